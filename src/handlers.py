@@ -0,0 +1,71 @@
+import asyncio
+from alpaca.common.exceptions import APIError
+from alpaca.trading.requests import MarketOrderRequest
+
+
+
+'''
+The bar and trade update handlers used by main.py, built by live_handlers() so the same code can be run against the
+live Alpaca streams or against history with the replay engine in replay.py:
+
+on_bar, trade_status = live_handlers(client, router, signal, SYMBOL, notional = NOTIONAL)
+bars.subscribe_daily_bars(on_bar, SYMBOL)
+trades.subscribe_trade_updates(trade_status)
+
+Its parameters are:
+client = TradingClient (or replay.SimulatedBroker) used to look up the position before selling. When there is no position
+         to sell (e.g. a duplicate sell signal, a manual close or a sell fill that has not come through yet) the sell is
+         skipped
+router = OrderRouter the orders are sent through
+signal = OnlineTiltedMean fed with the close of every bar
+notional = dollar amount of every buy. None spends all of the account's cash, like the backtests do
+log = function the decisions and acknowledgements are printed with, None to stay quiet (e.g. when replaying at speed)
+'''
+
+
+
+def market_order(symbol, side, **size):
+    return MarketOrderRequest(
+        symbol = symbol,
+        side = side,
+        time_in_force = 'day',
+        **size
+    )
+
+
+
+def live_handlers(client, router, signal, symbol, notional = 100, log = print):
+
+    # Every bar updates the signal in O(1) time and places an order if it says to buy or sell
+    async def on_bar(bar):
+        decision = signal.update(bar.close)
+        if log:
+            log(f"{bar.symbol} close {bar.close}  decision: {decision}  latency: {signal.last_latency_us:.1f} us")
+        if decision == 'buy':
+            amount = notional
+            if amount is None:
+                account = await asyncio.to_thread(client.get_account)
+                amount = float(account.cash)
+            report = await router.submit(market_order(symbol, 'buy', notional = amount))
+            if log:
+                log(f"Buy order acknowledged in {report['ack_latency_ms']:.1f} ms")
+        elif decision == 'sell':
+            try:
+                position = await asyncio.to_thread(client.get_open_position, symbol)
+            except APIError as e:
+                if e.status_code != 404:
+                    raise
+                if log:
+                    log(f"No {symbol} position to sell, skipping the sell")
+                return
+            report = await router.submit(market_order(symbol, 'sell', qty = position.qty))
+            if log:
+                log(f"Sell order acknowledged in {report['ack_latency_ms']:.1f} ms")
+
+    # Fills (and any other order updates) come through the trading stream
+    async def trade_status(data):
+        if log:
+            log(data)
+        await router.on_trade_update(data)
+
+    return on_bar, trade_status
@@ -1,12 +1,28 @@
 from config import ALPACA_KEY, ALPACA_SECRET_KEY
 #import config_example
+import threading
+from datetime import datetime, timedelta
 from alpaca.trading.client import TradingClient
-from alpaca.trading.requests import MarketOrderRequest
 from alpaca.trading.stream import TradingStream
+from alpaca.data.live import StockDataStream
+from alpaca.data.historical import StockHistoricalDataClient
+from alpaca.data.requests import StockBarsRequest
+from alpaca.data.timeframe import TimeFrame
+from online_signal import OnlineTiltedMean
+from order_router import OrderRouter
+from handlers import live_handlers
 
 
+# Strategy parameters, the same as MeanReversion.tilted_mean_reversion()
 
-client = TradingClient(ALPACA_KEY, ALPACA_SECRET_KEY)
+SYMBOL = "SPY"
+SCOPE = 30
+BUY_RANGE = 2
+SELL_RANGE = 2
+NOTIONAL = 100
+
+
+client = TradingClient(ALPACA_KEY, ALPACA_SECRET_KEY, paper = True)
 
 
 # account = dict(client.get_account())
@@ -15,19 +31,35 @@ client = TradingClient(ALPACA_KEY, ALPACA_SECRET_KEY)
 #     print(f"{k:30}{v})")
 
 
-order_details = MarketOrderRequest(
-    symbol = "SPY",
-    notional = 100,
-    side = 'buy',
-    time_in_force = 'day'
-)
+# Start with the position we already hold, and warm the signal up with the last SCOPE daily bars so it can trade straight away
 
-order = client.submit_order(order_details)
+try:
+    client.get_open_position(SYMBOL)
+    holding = True
+except Exception:
+    holding = False
+
+signal = OnlineTiltedMean(scope = SCOPE, buy_range = BUY_RANGE, sell_range = SELL_RANGE, position = holding)
+
+history = StockHistoricalDataClient(ALPACA_KEY, ALPACA_SECRET_KEY).get_stock_bars(StockBarsRequest(
+    symbol_or_symbols = SYMBOL,
+    timeframe = TimeFrame.Day,
+    start = datetime.now() - timedelta(days = 3 * SCOPE)
+))
+signal.warm_up([bar.close for bar in history[SYMBOL][-SCOPE:]])
 
-trades = TradingStream(ALPACA_KEY, ALPACA_SECRET_KEY, paper = True)
 
-async def trade_status(data):
-    print(data)
+# Orders are queued on the router and sent without blocking the bar handler. Every daily bar updates the signal in O(1)
+# time and places an order if it says to buy or sell, fills come through the trading stream (see handlers.py)
 
+router = OrderRouter(client)
+on_bar, trade_status = live_handlers(client, router, signal, SYMBOL, notional = NOTIONAL)
+
+
+trades = TradingStream(ALPACA_KEY, ALPACA_SECRET_KEY, paper = True)
 trades.subscribe_trade_updates(trade_status)
-trades.run()
\ No newline at end of file
+threading.Thread(target = trades.run, daemon = True).start()
+
+bars = StockDataStream(ALPACA_KEY, ALPACA_SECRET_KEY)
+bars.subscribe_daily_bars(on_bar, SYMBOL)
+bars.run()
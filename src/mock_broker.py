@@ -0,0 +1,160 @@
+import json
+import time
+import uuid
+import random
+import asyncio
+import inspect
+import threading
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+
+'''
+MockBroker() is a small local HTTP server that answers the Alpaca order endpoints, so the order router (and anything else
+that uses a TradingClient) can be run without a network connection or an Alpaca account:
+
+broker = MockBroker(latency = 0.01, error_rate = 0.1)
+client = TradingClient('key', 'secret', url_override = broker.start())
+
+Its parameters are:
+latency = seconds each request takes to answer
+error_rate = fraction of order submissions answered with error_status (e.g. 429 to test rate limit handling)
+errors = optional list of statuses the next order submissions are answered with, in order (e.g. [429, 503]), for tests
+         that need the errors to be the same every run
+fill_prices = optional {symbol : price} used to fill orders straight away. Every fill is passed as a trade update, in the
+              same shape TradingStream gives its handlers, to the handlers given to subscribe_trade_updates()
+
+Every order submission is recorded in broker.requests as (time.monotonic() it arrived, client_order_id, status answered).
+'''
+
+
+
+class MockBroker():
+
+    def __init__(self, host = '127.0.0.1', port = 0, latency = 0.0, error_rate = 0.0, error_status = 429, errors = None, fill_prices = None):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.errors = list(errors or [])
+        self.fill_prices = fill_prices
+        self.orders = {}
+        self.requests = []
+        self.subscribers = [] # (handler, event loop it was subscribed from or None)
+        self.lock = threading.Lock()
+        self.server = None
+
+
+    # Like TradingStream.subscribe_trade_updates(). Coroutine handlers (e.g. OrderRouter.on_trade_update) are run on the
+    # loop they were subscribed from, or on 'loop'
+    def subscribe_trade_updates(self, handler, loop = None):
+        if loop is None:
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                pass
+        self.subscribers.append((handler, loop))
+
+
+    def start(self) -> str:
+        broker = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args): # Keep the console quiet
+                pass
+
+            def _reply(self, status, body):
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self):
+                arrived = time.monotonic()
+                time.sleep(broker.latency)
+                body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+                if self.path.rstrip('/') != '/v2/orders':
+                    return self._reply(404, {'code' : 40410000, 'message' : 'not found'})
+                with broker.lock:
+                    error = broker.errors.pop(0) if broker.errors else broker.error_status if random.random() < broker.error_rate else None
+                if error is not None:
+                    broker.requests.append((arrived, body.get('client_order_id'), error))
+                    return self._reply(error, {'code' : error * 100000, 'message' : 'mock error'})
+                status, order = broker.new_order(body)
+                broker.requests.append((arrived, body.get('client_order_id'), status))
+                self._reply(status, order)
+
+            def do_GET(self):
+                time.sleep(broker.latency)
+                if self.path.startswith('/v2/orders:by_client_order_id'):
+                    client_order_id = self.path.split('client_order_id=')[-1].split('&')[0]
+                    order = broker.orders.get(client_order_id)
+                    if order is None:
+                        return self._reply(404, {'code' : 40410000, 'message' : 'order not found'})
+                    return self._reply(200, order)
+                self._reply(404, {'code' : 40410000, 'message' : 'not found'})
+
+        self.server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self.port = self.server.server_address[1]
+        threading.Thread(target = self.server.serve_forever, daemon = True).start()
+        return f"http://{self.host}:{self.port}"
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+
+    def new_order(self, body):
+        now = datetime.now(timezone.utc).isoformat()
+        client_order_id = body.get('client_order_id') or uuid.uuid4().hex
+        with self.lock:
+            if client_order_id in self.orders:
+                return 422, {'code' : 42210000, 'message' : 'client_order_id must be unique'}
+            order = {
+                'id' : str(uuid.uuid4()),
+                'client_order_id' : client_order_id,
+                'created_at' : now,
+                'updated_at' : now,
+                'submitted_at' : now,
+                'asset_id' : str(uuid.uuid5(uuid.NAMESPACE_DNS, body.get('symbol', ''))),
+                'symbol' : body.get('symbol'),
+                'asset_class' : 'us_equity',
+                'notional' : None if body.get('notional') is None else str(body['notional']),
+                'qty' : None if body.get('qty') is None else str(body['qty']),
+                'filled_qty' : '0',
+                'order_class' : 'simple',
+                'order_type' : body.get('type', 'market'),
+                'type' : body.get('type', 'market'),
+                'side' : body.get('side'),
+                'time_in_force' : body.get('time_in_force', 'day'),
+                'status' : 'accepted',
+                'extended_hours' : False,
+            }
+            self.orders[client_order_id] = order
+
+        if self.fill_prices and order['symbol'] in self.fill_prices:
+            self.fill(client_order_id, self.fill_prices[order['symbol']])
+        return 200, order
+
+
+    # Fills an order at 'price' and sends the trade update to every subscriber
+
+    def fill(self, client_order_id, price):
+        order = self.orders[client_order_id]
+        qty = float(order['qty']) if order['qty'] else float(order['notional']) / price
+        order.update({'status' : 'filled', 'filled_qty' : str(qty), 'filled_avg_price' : str(price), 'filled_at' : datetime.now(timezone.utc).isoformat()})
+        update = SimpleNamespace(event = 'fill', price = price, qty = qty, timestamp = order['filled_at'], order = SimpleNamespace(**order))
+        for handler, loop in self.subscribers:
+            result = handler(update)
+            if inspect.isawaitable(result): # Fills happen on the server's threads, so the coroutine is run on the handler's loop
+                if loop is None:
+                    asyncio.run(result)
+                else:
+                    asyncio.run_coroutine_threadsafe(result, loop)
@@ -0,0 +1,130 @@
+import os
+import sys
+import math
+import time
+try: # Windows whose standard deviation is this small relative to the price give no signal, as in the backtests
+    from strategy_formulation.strategy.rolling_regression import FLAT_TOLERANCE
+except ImportError: # When the package is not installed
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'strategy_development'))
+    from strategy_formulation.strategy.rolling_regression import FLAT_TOLERANCE
+
+
+
+'''
+OnlineTiltedMean() is the live version of the tilted mean reversion signal.
+
+Running tilted_mean() on every new bar would refit a regression over the last 'scope' prices each time. Instead this
+class keeps the last 'scope' prices in a ring buffer together with running sums of y, x*y and y^2 (x = 0 ... scope - 1
+is the position inside the window). When a bar arrives the oldest price drops out, every remaining price moves one
+place to the left and the new price goes in at x = scope - 1, which only needs a few additions:
+sum_y  -> sum_y - oldest + new
+sum_xy -> sum_xy - (sum_y - oldest) + (scope - 1) * new
+sum_yy -> sum_yy - oldest^2 + new^2
+so the slope, intercept and residual standard deviation are updated in O(1) time and fixed memory.
+
+update(price) should be called with the closing price of every bar. It returns 'buy', 'sell' or None using the same
+rules as MeanReversion.tilted_mean_reversion():
+1. If we hold a position and the price is more than sell_range standard deviations above the regression line => 'sell'
+2. If we do not hold a position and the price is more than buy_range standard deviations below it => 'buy'
+Just like the backtest, the order is filled on the following bar. The time taken by the last update is stored in
+last_latency_us (microseconds).
+'''
+
+
+
+class OnlineTiltedMean():
+
+    def __init__(self, scope = 30, buy_range = 2, sell_range = 2, position = False, resync_every = 1000):
+        if scope < 2:
+            raise ValueError(f"scope must be at least 2 to fit a regression line, got {scope}")
+        self.scope = scope
+        self.buy_range = buy_range
+        self.sell_range = sell_range
+        self.position = position
+        self.no_of_trades = 0
+        self.resync_every = resync_every # Recompute the sums from the buffer every so often to stop rounding errors building up
+
+        self.buffer = [0.0] * scope
+        self.head = 0 # Index of the oldest price in the buffer
+        self.count = 0
+        self.offset = None # Prices are stored relative to the first price to keep the sums small
+        self.sum_y, self.sum_xy, self.sum_yy = 0.0, 0.0, 0.0
+
+        self.slope, self.intercept, self.endpoint, self.stddev = math.nan, math.nan, math.nan, math.nan
+        self.last_latency_us = 0.0
+
+        m = scope
+        self._sum_x = m * (m - 1) / 2
+        self._sxx = m * (m * m - 1) / 12 # sum of (x - mean(x))^2
+
+
+    # Feeds in a list of historical closing prices without making any decisions, so the signal is ready straight away
+
+    def warm_up(self, prices):
+        for price in prices:
+            self._add(price)
+
+
+    def _add(self, price):
+        y = float(price)
+        if self.offset is None:
+            self.offset = y
+        y -= self.offset
+        m = self.scope
+
+        if self.count < m: # Still filling the window
+            self.buffer[self.count] = y
+            self.sum_xy += self.count * y
+            self.sum_y += y
+            self.sum_yy += y * y
+        else:
+            oldest = self.buffer[self.head]
+            self.buffer[self.head] = y
+            self.head = (self.head + 1) % m
+            self.sum_y -= oldest
+            self.sum_xy += (m - 1) * y - self.sum_y
+            self.sum_y += y
+            self.sum_yy += y * y - oldest * oldest
+        self.count += 1
+
+        if self.count % self.resync_every == 0:
+            self._resync()
+        if self.count >= m:
+            self._fit()
+
+    def _resync(self):
+        window = self.buffer[self.head:] + self.buffer[:self.head] # Oldest to newest
+        self.sum_y = math.fsum(window)
+        self.sum_xy = math.fsum(x * y for x, y in enumerate(window))
+        self.sum_yy = math.fsum(y * y for y in window)
+
+    def _fit(self):
+        m = self.scope
+        sxy = self.sum_xy - self._sum_x * self.sum_y / m
+        syy = self.sum_yy - self.sum_y * self.sum_y / m
+        self.slope = sxy / self._sxx
+        intercept = (self.sum_y - self.slope * self._sum_x) / m
+        self.intercept = intercept + self.offset
+        self.endpoint = intercept + self.slope * (m - 1) + self.offset # What you would expect the current price to be based off of trends
+        self.stddev = math.sqrt(max(syy - self.slope * sxy, 0) / (m - 1))
+
+
+    def update(self, price):
+        start = time.perf_counter_ns()
+        self._add(price)
+
+        decision = None
+        if self.count >= self.scope and self.stddev > FLAT_TOLERANCE * abs(self.endpoint): # Flat windows give no signal, like threshold_signals()
+            price = float(price)
+            # If we go above n std above the linear model line => sell
+            if self.position and price > self.endpoint + self.sell_range * self.stddev:
+                self.position = False
+                decision = 'sell'
+            # if we are not in the market and the price is below n std below the linear model line -> buy
+            if not self.position and price < self.endpoint - self.buy_range * self.stddev:
+                self.position = True
+                self.no_of_trades += 1
+                decision = 'buy' if decision is None else None # A sell and buy on the same bar cancel out
+
+        self.last_latency_us = (time.perf_counter_ns() - start) / 1000
+        return decision
@@ -0,0 +1,228 @@
+import time
+import uuid
+import random
+import asyncio
+from alpaca.common.exceptions import APIError
+
+
+
+'''
+OrderRouter() sends the orders generated by the strategy to Alpaca without blocking the event loop.
+
+client.submit_order() is a blocking HTTP call, so submitting one order at a time means the last ticker to signal at
+the open waits for every order before it. The router instead puts every MarketOrderRequest on a queue and has
+'max_concurrency' workers submit them at the same time. Its parameters are:
+client = TradingClient used to submit the orders. Its requests session (and so its connections) is shared by every worker.
+         Pass TradingClient(..., url_override = MockBroker().start()) to run against the local mock broker in mock_broker.py
+max_concurrency = number of orders that can be in flight at once
+rate_limit, per = at most 'rate_limit' requests are sent every 'per' seconds (Alpaca allows 200 a minute)
+max_retries, backoff = rate limited (429), server (5xx) and connection errors are retried up to max_retries times,
+                       waiting backoff * 2^attempt seconds (plus some jitter) between attempts
+
+Every order is given a client_order_id, so a retry after a lost response looks the order up instead of submitting it
+twice. Pass on_trade_update to TradingStream.subscribe_trade_updates() to match fills back to the orders that were sent.
+self.reports holds one entry per order, including the submit to acknowledgement latency in milliseconds.
+'''
+
+
+
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+
+
+# Token bucket. Each request takes a token and the bucket refills at rate_limit / per tokens a second
+
+class RateLimiter():
+
+    def __init__(self, rate_limit = 200, per = 60.0):
+        self.capacity = rate_limit
+        self.tokens = float(rate_limit)
+        self.refill_rate = rate_limit / per
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.refill_rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.refill_rate)
+
+
+
+# The client's own 429 retry sleeps for seconds while holding a worker, so the router retries instead. alpaca-py (checked
+# against 0.15.0) has no public setting for it: TradingClient does not pass retry_attempts on to RESTClient, which ignores
+# retry_attempts = 0 anyway, and no environment variable is read. So the private _retry count is set, but only when the
+# client has one. Other clients (e.g. replay.SimulatedBroker) and SDK versions without it are left alone
+
+def disable_client_retries(client):
+    if isinstance(getattr(client, '_retry', None), int):
+        client._retry = 0
+
+
+
+class OrderRouter():
+
+    def __init__(self, client, max_concurrency = 8, rate_limit = 200, per = 60.0, max_retries = 3, backoff = 0.5):
+        self.client = client
+        disable_client_retries(client)
+        self.max_concurrency = max_concurrency
+        self.limiter = RateLimiter(rate_limit, per)
+        self.max_retries = max_retries
+        self.backoff = backoff
+
+        self.loop = None
+        self.queue = None
+        self.workers = []
+        self.reports = {} # client_order_id -> report dictionary
+        self.fills = {} # client_order_id -> future that completes when the order is filled, canceled or rejected
+
+
+    def _start(self):
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue()
+        self.workers = [self.loop.create_task(self._worker()) for _ in range(self.max_concurrency)]
+
+
+    # Queues an order and returns a future with its report once the broker has acknowledged it
+
+    def enqueue(self, order_request) -> asyncio.Future:
+        if self.loop is None:
+            self._start()
+        if order_request.client_order_id is None:
+            order_request.client_order_id = uuid.uuid4().hex
+
+        key = order_request.client_order_id
+        self.reports[key] = {
+            'client_order_id' : key,
+            'symbol' : order_request.symbol,
+            'side' : order_request.side,
+            'queued_at' : time.perf_counter(),
+            'attempts' : 0,
+            'status' : 'queued',
+        }
+        acknowledged = self.loop.create_future()
+        self.fills.setdefault(key, self.loop.create_future())
+        self.queue.put_nowait((order_request, acknowledged))
+        return acknowledged
+
+    async def submit(self, order_request) -> dict:
+        return await self.enqueue(order_request)
+
+    async def submit_many(self, order_requests) -> list:
+        return await asyncio.gather(*(self.enqueue(order) for order in order_requests), return_exceptions = True)
+
+    # Waits until the trade stream reports the order as filled (or canceled / rejected)
+    async def wait_for_fill(self, client_order_id, timeout = None) -> dict:
+        await asyncio.wait_for(asyncio.shield(self.fills[client_order_id]), timeout)
+        return self.reports[client_order_id]
+
+
+    async def _worker(self):
+        while True:
+            order_request, acknowledged = await self.queue.get()
+            try:
+                report = await self._send(order_request)
+                if not acknowledged.done():
+                    acknowledged.set_result(report)
+            except Exception as e:
+                if not acknowledged.done():
+                    acknowledged.set_exception(e)
+            finally:
+                self.queue.task_done()
+
+    async def _send(self, order_request):
+        report = self.reports[order_request.client_order_id]
+        for attempt in range(self.max_retries + 1):
+            await self.limiter.acquire()
+            report['attempts'] += 1
+            start = time.perf_counter()
+            try:
+                if attempt == 0:
+                    order = await asyncio.to_thread(self.client.submit_order, order_request)
+                else: # The last attempt may have reached the broker even though we did not get a response
+                    order = await asyncio.to_thread(self._resubmit, order_request)
+                acked = time.perf_counter()
+                if 'events' not in report: # The trade stream can report the fill before the submission is acknowledged
+                    report['status'] = str(order.status.value if hasattr(order.status, 'value') else order.status)
+                report.update({
+                    'order_id' : str(order.id),
+                    'submitted_at' : start,
+                    'acked_at' : acked,
+                    'ack_latency_ms' : (acked - start) * 1000,
+                    'queue_latency_ms' : (start - report['queued_at']) * 1000,
+                })
+                return report
+
+            except APIError as e:
+                if e.status_code not in RETRY_STATUS_CODES or attempt == self.max_retries:
+                    report['status'] = 'failed'
+                    report['error'] = str(e)
+                    raise
+            except (ConnectionError, OSError, TimeoutError) as e:
+                if attempt == self.max_retries:
+                    report['status'] = 'failed'
+                    report['error'] = str(e)
+                    raise
+            except Exception as e: # requests' connection errors do not all inherit from ConnectionError
+                if type(e).__module__.split('.')[0] != 'requests' or attempt == self.max_retries:
+                    report['status'] = 'failed'
+                    report['error'] = str(e)
+                    raise
+
+            await asyncio.sleep(self.backoff * 2 ** attempt * (1 + random.random() / 2))
+
+    def _resubmit(self, order_request):
+        try:
+            return self.client.get_order_by_client_id(order_request.client_order_id)
+        except APIError as e:
+            if e.status_code != 404:
+                raise
+        return self.client.submit_order(order_request)
+
+
+    # Handler for TradingStream.subscribe_trade_updates(). It can be called from the trade stream's own thread and loop
+
+    async def on_trade_update(self, data):
+        if self.loop is None:
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self.loop:
+            self._reconcile(data)
+        else:
+            self.loop.call_soon_threadsafe(self._reconcile, data)
+
+    def _reconcile(self, data):
+        key = data.order.client_order_id
+        report = self.reports.get(key)
+        if report is None: # Not one of our orders
+            return
+        event = str(data.event.value if hasattr(data.event, 'value') else data.event)
+        report['status'] = event
+        report.setdefault('events', []).append((event, time.perf_counter()))
+        if event in ('fill', 'canceled', 'rejected', 'expired'):
+            report['filled_qty'] = getattr(data.order, 'filled_qty', None)
+            report['filled_avg_price'] = getattr(data.order, 'filled_avg_price', None)
+            report['done_at'] = time.perf_counter()
+            fill = self.fills.setdefault(key, self.loop.create_future())
+            if not fill.done():
+                fill.set_result(event)
+
+
+    # Waits for every queued order to be sent, then stops the workers
+
+    async def close(self):
+        if self.loop is None:
+            return
+        await self.queue.join()
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions = True)
+        self.loop, self.queue, self.workers = None, None, []
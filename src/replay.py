@@ -0,0 +1,341 @@
+import os
+import sys
+import json
+import time
+import uuid
+import asyncio
+import inspect
+import threading
+from types import SimpleNamespace
+import numpy as np
+import pandas as pd
+from alpaca.common.exceptions import APIError
+
+
+
+'''
+Replays stored bars through the live trading code, so the handlers in main.py can be run over history at speed.
+
+BarReplay(bars, broker, speed) stands in for StockDataStream. Handlers are subscribed the same way
+(subscribe_bars / subscribe_daily_bars(handler, *symbols)) and are awaited with one bar object at a time, which has the
+same attributes as Alpaca's Bar (symbol, timestamp, open, high, low, close, volume). Its parameters are:
+bars = {symbol : prices} where prices is a pandas Series of closes or a DataFrame with Open, High, Low, Close and Volume
+       columns (e.g. StockInfo data), indexed by date. A DataFrame of closes with one column per symbol also works
+broker = optional SimulatedBroker that fills the orders placed by the handlers
+speed = None replays as fast as possible, 1 in real time (the gaps between the bar timestamps), N is N times real time
+
+SimulatedBroker(cash) stands in for both the TradingClient and the TradingStream. It answers submit_order(),
+get_order_by_client_id(), get_open_position() and get_account(), so it can be passed to OrderRouter and live_handlers()
+in place of the client, and sends fills to the functions given to subscribe_trade_updates() in the same shape
+TradingStream gives its handlers. A market order placed while handling a bar is filled on the symbol's next bar, at its
+close (fill = 'close', the same convention as the vectorised backtests) or at its open (fill = 'open').
+
+broker = SimulatedBroker(cash = 100)
+router = OrderRouter(broker, rate_limit = 10 ** 9)
+on_bar, trade_status = live_handlers(broker, router, OnlineTiltedMean(), 'SPY', notional = None, log = None)
+replay = BarReplay({'SPY' : prices}, broker)
+replay.subscribe_daily_bars(on_bar, 'SPY')
+broker.subscribe_trade_updates(trade_status)
+replay.run()
+replay.summary()    # Bars and orders a second, and the bar to order latency of every order
+
+replay_parity() does all of this for the tilted mean reversion signal and checks the equity of the simulated account
+against backtest() on the same prices.
+'''
+
+
+
+# A position or order that does not exist is answered with a 404 like the Alpaca API
+
+def _not_found(message):
+    return APIError(json.dumps({'code' : 40410000, 'message' : message}), SimpleNamespace(response = SimpleNamespace(status_code = 404), request = None))
+
+def _forbidden(message):
+    return APIError(json.dumps({'code' : 40310000, 'message' : message}), SimpleNamespace(response = SimpleNamespace(status_code = 403), request = None))
+
+def _value(x):
+    return str(x.value if hasattr(x, 'value') else x) # Enums (OrderSide.BUY) or plain strings ('buy')
+
+
+
+class SimulatedBroker():
+
+    def __init__(self, cash = 100_000.0, fill = 'close'):
+        if fill not in ('close', 'open'):
+            raise ValueError(f"fill must be 'close' or 'open', got {fill!r}")
+        self.cash = float(cash)
+        self.fill_at = fill
+        self.positions = {} # symbol -> qty
+        self.prices = {} # symbol -> last close
+        self.orders = {} # client_order_id -> order dictionary
+        self.pending = {} # symbol -> client_order_ids waiting for the next bar
+        self.subscribers = []
+        self.history = [] # (timestamp, equity) after every bar
+        self.latencies_us = [] # Bar dispatch to order submission of every order
+        self.bar_dispatched_at = None
+        self.lock = threading.Lock() # OrderRouter submits from worker threads
+
+
+    '''
+        TradingClient
+    '''
+
+    def submit_order(self, order_data):
+        received = time.perf_counter()
+        symbol = order_data.symbol
+        side = _value(order_data.side)
+        qty = None if order_data.qty is None else float(order_data.qty)
+        notional = None if getattr(order_data, 'notional', None) is None else float(order_data.notional)
+        client_order_id = order_data.client_order_id or uuid.uuid4().hex
+
+        with self.lock:
+            if client_order_id in self.orders:
+                raise APIError(json.dumps({'code' : 42210000, 'message' : 'client_order_id must be unique'}), SimpleNamespace(response = SimpleNamespace(status_code = 422), request = None))
+            if side == 'sell' and qty is not None and qty > self.positions.get(symbol, 0.0) + 1e-9:
+                raise _forbidden(f"insufficient qty available for order (requested: {qty}, available: {self.positions.get(symbol, 0.0)})")
+            if side == 'buy' and notional is not None and notional > self.cash + 1e-9:
+                raise _forbidden('insufficient buying power')
+
+            order = {
+                'id' : str(uuid.uuid4()),
+                'client_order_id' : client_order_id,
+                'symbol' : symbol,
+                'side' : side,
+                'type' : 'market',
+                'time_in_force' : _value(getattr(order_data, 'time_in_force', 'day')),
+                'qty' : None if qty is None else str(qty),
+                'notional' : None if notional is None else str(notional),
+                'filled_qty' : '0',
+                'filled_avg_price' : None,
+                'status' : 'accepted',
+            }
+            self.orders[client_order_id] = order
+            self.pending.setdefault(symbol, []).append(client_order_id)
+            if self.bar_dispatched_at is not None:
+                self.latencies_us.append((received - self.bar_dispatched_at) * 1e6)
+        return SimpleNamespace(**order)
+
+    def get_order_by_client_id(self, client_id):
+        order = self.orders.get(client_id)
+        if order is None:
+            raise _not_found('order not found')
+        return SimpleNamespace(**order)
+
+    def get_open_position(self, symbol_or_asset_id):
+        qty = self.positions.get(symbol_or_asset_id, 0.0)
+        if qty <= 0:
+            raise _not_found('position does not exist')
+        price = self.prices[symbol_or_asset_id]
+        return SimpleNamespace(symbol = symbol_or_asset_id, qty = str(qty), side = 'long', current_price = str(price), market_value = str(qty * price))
+
+    def get_account(self):
+        equity = self.equity()
+        return SimpleNamespace(cash = str(self.cash), equity = str(equity), buying_power = str(self.cash), portfolio_value = str(equity))
+
+    def equity(self):
+        return self.cash + sum(qty * self.prices.get(symbol, 0.0) for symbol, qty in self.positions.items())
+
+
+    '''
+        TradingStream
+    '''
+
+    def subscribe_trade_updates(self, handler):
+        self.subscribers.append(handler)
+
+
+    # Fills the orders waiting for this bar's symbol and returns their trade updates
+    def _on_bar(self, bar):
+        price = bar.close if self.fill_at == 'close' else bar.open
+        updates = []
+        with self.lock:
+            for client_order_id in self.pending.pop(bar.symbol, []):
+                order = self.orders[client_order_id]
+                held = self.positions.get(bar.symbol, 0.0)
+                if order['side'] == 'buy':
+                    qty = float(order['qty']) if order['qty'] else float(order['notional']) / price
+                    self.cash -= qty * price
+                    self.positions[bar.symbol] = held + qty
+                else:
+                    qty = min(float(order['qty']), held)
+                    self.cash += qty * price
+                    self.positions[bar.symbol] = held - qty
+                order.update({'status' : 'filled', 'filled_qty' : str(qty), 'filled_avg_price' : str(price), 'filled_at' : bar.timestamp})
+                updates.append(SimpleNamespace(event = 'fill', price = price, qty = qty, timestamp = bar.timestamp, order = SimpleNamespace(**order)))
+            self.prices[bar.symbol] = bar.close
+        return updates
+
+
+
+# Turns the stored prices into a list of bars in time order (bars with the same timestamp keep the order of the symbols)
+
+def _to_bars(bars):
+    if isinstance(bars, pd.DataFrame):
+        bars = {symbol : bars[symbol] for symbol in bars.columns}
+
+    columns = []
+    for symbol, prices in bars.items():
+        if isinstance(prices, pd.DataFrame):
+            fields = {name.lower() : prices[name] for name in prices.columns}
+            close = fields.get('close', fields.get('adj close', prices.iloc[:, 0]))
+        else:
+            fields, close = {}, prices
+        close = close.dropna()
+        index = close.index
+        def field(name, default):
+            return fields[name].reindex(index).to_numpy(dtype = np.float64) if name in fields else default
+        close_values = close.to_numpy(dtype = np.float64)
+        columns.append((symbol, index, close_values, field('open', close_values), field('high', close_values), field('low', close_values), field('volume', np.zeros(len(index)))))
+
+    timestamps = np.concatenate([pd.DatetimeIndex(column[1]).asi8 for column in columns]) if columns else np.empty(0, dtype = np.int64)
+    order = np.argsort(timestamps, kind = 'stable')
+    output = []
+    for symbol, index, close, open_, high, low, volume in columns:
+        for i, timestamp in enumerate(index):
+            output.append(SimpleNamespace(symbol = symbol, timestamp = timestamp, open = open_[i], high = high[i], low = low[i], close = close[i], volume = volume[i]))
+    return [output[i] for i in order]
+
+
+
+class BarReplay():
+
+    def __init__(self, bars, broker = None, speed = None):
+        if speed is not None and speed <= 0:
+            raise ValueError(f"speed must be positive (or None for as fast as possible), got {speed}")
+        self.bars = _to_bars(bars)
+        self.broker = broker
+        self.speed = speed
+        self.handlers = {} # symbol -> handlers, '*' for every symbol
+        self.stats = {}
+        self._running = False
+
+
+    def subscribe_bars(self, handler, *symbols):
+        for symbol in symbols or ('*',):
+            self.handlers.setdefault(symbol, []).append(handler)
+
+    subscribe_daily_bars = subscribe_bars
+    subscribe_updated_bars = subscribe_bars
+
+
+    async def _dispatch(self, handlers, data):
+        for handler in handlers:
+            result = handler(data)
+            if inspect.isawaitable(result):
+                await result
+
+
+    # Sends every bar to its handlers, waiting for them before sending the next one
+    async def replay(self):
+        self._running = True
+        broker = self.broker
+        first = self.bars[0].timestamp if self.bars else None
+        start = time.perf_counter()
+        dispatched = 0
+        for bar in self.bars:
+            if not self._running:
+                break
+            if self.speed is not None: # Wait until this bar's time comes round, relative to the first bar
+                delay = start + (bar.timestamp - first).total_seconds() / self.speed - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+
+            if broker is not None:
+                updates = broker._on_bar(bar)
+                for update in updates:
+                    await self._dispatch(broker.subscribers, update)
+                broker.history.append((bar.timestamp, broker.equity()))
+                broker.bar_dispatched_at = time.perf_counter()
+            await self._dispatch(self.handlers.get(bar.symbol, []) + self.handlers.get('*', []), bar)
+            await asyncio.sleep(0) # Lets tasks started by the handlers (e.g. the order router's workers) run
+            dispatched += 1
+
+        elapsed = time.perf_counter() - start
+        self._running = False
+        self.stats = {'bars' : dispatched, 'elapsed_s' : elapsed, 'bars_per_second' : dispatched / elapsed if elapsed else float('inf')}
+        return self.stats
+
+    # Blocks until every bar has been replayed, like StockDataStream.run()
+    def run(self):
+        return asyncio.run(self.replay())
+
+    def stop(self):
+        self._running = False
+
+
+    # Throughput of the last replay and the latency from a bar reaching the handlers to its order reaching the broker
+    def summary(self):
+        summary = dict(self.stats)
+        if self.broker is not None:
+            latencies = np.asarray(self.broker.latencies_us)
+            summary['orders'] = len(self.broker.orders)
+            summary['fills'] = sum(order['status'] == 'filled' for order in self.broker.orders.values())
+            if summary.get('elapsed_s'):
+                summary['orders_per_second'] = summary['orders'] / summary['elapsed_s']
+            for q in (50, 90, 99):
+                summary[f'bar_to_order_p{q}_us'] = float(np.percentile(latencies, q)) if len(latencies) else float('nan')
+            summary['final_equity'] = float(self.broker.equity())
+        return summary
+
+
+
+# Runs OnlineTiltedMean through the live handlers, the order router and the simulated broker over 'prices' (a Series of
+# closes), and backtest() on the same prices. Every buy spends all of the cash, so both should end with the same equity
+# on every bar. Returns the replay's summary along with the final values, trade counts and largest equity difference
+
+def replay_parity(prices, scope = 30, buy_range = 2, sell_range = 2, investment = 100, symbol = 'SPY', speed = None, rtol = 1e-9):
+    from online_signal import OnlineTiltedMean
+    from order_router import OrderRouter
+    from handlers import live_handlers
+    try:
+        from strategy_formulation.strategy.rolling_regression import RollingStats, threshold_signals
+        from strategy_formulation.research.stock_info.backtest import backtest
+    except ImportError: # When the package is not installed
+        sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'strategy_development'))
+        from strategy_formulation.strategy.rolling_regression import RollingStats, threshold_signals
+        from strategy_formulation.research.stock_info.backtest import backtest
+
+    prices = prices.iloc[:, 0] if isinstance(prices, pd.DataFrame) else prices
+    prices = prices.dropna()
+
+    broker = SimulatedBroker(cash = investment)
+    signal = OnlineTiltedMean(scope = scope, buy_range = buy_range, sell_range = sell_range)
+    replay = BarReplay({symbol : prices}, broker, speed = speed)
+
+    async def run():
+        router = OrderRouter(broker, rate_limit = 10 ** 9) # Orders are not rate limited on history
+        on_bar, trade_status = live_handlers(broker, router, signal, symbol, notional = None, log = None)
+        replay.subscribe_daily_bars(on_bar, symbol)
+        broker.subscribe_trade_updates(trade_status)
+        await replay.replay()
+        await router.close()
+    asyncio.run(run())
+
+    # The same signals as MeanReversion.tilted_mean_reversion(), decided on one bar and traded on the next
+    values = prices.to_numpy(dtype = np.float64)
+    buy_signal, sell_signal = threshold_signals(values, RollingStats(values).regression(scope), buy_range = buy_range, sell_range = sell_range)
+    entries = np.zeros(len(values), dtype = bool)
+    exits = np.zeros(len(values), dtype = bool)
+    entries[1:] = buy_signal[:-1]
+    exits[1:] = sell_signal[:-1]
+    results = backtest(values, entries, exits, start = scope, investment = investment)
+
+    # The backtest's equity is 0 on the bars it is out of the market, so the curves are compared on the other bars
+    replay_equity = np.array([equity for _, equity in broker.history[scope:]])
+    backtest_equity = results['strat_array_returns'][1:]
+    if len(replay_equity) == len(backtest_equity):
+        in_market = backtest_equity != 0
+        difference = np.abs(np.append(replay_equity[in_market] - backtest_equity[in_market], broker.equity() - results['strat_returns']))
+    else:
+        difference = np.array([np.inf])
+
+    summary = replay.summary()
+    summary.update({
+        'replay_value' : float(broker.equity()),
+        'backtest_value' : results['strat_returns'],
+        'replay_trades' : sum(order['side'] == 'buy' and order['status'] == 'filled' for order in broker.orders.values()),
+        'backtest_trades' : results['no_of_trades'],
+        'max_equity_difference' : float(difference.max()),
+        'parity' : bool(np.all(difference <= rtol * max(np.abs(replay_equity).max(initial = 0), abs(investment), 1))),
+    })
+    return summary
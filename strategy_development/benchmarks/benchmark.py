@@ -0,0 +1,339 @@
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from strategy_formulation.strategy.tilted_mean_reversion_strategy import MeanReversion, tilted_mean
+from strategy_formulation.research.stock_info.backtest import backtest
+from strategy_formulation.research.stock_info.universe import StockUniverse
+from strategy_formulation.research.stock_info.result_cache import ResultCache, set_default_result_cache
+from strategy_analysis.performance.performance_function import performance_analysis, panel_performance_analysis
+import gc
+import json
+import time
+import argparse
+import platform
+import subprocess
+import tracemalloc
+from datetime import datetime
+import numpy as np
+import pandas as pd
+
+
+
+'''
+Benchmarks for the backtest, data and metrics hot paths.
+
+Every case runs on deterministic synthetic prices (a seeded random walk), so nothing is downloaded and the numbers from
+two runs are comparable. Each case is timed 'repeats' times after a warm up call (which also compiles the Numba kernels)
+and is then run once more under tracemalloc to record its peak memory. For every case and set of parameters we record:
+wall_time = the fastest run in seconds (wall_time_median is the median)
+peak_memory = peak memory allocated by Python and NumPy during the run in bytes
+bars_per_second = the number of price bars processed (bars x tickers) divided by wall_time
+
+Every run is appended to a JSON history file together with the git commit and library versions. compare() matches two
+runs case by case and flags any case that became more than 'threshold' slower (or used more memory), so each
+performance change can be checked against the run before it:
+
+python benchmark.py run --quick              # Smaller grid, about a minute
+python benchmark.py run --label my-change
+python benchmark.py compare --baseline -2 --current -1
+python benchmark.py run --cases startup   # Import time of the engine in a new process
+
+compare exits with status 1 if it finds a regression.
+'''
+
+
+
+HISTORY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'history.json')
+
+RELEVANT_METRICS = ['B&H % increase', 'Strat risk-adj % increase', 'No. of trades', 'Win / Loss Ratio']
+
+# The repeats would otherwise be served from the result cache (when STOCK_INFO_RESULT_CACHE=1), so only the first run would
+# be timed
+set_default_result_cache(ResultCache(enabled = False))
+
+
+
+'''
+    Synthetic price fixtures
+'''
+
+
+# Geometric random walk of n_bars minute bars for each ticker. The same seed always gives the same prices
+
+def synthetic_prices(n_bars, n_tickers = 1, seed = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    returns = rng.normal(0.0002, 0.015, size = (n_bars, n_tickers))
+    prices = 50 * np.exp(np.cumsum(returns, axis = 0))
+    index = pd.date_range('2000-01-03 09:30', periods = n_bars, freq = 'min')
+    return pd.DataFrame(prices, index = index, columns = [f"SYN{j}" for j in range(n_tickers)])
+
+def synthetic_stock(n_bars, seed = 0) -> MeanReversion:
+    return MeanReversion.from_data('SYN0', synthetic_prices(n_bars, seed = seed))
+
+def synthetic_universe(n_bars, n_tickers, seed = 0) -> StockUniverse:
+    prices = synthetic_prices(n_bars, n_tickers, seed = seed)
+    fetcher = lambda tickers, **kwargs : prices[list(tickers)]
+    return StockUniverse(list(prices.columns), fetcher = fetcher)
+
+# Splits the dates into 'n' back to back periods, like the decades used by performance_analysis
+def synthetic_periods(dates, n = 4, investment = 100):
+    edges = np.linspace(0, len(dates) - 1, n + 1).astype(int)
+    return [[str(dates[edges[i] + (i > 0)]), str(dates[edges[i + 1]]), investment] for i in range(n)]
+
+
+
+'''
+    Benchmark cases
+
+    Each case takes its parameters and returns (run, bars) where run() is the code to time and bars is the number of
+    price bars it processes. Setting up the fixtures is not timed.
+'''
+
+
+CASES = {}
+
+def case(name):
+    def register(function):
+        CASES[name] = function
+        return function
+    return register
+
+
+# The old way of generating signals: one regression per bar
+@case('tilted_mean')
+def bench_tilted_mean(n_bars, scope):
+    prices = synthetic_prices(n_bars).iloc[:, 0].to_numpy()
+    def run():
+        for i in range(scope, n_bars):
+            tilted_mean(prices[i - scope : i], scope, 2, check = 'buy')
+    return run, n_bars - scope
+
+@case('tilted_mean_reversion')
+def bench_tilted_mean_reversion(n_bars, scope):
+    stock = synthetic_stock(n_bars)
+    return lambda : stock.tilted_mean_reversion(None, scope = scope, graph = False, analysis = False), n_bars
+
+@case('buy_and_hold')
+def bench_buy_and_hold(n_bars, scope):
+    stock = synthetic_stock(n_bars)
+    return lambda : stock.buy_and_hold(None, scope = scope, graph = False, analysis = False), n_bars
+
+@case('strategy_template')
+def bench_strategy_template(n_bars, scope):
+    stock = synthetic_stock(n_bars)
+    prices = stock.data.iloc[:, 0].to_numpy()
+    results = backtest(prices, np.zeros(n_bars, dtype = bool), np.zeros(n_bars, dtype = bool), start = scope, investment = 100)
+    return lambda : stock.strategy_template(results, scope, graph = False, analysis = False), n_bars
+
+@case('performance_analysis')
+def bench_performance_analysis(n_bars, scope, n_tickers):
+    universe = synthetic_universe(n_bars, n_tickers)
+    periods = synthetic_periods(universe.dates)
+    return lambda : performance_analysis(periods, None, RELEVANT_METRICS, scope = scope, universe = universe), n_bars * n_tickers
+
+@case('panel_performance_analysis')
+def bench_panel_performance_analysis(n_bars, scope, n_tickers):
+    universe = synthetic_universe(n_bars, n_tickers)
+    periods = synthetic_periods(universe.dates)
+    return lambda : panel_performance_analysis(periods, None, RELEVANT_METRICS, scope = scope, universe = universe), n_bars * n_tickers
+
+
+
+# Time for a new Python process to import a module, which every process pool worker and command line call pays before
+# doing any work. The engine (signals and backtests) only needs NumPy, so it should stay well under 200 ms
+STARTUP_MODULES = [
+    'strategy_formulation.strategy.panel_backtest',
+    'strategy_formulation.strategy.tilted_mean_reversion_strategy',
+    'strategy_analysis.performance.parameter_sweep',
+]
+
+@case('startup')
+def bench_startup(module):
+    root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+    env = dict(os.environ, PYTHONPATH = os.pathsep.join([root] + ([os.environ['PYTHONPATH']] if os.environ.get('PYTHONPATH') else [])))
+    return lambda : subprocess.run([sys.executable, '-c', f"import {module}"], env = env, check = True), 1
+
+
+
+# Parameters for every case. The quick grid leaves out the largest (slowest) sizes
+
+def parameter_grid(quick = False):
+    sizes = [1_000, 10_000] if quick else [1_000, 10_000, 100_000]
+    scopes = [30] if quick else [30, 252]
+    ticker_counts = [1, 10] if quick else [1, 10, 50]
+    single = [{'n_bars' : n, 'scope' : scope} for n in sizes for scope in scopes]
+    panel = [{'n_bars' : 2_520, 'scope' : scope, 'n_tickers' : t} for t in ticker_counts for scope in scopes] # 10 years of days
+    return {
+        'tilted_mean'                   : single,
+        'tilted_mean_reversion'         : single,
+        'buy_and_hold'                  : single,
+        'strategy_template'             : single,
+        'performance_analysis'          : panel,
+        'panel_performance_analysis'    : panel,
+        'startup'                       : [{'module' : module} for module in STARTUP_MODULES],
+    }
+
+
+
+'''
+    Running and recording benchmarks
+'''
+
+
+def measure(run, bars, repeats = 3):
+    run() # Warm up
+    times = []
+    for _ in range(repeats):
+        gc.collect()
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+
+    gc.collect()
+    tracemalloc.start()
+    run()
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    wall_time = min(times)
+    return {
+        'wall_time'         : wall_time,
+        'wall_time_median'  : float(np.median(times)),
+        'peak_memory'       : peak_memory,
+        'bars'              : bars,
+        'bars_per_second'   : bars / wall_time if wall_time else float('inf'),
+    }
+
+
+def run_benchmarks(cases = None, quick = False, repeats = 3, verbose = True) -> list:
+    grid = parameter_grid(quick)
+    results = []
+    for name in cases or grid:
+        for params in grid[name]:
+            run, bars = CASES[name](**params)
+            result = {'case' : name, 'params' : params, **measure(run, bars, repeats = repeats)}
+            results.append(result)
+            if verbose:
+                print(f"{name:28}{params_key(params):40}{result['wall_time'] * 1000:12.2f} ms{result['peak_memory'] / 2 ** 20:10.2f} MiB{result['bars_per_second']:14,.0f} bars/s")
+    return results
+
+
+def params_key(params):
+    return ', '.join(f"{key}={value}" for key, value in sorted(params.items()))
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output = True, text = True, cwd = os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def load_history(path = HISTORY_PATH) -> list:
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return json.load(f)['runs']
+
+def record_run(results, label = None, path = HISTORY_PATH) -> dict:
+    run = {
+        'label'     : label,
+        'timestamp' : datetime.now().isoformat(timespec = 'seconds'),
+        'commit'    : _git_commit(),
+        'python'    : platform.python_version(),
+        'numpy'     : np.__version__,
+        'pandas'    : pd.__version__,
+        'machine'   : platform.platform(),
+        'results'   : results,
+    }
+    runs = load_history(path) + [run]
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump({'runs' : runs}, f, indent = 1)
+    os.replace(tmp, path) # A crash while writing never leaves a half written history
+    return run
+
+
+
+# Finds a run in the history by its position (e.g. -1 is the latest run) or its label
+
+def find_run(runs, run):
+    if isinstance(run, str) and not run.lstrip('-').isdigit():
+        matches = [r for r in runs if r['label'] == run]
+        if not matches:
+            raise ValueError(f"No benchmark run labelled {run}")
+        return matches[-1]
+    return runs[int(run)]
+
+
+# Compares two runs case by case. A case is a regression if it became more than 'threshold' (e.g. 0.1 = 10%) slower,
+# or used that much more peak memory. Differences smaller than min_time seconds are treated as noise
+
+def compare(baseline = -2, current = -1, threshold = 0.1, min_time = 0.001, path = HISTORY_PATH) -> pd.DataFrame:
+    runs = load_history(path)
+    if len(runs) < 2 and not (isinstance(baseline, str) or isinstance(current, str)):
+        raise ValueError(f"Need at least two benchmark runs in {path} to compare, found {len(runs)}")
+    baseline_run, current_run = find_run(runs, baseline), find_run(runs, current)
+    baseline_results = {(r['case'], params_key(r['params'])) : r for r in baseline_run['results']}
+
+    rows = []
+    for r in current_run['results']:
+        key = (r['case'], params_key(r['params']))
+        old = baseline_results.get(key)
+        row = {'case' : key[0], 'params' : key[1], 'current_time' : r['wall_time'], 'current_memory' : r['peak_memory']}
+        if old is None:
+            row['status'] = 'new'
+        else:
+            time_change = r['wall_time'] / old['wall_time'] - 1 if old['wall_time'] else 0.0
+            memory_change = r['peak_memory'] / old['peak_memory'] - 1 if old['peak_memory'] else 0.0
+            slower = time_change > threshold and r['wall_time'] - old['wall_time'] > min_time
+            faster = time_change < -threshold and old['wall_time'] - r['wall_time'] > min_time
+            row.update({
+                'baseline_time'     : old['wall_time'],
+                'time_change %'     : round(time_change * 100, 1),
+                'baseline_memory'   : old['peak_memory'],
+                'memory_change %'   : round(memory_change * 100, 1),
+                'status'            : 'regression' if slower or memory_change > threshold else 'improvement' if faster else 'ok',
+            })
+        rows.append(row)
+
+    columns = ['case', 'params', 'baseline_time', 'current_time', 'time_change %', 'baseline_memory', 'current_memory', 'memory_change %', 'status']
+    return pd.DataFrame(rows).reindex(columns = columns)
+
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Benchmarks for the backtest, data and metrics hot paths')
+    parser.add_argument('--history', default = HISTORY_PATH, help = 'JSON file the runs are recorded in')
+    commands = parser.add_subparsers(dest = 'command', required = True)
+
+    run_parser = commands.add_parser('run', help = 'run the benchmarks and record them')
+    run_parser.add_argument('--quick', action = 'store_true', help = 'leave out the largest sizes')
+    run_parser.add_argument('--cases', nargs = '+', choices = sorted(CASES), help = 'only run these cases')
+    run_parser.add_argument('--repeats', type = int, default = 3)
+    run_parser.add_argument('--label', help = 'name for this run, can be used with compare')
+    run_parser.add_argument('--threshold', type = float, default = 0.1)
+
+    compare_parser = commands.add_parser('compare', help = 'compare two recorded runs')
+    compare_parser.add_argument('--baseline', default = '-2', help = 'run index or label (default: the run before last)')
+    compare_parser.add_argument('--current', default = '-1', help = 'run index or label (default: the last run)')
+    compare_parser.add_argument('--threshold', type = float, default = 0.1)
+
+    args = parser.parse_args(argv)
+    if args.command == 'run':
+        record_run(run_benchmarks(args.cases, quick = args.quick, repeats = args.repeats), label = args.label, path = args.history)
+        if len(load_history(args.history)) < 2:
+            return 0
+        args.baseline, args.current = '-2', '-1'
+
+    comparison = compare(args.baseline, args.current, threshold = args.threshold, path = args.history)
+    with pd.option_context('display.width', 200, 'display.max_rows', None, 'display.max_columns', None):
+        print(comparison.to_string(index = False))
+    regressions = comparison[comparison['status'] == 'regression']
+    if len(regressions):
+        print(f"\n{len(regressions)} regression(s) found")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,133 @@
+from strategy_formulation.strategy.rolling_regression import rolling_regression
+from strategy_formulation.strategy.panel_backtest import panel_period_results, round_metric, TEMPLATE_METRICS
+from strategy_formulation.research.stock_info.risk_metrics import periods_per_year, RISK_METRICS
+from strategy_formulation.research.stock_info.result_cache import ResultCache
+from strategy_analysis.performance.shared_pool import run_shared, shared
+import os
+import json
+import hashlib
+import itertools
+import numpy as np
+import pandas as pd
+
+
+
+'''
+parameter_sweep() runs the tilted mean reversion strategy for every combination of a parameter grid, e.g.
+
+grid = {'scope' : range(20, 253), 'buy_range' : [0.5, 1, 1.5, 2, 2.5, 3, 3.5], 'sell_range' : [2]}
+
+over a set of tickers and periods (the same [start_date, end_date, investment_amount] periods as performance_analysis).
+
+How it works:
+1. The prices are passed in as a StockUniverse (or any object with .values, .dates and .tickers) and copied once into
+   shared memory by run_shared() (see shared_pool.py), so the worker processes read the same array instead of each
+   receiving a pickled DataFrame
+2. The grid is split into chunks of grid points that share a scope. Each chunk computes the rolling regression once
+   per period and reuses it for every buy_range / sell_range pair in the chunk
+3. The chunks run on a process pool. Every finished chunk is saved to 'checkpoint_dir', so an interrupted sweep can be
+   run again with the same arguments and only the missing chunks are computed. The checkpoints are keyed by the
+   arguments and by data_fingerprint() of the prices, so a sweep over different prices never picks up old chunks
+
+The output is a tidy DataFrame with one row per (scope, buy_range, sell_range, period, ticker) and one column per metric.
+An ExecutionModel (see execution.py) can be passed in to run the sweep after trading costs, e.g. once per cost level
+to see how sensitive the best parameters are to costs.
+'''
+
+
+
+# Runs one chunk of the grid (a scope and its buy_range / sell_range pairs) over every period, in a run_shared() worker
+# that has the prices, dates and tickers
+
+def run_chunk(scope, ranges, periods, relevant_metrics, execution = None):
+    prices, dates, tickers = shared()['prices'], shared()['dates'], shared()['tickers']
+    rows = []
+    metrics = [metric for metric in relevant_metrics if metric in RISK_METRICS]
+
+    for start, end, investment in periods:
+        period_rows = dates.slice_indexer(start, end)
+        segment = prices[period_rows]
+        bars_per_year = periods_per_year(dates[period_rows])
+        regression = rolling_regression(segment, scope) # Shared by every buy_range / sell_range pair in the chunk
+
+        for buy_range, sell_range in ranges:
+            results = panel_period_results(segment, investment, scope = scope, buy_range = buy_range, sell_range = sell_range, regression = regression, execution = execution,
+                                           metrics = metrics, periods_per_year = bars_per_year)
+            for j, ticker in enumerate(tickers):
+                row = {'scope' : scope, 'buy_range' : buy_range, 'sell_range' : sell_range, 'period' : f"{start} to {end}", 'ticker' : ticker}
+                for metric in relevant_metrics:
+                    row[metric] = round_metric(metric, results[metric][j])
+                rows.append(row)
+
+    return pd.DataFrame(rows)
+
+
+
+# Splits the grid into chunks of at most chunk_size (buy_range, sell_range) pairs that share a scope
+
+def sweep_chunks(grid, chunk_size = 16):
+    ranges = list(itertools.product(grid.get('buy_range', [2]), grid.get('sell_range', [2])))
+    chunks = []
+    for scope in grid.get('scope', [30]):
+        for i in range(0, len(ranges), chunk_size):
+            chunks.append((int(scope), ranges[i : i + chunk_size]))
+    return chunks
+
+
+
+# Shape, first and last date and a hash of the dates and prices of a universe, so the same arguments over different
+# data (e.g. prices downloaded again after a dividend, or a longer history) are told apart
+
+def data_fingerprint(universe):
+    dates = pd.DatetimeIndex(universe.dates)
+    values = np.asarray(universe.values, dtype = np.float64)
+    return {'shape' : list(values.shape), 'dates' : [str(dates[0]), str(dates[-1])] if len(dates) else [],
+            'sha256' : ResultCache.fingerprint(pd.DataFrame(values, index = dates))}
+
+
+
+def sweep_id(grid, periods, tickers, relevant_metrics, chunk_size, execution = None, fingerprint = None):
+    key = json.dumps([{k : list(v) for k, v in grid.items()}, periods, list(tickers), relevant_metrics, chunk_size] + ([repr(execution)] if execution is not None else [])
+                     + ([fingerprint] if fingerprint is not None else []), default = str)
+    return hashlib.sha1(key.encode()).hexdigest()[:16]
+
+
+
+def parameter_sweep(universe, grid, periods, relevant_metrics = None, chunk_size = 16, max_workers = None, checkpoint_dir = None, execution = None):
+    if relevant_metrics is None:
+        relevant_metrics = TEMPLATE_METRICS
+    relevant_metrics = list(relevant_metrics)
+    chunks = sweep_chunks(grid, chunk_size)
+
+    # Each sweep gets its own checkpoint folder, so changing any of the arguments starts a fresh sweep
+    if checkpoint_dir is not None:
+        checkpoint_dir = os.path.join(checkpoint_dir, sweep_id(grid, periods, universe.tickers, relevant_metrics, chunk_size, execution, data_fingerprint(universe)))
+        os.makedirs(checkpoint_dir, exist_ok = True)
+
+    def checkpoint_path(i):
+        return os.path.join(checkpoint_dir, f"chunk_{i:06d}.pkl")
+
+    results = {}
+    if checkpoint_dir is not None:
+        for i in range(len(chunks)):
+            if os.path.exists(checkpoint_path(i)):
+                results[i] = pd.read_pickle(checkpoint_path(i))
+
+    def save(i, frame):
+        results[i] = frame
+        if checkpoint_dir is not None:
+            tmp_path = checkpoint_path(i) + '.tmp' # Write then rename so a crash never leaves a half written chunk
+            frame.to_pickle(tmp_path)
+            os.replace(tmp_path, checkpoint_path(i))
+
+    todo = [i for i in range(len(chunks)) if i not in results]
+    if todo:
+        state = {'dates' : pd.DatetimeIndex(universe.dates), 'tickers' : list(universe.tickers)}
+        tasks = [(*chunks[i], periods, relevant_metrics, execution) for i in todo]
+        for t, frame in run_shared(run_chunk, tasks, {'prices' : np.asfortranarray(universe.values, dtype = np.float64)}, state = state, max_workers = max_workers):
+            save(todo[t], frame)
+
+    frames = [results[i] for i in range(len(chunks)) if not results[i].empty]
+    if not frames:
+        return pd.DataFrame(columns = ['scope', 'buy_range', 'sell_range', 'period', 'ticker'] + relevant_metrics)
+    return pd.concat(frames, ignore_index = True)
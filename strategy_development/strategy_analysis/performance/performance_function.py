@@ -1,9 +1,12 @@
 import sys
 sys.path.append('../../')
 from strategy_formulation.strategy.tilted_mean_reversion_strategy import MeanReversion
+from strategy_formulation.strategy.panel_backtest import panel_tilted_mean_reversion
+from strategy_formulation.strategy.portfolio_backtest import portfolio_tilted_mean_reversion
 from strategy_formulation.research.stock_info.stock_info import sap500_tickers
+from strategy_formulation.research.stock_info.universe import StockUniverse
+from strategy_formulation.research.stock_info.risk_metrics import RISK_METRICS
 import numpy as np
-import yfinance as yf
 import pandas as pd
 
 
@@ -31,27 +34,56 @@ tickers_range = [0,50]
 
 relevant_metrics = ['B&H % increase','Strat risk-adj % increase', 'No. of trades', 'Win / Loss Ratio']
 
-def performance_analysis(periods, tickers_range, relevant_metrics, scope = 30, buy_range = 2, sell_range = 2):
+# universe = optional StockUniverse to use instead of downloading the tickers in tickers_range (e.g. offline fixtures)
+# relevant_metrics can include any of RISK_METRICS (see risk_metrics.py), only the ones asked for are worked out
 
-    # Get list of tickers for stock data
-    tickers = sap500_tickers(tickers_range[0], tickers_range[1])
-    # Gather tickers stock info
-    dict_of_tickers = {ticker : MeanReversion(ticker) for ticker in tickers}
-    # Filter out tickers with empty stock data
-    dict_of_tickers = {k : v for k, v in dict_of_tickers.items() if not v.data.empty}
+def performance_analysis(periods, tickers_range, relevant_metrics, scope = 30, buy_range = 2, sell_range = 2, universe = None):
 
+    if universe is None:
+        # Get list of tickers for stock data
+        tickers = sap500_tickers(tickers_range[0], tickers_range[1])
+        # Gather tickers stock info in bulk, tickers with empty stock data are left out of the universe
+        universe = StockUniverse(tickers)
+    dict_of_tickers = universe.stocks(MeanReversion)
 
 
 
+
+    metrics = [metric for metric in relevant_metrics if metric in RISK_METRICS]
     output_data = {(key, metric) : [] for key in dict_of_tickers for metric in relevant_metrics}
     index_labels = [f"{start} to {end}" for start, end, _ in periods]
 
     for key in dict_of_tickers:
         for period in periods:
-            result = dict_of_tickers[key].tilted_mean_reversion(period, scope = scope, buy_range = buy_range, sell_range = sell_range, graph = False, analysis = False)
+            result = dict_of_tickers[key].tilted_mean_reversion(period, scope = scope, buy_range = buy_range, sell_range = sell_range, graph = False, analysis = False, metrics = metrics)
             for metric in relevant_metrics:
                 output_data[(key, metric)].append(result[metric])
     output_df = pd.DataFrame(output_data)
     output_df.index = index_labels
 
-    return output_df
\ No newline at end of file
+    return output_df
+
+
+
+# Same output as performance_analysis, but every ticker is backtested at once on one price panel (see panel_backtest.py)
+
+def panel_performance_analysis(periods, tickers_range, relevant_metrics, scope = 30, buy_range = 2, sell_range = 2, universe = None):
+
+    if universe is None:
+        tickers = sap500_tickers(tickers_range[0], tickers_range[1])
+        universe = StockUniverse(tickers)
+
+    return panel_tilted_mean_reversion(universe.values, universe.dates, universe.tickers, periods, scope = scope, buy_range = buy_range, sell_range = sell_range, relevant_metrics = relevant_metrics)
+
+
+
+# Backtests the universe as one portfolio with shared capital (see portfolio_backtest.py). One row per period with the
+# portfolio's metrics, relevant_metrics = None gives all of PORTFOLIO_METRICS
+
+def portfolio_performance_analysis(periods, tickers_range, relevant_metrics = None, scope = 30, buy_range = 2, sell_range = 2, sizing = 'equal', max_positions = None, universe = None):
+
+    if universe is None:
+        tickers = sap500_tickers(tickers_range[0], tickers_range[1])
+        universe = StockUniverse(tickers)
+
+    return portfolio_tilted_mean_reversion(universe.values, universe.dates, universe.tickers, periods, scope = scope, buy_range = buy_range, sell_range = sell_range, sizing = sizing, max_positions = max_positions, relevant_metrics = relevant_metrics)
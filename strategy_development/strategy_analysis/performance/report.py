@@ -0,0 +1,179 @@
+from strategy_formulation.strategy.panel_backtest import TEMPLATE_METRICS
+from strategy_analysis.performance.parameter_sweep import run_chunk, sweep_chunks, sweep_id, data_fingerprint
+from strategy_analysis.performance.shared_pool import run_shared
+import os
+import json
+import time
+import numpy as np
+import pandas as pd
+
+
+
+'''
+generate_report() runs the tilted mean reversion strategy over every (period, parameters) task of a grid, like
+parameter_sweep(), and writes the results to a Parquet dataset in long format, with one row per
+(period, ticker, buy_range, sell_range, metric) and its value:
+
+path/run=<run>/scope=<scope>/part-<chunk>.parquet
+
+Each report is a 'run' (by default a hash of its arguments and of data_fingerprint() of the prices) with its own folder, so new reports are appended to the
+dataset without rewriting the old ones, and a run that was interrupted is finished by calling generate_report() again
+with the same arguments (the chunks already written are skipped). The chunks run on a process pool and each one is
+written as soon as it finishes. A ticker that does not have more than 'scope' prices in a period has no results, so its
+values are null instead of the 0.0 that performance_analysis() gives.
+
+read_report() loads a report back. Filters on any column (run, scope, buy_range, sell_range, period, ticker, metric) are
+pushed down to Parquet, so only the matching folders and row groups are read:
+
+run = generate_report(universe, grid, periods, 'reports')
+read_report('reports', run = run, metric = 'Strat % increase', ticker = ['AAPL', 'MSFT'])
+read_report('reports', run = run, scope = 30, buy_range = 2, sell_range = 2, wide = True) # performance_analysis layout
+
+Parquet is read and written with pyarrow.
+'''
+
+
+
+REPORT_COLUMNS = ['run', 'scope', 'buy_range', 'sell_range', 'period', 'ticker', 'metric', 'value']
+
+ROW_GROUP_SIZE = 64 * 1024 # Rows are sorted by metric and ticker, so small row groups let filters skip most of a file
+
+
+
+def _pyarrow():
+    try:
+        import pyarrow as pa
+        import pyarrow.dataset as ds
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("Reports are stored as Parquet, which needs pyarrow (pip install pyarrow)")
+    return pa, ds, pq
+
+def _partitioning():
+    pa, ds, _ = _pyarrow()
+    return ds.partitioning(pa.schema([('run', pa.string()), ('scope', pa.int64())]), flavor = 'hive')
+
+def _file_schema():
+    pa, _, _ = _pyarrow()
+    return pa.schema([('period', pa.string()), ('ticker', pa.string()), ('buy_range', pa.float64()), ('sell_range', pa.float64()),
+                      ('metric', pa.string()), ('value', pa.float64())])
+
+
+
+# Number of prices every ticker has in every period, as a Series indexed by (period, ticker)
+
+def _price_counts(universe, periods):
+    dates = pd.DatetimeIndex(universe.dates)
+    values = np.asarray(universe.values, dtype = np.float64)
+    counts = {}
+    for start, end, _ in periods:
+        segment = values[dates.slice_indexer(start, end)]
+        counts[f"{start} to {end}"] = pd.Series((~np.isnan(segment)).sum(axis = 0), index = list(universe.tickers))
+    return pd.concat(counts, names = ['period', 'ticker'])
+
+
+
+# Turns a run_chunk() result into long format, with null values for the tickers that had no results
+
+def _to_long(frame, relevant_metrics, counts):
+    long = frame.melt(id_vars = ['scope', 'buy_range', 'sell_range', 'period', 'ticker'], value_vars = relevant_metrics, var_name = 'metric', value_name = 'value')
+    long['value'] = long['value'].astype(np.float64)
+    bars = counts.reindex(pd.MultiIndex.from_arrays([long['period'], long['ticker']])).to_numpy()
+    long.loc[~(bars > long['scope'].to_numpy()), 'value'] = np.nan
+    return long.sort_values(['metric', 'ticker'], kind = 'stable')
+
+
+
+def _write_chunk(path, frame):
+    pa, _, pq = _pyarrow()
+    table = pa.Table.from_pandas(frame[_file_schema().names], schema = _file_schema(), preserve_index = False)
+    os.makedirs(os.path.dirname(path), exist_ok = True)
+    tmp_path = path + '.tmp' # Write then rename so a crash never leaves a half written chunk
+    pq.write_table(table, tmp_path, row_group_size = ROW_GROUP_SIZE)
+    os.replace(tmp_path, path)
+
+
+
+# Runs every (period, parameters) task of the grid and writes the results to the dataset at 'path'. Returns the run's name
+
+def generate_report(universe, grid, periods, path, relevant_metrics = None, run = None, chunk_size = 16, max_workers = None, execution = None):
+    _pyarrow()
+    if relevant_metrics is None:
+        relevant_metrics = TEMPLATE_METRICS
+    relevant_metrics = list(relevant_metrics)
+    chunks = sweep_chunks(grid, chunk_size)
+    fingerprint = data_fingerprint(universe)
+    if run is None:
+        run = sweep_id(grid, periods, universe.tickers, relevant_metrics, chunk_size, execution, fingerprint)
+    run_dir = os.path.join(path, f"run={run}")
+
+    def chunk_path(i):
+        return os.path.join(run_dir, f"scope={chunks[i][0]}", f"part-{i:06d}.parquet")
+
+    os.makedirs(run_dir, exist_ok = True)
+    run_path = os.path.join(run_dir, '_run.json') # Files starting with _ are not read as part of the dataset
+    if not os.path.exists(run_path):
+        with open(run_path, 'w') as f:
+            json.dump({'run' : run, 'grid' : {k : list(v) for k, v in grid.items()}, 'periods' : periods, 'tickers' : list(universe.tickers),
+                       'relevant_metrics' : relevant_metrics, 'execution' : repr(execution), 'data' : fingerprint, 'created_at' : time.time()}, f, default = str)
+
+    todo = [i for i in range(len(chunks)) if not os.path.exists(chunk_path(i))]
+    if not todo:
+        return run
+    counts = _price_counts(universe, periods)
+
+    def save(i, frame):
+        if not frame.empty:
+            _write_chunk(chunk_path(i), _to_long(frame, relevant_metrics, counts))
+
+    state = {'dates' : pd.DatetimeIndex(universe.dates), 'tickers' : list(universe.tickers)}
+    tasks = [(*chunks[i], periods, relevant_metrics, execution) for i in todo]
+    for t, frame in run_shared(run_chunk, tasks, {'prices' : np.asfortranarray(universe.values, dtype = np.float64)}, state = state, max_workers = max_workers):
+        save(todo[t], frame)
+
+    return run
+
+
+
+# Loads the rows of the report dataset at 'path' that match the filters, e.g. metric = 'Strat % increase' or
+# ticker = ['AAPL', 'MSFT']. wide = True returns the performance_analysis() layout: one row per period (and set of
+# parameters) and one column per (ticker, metric)
+
+def read_report(path, columns = None, wide = False, **filters):
+    _, ds, _ = _pyarrow()
+    unknown = set(filters) - set(REPORT_COLUMNS)
+    if unknown:
+        raise ValueError(f"Can only filter on {REPORT_COLUMNS}, got {sorted(unknown)}")
+
+    expression = None
+    for column, value in filters.items():
+        values = list(value) if isinstance(value, (list, tuple, set, range)) else [value]
+        term = ds.field(column).isin(values)
+        expression = term if expression is None else expression & term
+
+    dataset = ds.dataset(path, format = 'parquet', partitioning = _partitioning())
+    if wide:
+        columns = None
+    frame = dataset.to_table(columns = columns, filter = expression).to_pandas()
+    if columns is None:
+        frame = frame[REPORT_COLUMNS]
+    if not wide:
+        return frame
+
+    index = [column for column in ['run', 'scope', 'buy_range', 'sell_range'] if frame[column].nunique() > 1] + ['period']
+    output_df = frame.pivot(index = index, columns = ['ticker', 'metric'], values = 'value')
+    return output_df.rename_axis(columns = [None, None])
+
+
+
+# Arguments and creation time of every run in the report dataset
+
+def report_runs(path):
+    runs = []
+    for folder in sorted(os.listdir(path)) if os.path.isdir(path) else []:
+        try:
+            with open(os.path.join(path, folder, '_run.json')) as f:
+                runs.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    return pd.DataFrame(runs)
@@ -0,0 +1,76 @@
+import numpy as np
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+
+
+'''
+run_shared() runs a function over a list of tasks on a process pool, with the large arrays every task reads (e.g. a
+universe's prices) copied once into shared memory instead of being pickled for every worker. It is used by
+parameter_sweep(), generate_report() and walk_forward():
+
+for i, result in run_shared(run_chunk, tasks, {'prices' : prices}, state = {'dates' : dates, 'tickers' : tickers}):
+    ...
+
+Its parameters are:
+function = module level function, called as function(*task) for every task. It reads the arrays and state with shared()
+tasks = list of argument tuples
+arrays = {name : array} of the arrays to share. They are stored as float64 and keep their C or Fortran order
+state = {name : value} of small values given to every worker as they are (e.g. the dates and tickers)
+setup = optional module level function(shared()) run once in every worker after the arrays are attached. The dictionary
+        it returns is added to shared(), e.g. an object rebuilt from the shared arrays
+max_workers = number of worker processes, 1 runs the tasks in this process (useful for debugging)
+
+The results are yielded as (task index, result) in the order the tasks finish, and the shared memory is freed once
+every task has finished (or the loop over the results is left early).
+'''
+
+
+
+# Worker process state, set up once per process by _attach
+
+_shared = {}
+
+def shared() -> dict:
+    return _shared
+
+def _attach(shm_name, layout, state, setup):
+    shm = shared_memory.SharedMemory(name = shm_name)
+    _shared['shm'] = shm # Keep a reference so the buffer stays open
+    for name, shape, order, position in layout:
+        _shared[name] = np.ndarray(shape, dtype = np.float64, buffer = shm.buf, offset = position, order = order)
+    _shared.update(state)
+    if setup is not None:
+        _shared.update(setup(_shared))
+
+
+
+def run_shared(function, tasks, arrays, state = None, setup = None, max_workers = None):
+    arrays = {name : np.asarray(array, dtype = np.float64) for name, array in arrays.items()}
+    layout, position = [], 0
+    for name, array in arrays.items():
+        layout.append((name, array.shape, 'F' if np.isfortran(array) else 'C', position))
+        position += array.nbytes
+
+    shm = shared_memory.SharedMemory(create = True, size = max(position, 1))
+    try:
+        for (name, shape, order, position), array in zip(layout, arrays.values()):
+            np.ndarray(shape, dtype = np.float64, buffer = shm.buf, offset = position, order = order)[...] = array
+        initargs = (shm.name, layout, dict(state or {}), setup)
+        del arrays
+
+        if max_workers == 1: # Runs in this process, useful for debugging
+            _attach(*initargs)
+            try:
+                for i, task in enumerate(tasks):
+                    yield i, function(*task)
+            finally:
+                _shared.clear()
+        else:
+            with ProcessPoolExecutor(max_workers = max_workers, initializer = _attach, initargs = initargs) as pool:
+                futures = {pool.submit(function, *task) : i for i, task in enumerate(tasks)}
+                for future in as_completed(futures):
+                    yield futures[future], future.result()
+    finally:
+        shm.close()
+        shm.unlink()
@@ -0,0 +1,177 @@
+from strategy_formulation.strategy.rolling_regression import RollingStats
+from strategy_formulation.strategy.panel_backtest import panel_period_results, round_metric, TEMPLATE_METRICS
+from strategy_formulation.research.stock_info.risk_metrics import periods_per_year, RISK_METRICS
+from strategy_analysis.performance.shared_pool import run_shared, shared
+import itertools
+import numpy as np
+import pandas as pd
+
+
+
+'''
+walk_forward() is a walk forward optimisation of the tilted mean reversion strategy. The history is split into folds of
+an in-sample window followed by an out-of-sample window, e.g. with in_sample = '5Y', out_of_sample = '1Y'
+
+fold 0: in-sample 2000-01-01 to 2004-12-31, out-of-sample 2005-01-01 to 2005-12-31
+fold 1: in-sample 2001-01-01 to 2005-12-31, out-of-sample 2006-01-01 to 2006-12-31
+...
+
+For each fold every (scope, buy_range, sell_range) of the grid is run in-sample, the one with the best 'objective' is
+picked, and only that one is run out-of-sample. The chosen parameters are picked once for the whole universe (by the
+median of the objective over the tickers) or, with select = 'ticker', separately for each ticker. The objective is one
+of the strategy_template() metrics or of the RISK_METRICS in risk_metrics.py (e.g. 'Sharpe ratio'), and is maximised.
+
+How it works:
+1. The prices go into shared memory with run_shared() (see shared_pool.py), along with the prefix sums of a
+   RollingStats() of the full history. The folds overlap, so instead of fitting the regression again for every fold,
+   each fold asks the shared RollingStats for the rows of its own window (a window is only used once the ticker has
+   'scope' prices in the period, so it never reaches back past the start of the period and the signals are the same as
+   running the period alone)
+2. Each fold works out the regression once per scope and reuses it for every buy_range / sell_range pair
+3. The folds run on a process pool (max_workers = 1 runs them in this process)
+
+The output has one row per (fold, ticker) with the fold's dates, the chosen parameters, the in-sample objective and the
+out-of-sample relevant_metrics, in the same period format as performance_analysis.
+'''
+
+
+
+# Rebuilds the RollingStats of the full history from the shared arrays, once per worker process
+
+def _attach_stats(arrays):
+    return {'stats' : RollingStats.from_arrays(arrays, one_dimensional = arrays['one_dimensional'], block_size = arrays['block_size'])}
+
+
+
+def _rows(dates, start, end):
+    rows = dates.slice_indexer(start, end)
+    return rows.start or 0, len(dates) if rows.stop is None else rows.stop
+
+
+
+# Runs every parameter of the grid on the fold's in-sample window, then the chosen ones on the out-of-sample window
+
+def _run_fold(number, fold, scopes, ranges, objective, select, relevant_metrics):
+    stats, dates, tickers = shared()['stats'], shared()['dates'], shared()['tickers']
+    in_sample, out_of_sample = fold
+
+    i, j = _rows(dates, *in_sample[:2])
+    segment = stats.prices[i : j]
+    objective_metrics = [objective] if objective in RISK_METRICS else None
+    parameters, scores = [], []
+    for scope in scopes:
+        if j - i <= scope:
+            continue
+        regression = stats.regression(scope, i, j) # Shared by every buy_range / sell_range pair of the scope
+        enough_data = (~np.isnan(segment)).sum(axis = 0) > scope
+        for buy_range, sell_range in ranges:
+            results = panel_period_results(segment, in_sample[2], scope = scope, buy_range = buy_range, sell_range = sell_range, regression = regression,
+                                           metrics = objective_metrics, periods_per_year = periods_per_year(dates[i : j]))
+            parameters.append((scope, buy_range, sell_range))
+            scores.append(np.where(enough_data, results[objective], np.nan))
+
+    if not parameters:
+        return pd.DataFrame()
+    scores = np.array(scores) # (parameters, tickers)
+
+    # Index of the chosen parameters for each ticker, -1 when the ticker has no in-sample score
+    scored = ~np.isnan(scores).all(axis = 0)
+    if select == 'ticker':
+        chosen = np.where(scored, np.argmax(np.where(np.isnan(scores), -np.inf, scores), axis = 0), -1)
+    else:
+        if not scored.any():
+            return pd.DataFrame()
+        with np.errstate(all = 'ignore'):
+            universe_score = np.nanmedian(scores[:, scored], axis = 1)
+        chosen = np.where(scored, int(np.nanargmax(universe_score)), -1)
+
+    i, j = _rows(dates, *out_of_sample[:2])
+    segment = stats.prices[i : j]
+    metrics = [metric for metric in relevant_metrics if metric in RISK_METRICS]
+    rows = []
+    for p in np.unique(chosen[chosen >= 0]):
+        scope, buy_range, sell_range = parameters[p]
+        results = panel_period_results(segment, out_of_sample[2], scope = scope, buy_range = buy_range, sell_range = sell_range, regression = stats.regression(scope, i, j),
+                                       metrics = metrics, periods_per_year = periods_per_year(dates[i : j]))
+        for t in np.flatnonzero(chosen == p):
+            row = {
+                'fold' : number,
+                'in_sample' : f"{in_sample[0]} to {in_sample[1]}",
+                'out_of_sample' : f"{out_of_sample[0]} to {out_of_sample[1]}",
+                'ticker' : tickers[t],
+                'scope' : scope,
+                'buy_range' : buy_range,
+                'sell_range' : sell_range,
+                f"In-sample {objective}" : round_metric(objective, scores[p, t]),
+            }
+            for metric in relevant_metrics:
+                row[metric] = round_metric(metric, results[metric][t])
+            rows.append((t, row))
+
+    return pd.DataFrame([row for _, row in sorted(rows, key = lambda row : row[0])]) # In the universe's ticker order
+
+
+
+def _offset(length):
+    if isinstance(length, str):
+        number, unit = length[:-1], length[-1].upper()
+        if unit in ('Y', 'M') and number.isdigit():
+            return pd.DateOffset(years = int(number)) if unit == 'Y' else pd.DateOffset(months = int(number))
+        return pd.Timedelta(length)
+    return length
+
+
+
+# Splits [start, end] into (in_sample, out_of_sample) pairs of [start_date, end_date, investment] periods. Lengths are
+# strings such as '5Y', '18M' or '90D' (or pandas offsets), step defaults to the out-of-sample length so the
+# out-of-sample windows follow on from each other
+
+def walk_forward_folds(start, end, in_sample = '5Y', out_of_sample = '1Y', step = None, investment = 100) -> list:
+    in_sample, out_of_sample = _offset(in_sample), _offset(out_of_sample)
+    step = out_of_sample if step is None else _offset(step)
+    start, end = pd.Timestamp(start), pd.Timestamp(end)
+    day = pd.Timedelta(days = 1)
+
+    folds = []
+    while True:
+        oos_start = start + in_sample
+        oos_end = oos_start + out_of_sample - day
+        if oos_end > end:
+            break
+        folds.append((
+            [start.strftime('%Y-%m-%d'), (oos_start - day).strftime('%Y-%m-%d'), investment],
+            [oos_start.strftime('%Y-%m-%d'), oos_end.strftime('%Y-%m-%d'), investment],
+        ))
+        start = start + step
+    return folds
+
+
+
+def walk_forward(universe, grid, in_sample = '5Y', out_of_sample = '1Y', step = None, start = None, end = None, investment = 100,
+                 objective = 'Strat risk-adj % increase', select = 'universe', relevant_metrics = None, max_workers = None):
+    if relevant_metrics is None:
+        relevant_metrics = TEMPLATE_METRICS
+    relevant_metrics = list(relevant_metrics)
+    if objective not in TEMPLATE_METRICS + RISK_METRICS:
+        raise ValueError(f"objective must be one of {TEMPLATE_METRICS + RISK_METRICS}, got {objective}")
+    if select not in ('universe', 'ticker'):
+        raise ValueError(f"select must be 'universe' or 'ticker', got {select}")
+
+    dates = pd.DatetimeIndex(universe.dates)
+    columns = ['fold', 'in_sample', 'out_of_sample', 'ticker', 'scope', 'buy_range', 'sell_range', f"In-sample {objective}"] + relevant_metrics
+    if not len(dates):
+        return pd.DataFrame(columns = columns)
+    folds = walk_forward_folds(dates[0] if start is None else start, dates[-1] if end is None else end, in_sample, out_of_sample, step, investment)
+    scopes = list(dict.fromkeys(int(scope) for scope in grid.get('scope', [30])))
+    ranges = list(itertools.product(grid.get('buy_range', [2]), grid.get('sell_range', [2])))
+
+    stats = RollingStats(np.asarray(universe.values, dtype = np.float64))
+    state = {'dates' : dates, 'tickers' : list(universe.tickers), 'one_dimensional' : stats.one_dimensional, 'block_size' : stats.block_size}
+    tasks = [(number, fold, scopes, ranges, objective, select, relevant_metrics) for number, fold in enumerate(folds)]
+    frames = dict(run_shared(_run_fold, tasks, stats.arrays(), state = state, setup = _attach_stats, max_workers = max_workers))
+    frames = [frames[number] for number in range(len(folds))]
+
+    frames = [frame for frame in frames if not frame.empty]
+    if not frames:
+        return pd.DataFrame(columns = columns)
+    return pd.concat(frames, ignore_index = True)[columns]
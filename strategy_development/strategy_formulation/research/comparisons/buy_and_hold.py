@@ -1,9 +1,8 @@
 import sys
 sys.path.append('../')
-print(sys.path)
 from stock_info.stock_info import StockInfo
+from stock_info.backtest import buy_and_hold_curve
 import numpy as np
-import yfinance as yf
 import matplotlib.pyplot as plt
 
 '''
@@ -28,13 +27,9 @@ class StrategyComparison(StockInfo):
 
     def buy_and_hold(self, period, scope = 30, graph = True, plotting = False, analysis = True):
         period = self.default_period(period)
-        segment = self.data.loc[period[0] : period[1]]
+        segment = self.display_data(period)
         
-        bah_investment = [ period[2] ]
-
-        for i in range(scope, len(segment)):
-            bah_perc_change = segment.iloc[i] / segment.iloc[i - 1]
-            bah_investment.append(bah_investment[-1] * bah_perc_change.iloc[0])
+        bah_investment = buy_and_hold_curve(segment.iloc[:, 0].to_numpy(dtype = np.float64), scope, period[2]).tolist()
 
         if graph:
             plt.figure()
@@ -71,7 +66,7 @@ class StrategyComparison(StockInfo):
     
     def strategy_template(self, results: dict, scope, period = None, graph = True, analysis = True):
         period = self.default_period(period)
-        segment = self.data.loc[period[0] : period[1]]
+        segment = self.display_data(period)
         
         bah_investment = self.buy_and_hold(period, scope = scope, graph = False, plotting = True, analysis = False)
 
@@ -2,9 +2,9 @@ import sys
 sys.path.append('../')
 
 from comparisons.buy_and_hold import StrategyComparison
+from stock_info.backtest import position_loop
+from stock_info.plotting import PlotQueue
 import numpy as np
-import yfinance as yf
-import matplotlib.pyplot as plt
 
 
 # Classic Mean Reversion Stratgey
@@ -13,30 +13,23 @@ class MeanReversion(StrategyComparison):
 
     def mean_reversion(self, period, scope = 30, graph = True, analysis = True):
         period = self.default_period(period)
-        segment = self.data.loc[period[0] : period[1]]
+        segment = self.display_data(period)
         
         bah_investment = self.buy_and_hold(period, scope = scope, graph = False, plotting = True, analysis = False)
         
-        investment = period[2]
-        strat_investment = [ investment ]
-        position = False
-        length_in_market = 0
+        # Mean and standard deviation of the previous 'scope' data points for every bar
+        prices = segment.iloc[:, 0].to_numpy(dtype = np.float64)
+        rolling = segment.iloc[:, 0].rolling(scope)
+        prev_mean = rolling.mean().shift(1).to_numpy()
+        prev_std = np.sqrt(rolling.var().shift(1).to_numpy())
+
+        with np.errstate(invalid = 'ignore'):
+            entries = prices < prev_mean - 2 * prev_std # if we are not in the market and the price is below 2std below the mean -> buy
+            exits = prices > prev_mean + 2 * prev_std # If we go above 2std above the mean, sell
 
         # Loop over every data point once there is enough data to analyse previous data
-        for i in range(scope, len(segment)):
-            if position:
-                length_in_market += 1
-                perc_change = segment.iloc[i] / segment.iloc[i - 1]
-                investment *= perc_change.iloc[0] # Increase investment if we are in the market
-                strat_investment.append(investment) 
-                # If we go above 2std above the mean, sell
-                if segment.iloc[i].iloc[0] > segment.iloc[i - scope : i].mean().iloc[0] + 2 * np.sqrt(segment.iloc[i - scope : i].var().iloc[0]):
-                    position = False
-            else:
-                strat_investment.append(0) # If we're not in the market, append 0 to investment amount
-                
-            if not position and segment.iloc[i].iloc[0] < segment.iloc[i - scope : i].mean().iloc[0] - 2 * np.sqrt(segment.iloc[i - scope : i].var().iloc[0]):
-                position = True # if we are not in the market and the price is below 2std below the mean -> buy
+        equity, investment, length_in_market, _, _ = position_loop(prices, entries, exits, scope, period[2])
+        strat_investment = [ period[2] ] + equity.tolist()
 
         perc_in_market = length_in_market / (len(segment) - scope)
         if perc_in_market:
@@ -44,15 +37,12 @@ class MeanReversion(StrategyComparison):
         else:
             risk_adj_returns = 0
 
-        if graph:
-            plt.figure()
-            plt.plot(strat_investment, label = 'Mean Reversion Stratgey Returns')
-            plt.plot(bah_investment, label = 'Buy and Hold Returns', alpha = 0.4)
-            plt.title(f"Mean Reversion Strategy versus Buy and Hold Strategy for {self.ticker}")
-            plt.xlabel('Time')
-            plt.ylabel('Investment Value')
-            plt.legend()
-            plt.show()
+        if graph: # graph = a PlotQueue records the figure to draw later
+            plots = graph if isinstance(graph, PlotQueue) else PlotQueue()
+            plots.add(f"Mean Reversion Strategy versus Buy and Hold Strategy for {self.ticker}", [('Mean Reversion Stratgey Returns', strat_investment),
+                                                                                                  ('Buy and Hold Returns', bah_investment, {'alpha' : 0.4})])
+            if plots is not graph:
+                plots.show()
 
         def round_2_dp(x):
             return round(x,2)
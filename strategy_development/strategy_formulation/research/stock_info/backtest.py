@@ -0,0 +1,185 @@
+import numpy as np
+from importlib.util import find_spec
+
+# Numba is optional, without it the pure NumPy version of the position loop is used. Importing it takes a few hundred
+# milliseconds, so it is only imported (and the loop compiled) the first time the Numba loop is run
+NUMBA_AVAILABLE = find_spec('numba') is not None
+
+
+
+'''
+Array backed backtest kernel.
+
+The strategies used to step through their segment with segment.iloc[i] which creates a new pandas Series on every bar.
+backtest() instead takes a float64 price array plus precomputed entry and exit masks and replays the position logic
+that every strategy in this project shares:
+
+For every bar i from 'start' onwards
+1. If we are in the market the investment grows by prices[i] / prices[i - 1]. If exits[i] is True we then sell,
+   and the trade is a winning trade if prices[i] is above the price we bought at.
+2. If we are (now) out of the market and entries[i] is True we buy at prices[i].
+
+It outputs the results dictionary that StockInfo.strategy_template() expects. With an ExecutionModel (see execution.py)
+the same trades are made, but at its fill prices and after its costs.
+'''
+
+
+
+# Pure NumPy version. The state only changes when a trade opens or closes, so instead of looping over every bar
+# we jump from trade to trade with searchsorted and fill in each trade's equity with a cumulative product.
+# position / entry_price let a position that was opened before 'start' carry on (used by the streaming backtest).
+# As well as the position_loop() outputs it returns the final position and entry price and the bars we bought and sold on
+
+def trade_loop(prices, entries, exits, start, investment, position = False, entry_price = 0.0):
+    n = len(prices)
+    equity = np.zeros(max(n - start, 0))
+    time_in_market, trades, winning_trades = 0, 0, 0
+    buys, sells = [], []
+
+    entry_indexes = np.flatnonzero(entries)
+    exit_indexes = np.flatnonzero(exits)
+    ratios = prices[1:] / prices[:-1]
+
+    cursor = start
+    entry = start - 1 # An open position carries on as if it was bought on the bar before start
+    while True:
+        if position:
+            x = np.searchsorted(exit_indexes, entry, side = 'right') # First exit strictly after we bought
+            exit_ = exit_indexes[x] if x < len(exit_indexes) else n - 1
+            if exit_ > entry:
+                growth = investment * np.cumprod(ratios[entry : exit_])
+                equity[entry + 1 - start : exit_ + 1 - start] = growth
+                investment = float(growth[-1])
+                time_in_market += exit_ - entry
+
+            if x == len(exit_indexes): # Still in the market at the end of the data
+                break
+            position = False
+            sells.append(int(exit_))
+            if prices[exit_] > entry_price:
+                winning_trades += 1
+            cursor = exit_ # We can buy again on the bar we sold
+
+        e = np.searchsorted(entry_indexes, cursor)
+        if e == len(entry_indexes):
+            break
+        entry = entry_indexes[e]
+        entry_price = float(prices[entry])
+        position = True
+        trades += 1
+        buys.append(int(entry))
+
+    return equity, investment, time_in_market, trades, winning_trades, position, entry_price, buys, sells
+
+
+def _position_loop_numpy(prices, entries, exits, start, investment):
+    return trade_loop(prices, entries, exits, start, investment)[:5]
+
+
+
+def _position_loop_python(prices, entries, exits, start, investment):
+    n = len(prices)
+    equity = np.zeros(max(n - start, 0))
+    position = False
+    time_in_market, trades, winning_trades = 0, 0, 0
+    starting_point = 0.0
+
+    for i in range(start, n):
+        if position:
+            time_in_market += 1
+            investment *= prices[i] / prices[i - 1]
+            equity[i - start] = investment
+            if exits[i]:
+                position = False
+                if prices[i] > starting_point:
+                    winning_trades += 1
+
+        if not position and entries[i]:
+            trades += 1
+            starting_point = prices[i]
+            position = True
+
+    return equity, investment, time_in_market, trades, winning_trades
+
+
+
+_position_loop_numba = None
+
+def _numba_loop():
+    global _position_loop_numba
+    if _position_loop_numba is None:
+        from numba import njit
+        _position_loop_numba = njit(cache = True)(_position_loop_python)
+    return _position_loop_numba
+
+
+
+def position_loop(prices, entries, exits, start, investment, use_numba = None):
+    prices = np.ascontiguousarray(prices, dtype = np.float64).ravel()
+    entries = np.ascontiguousarray(entries, dtype = np.bool_).ravel()
+    exits = np.ascontiguousarray(exits, dtype = np.bool_).ravel()
+    start = max(int(start), 1)
+    investment = float(investment)
+
+    if use_numba is None:
+        use_numba = NUMBA_AVAILABLE
+    if use_numba:
+        if not NUMBA_AVAILABLE:
+            raise ImportError("use_numba = True but numba is not installed")
+        return _numba_loop()(prices, entries, exits, start, investment)
+    return _position_loop_numpy(prices, entries, exits, start, investment)
+
+
+
+# Return and number of bars held of every closed trade. The equity on a trade's exit bar is the investment after it,
+# and the investment before it is the previous trade's (or the starting investment)
+
+def closed_trades(equity, buys, sells, start, investment):
+    sells = np.asarray(sells, dtype = np.int64)
+    after = equity[sells - start] if len(sells) else np.empty(0)
+    before = np.concatenate(([float(investment)], after[:-1]))
+    return after / before - 1, sells - np.asarray(buys[: len(sells)], dtype = np.int64)
+
+
+
+# Runs the position loop and packages the output in the layout strategy_template() expects. execution = optional
+# ExecutionModel, opens / volumes = open prices and volumes of the same bars as prices (only needed by some models).
+# trade_list = True also returns the trade_returns and holding_periods of the closed trades (for risk_metrics.py)
+
+def backtest(prices, entries, exits, start, investment, use_numba = None, execution = None, opens = None, volumes = None, trade_list = False):
+    costed = execution is not None and not execution.frictionless
+    costs = None
+    if not costed and not trade_list:
+        equity, investment, time_in_market, trades, winning_trades = position_loop(prices, entries, exits, start, investment, use_numba = use_numba)
+    else:
+        initial_investment = float(investment)
+        prices = np.ascontiguousarray(prices, dtype = np.float64).ravel()
+        start = max(int(start), 1)
+        equity, investment, time_in_market, trades, winning_trades, _, _, buys, sells = trade_loop(prices, np.asarray(entries, dtype = bool).ravel(), np.asarray(exits, dtype = bool).ravel(), start, initial_investment)
+        if costed:
+            equity, investment, winning_trades, costs = execution.apply(prices, buys, sells, start, initial_investment, opens = opens, volumes = volumes)
+
+    results = {
+        'strat_returns' : float(investment),
+        'strat_array_returns' : np.concatenate(([0.0], equity)),
+        'time_in_market' : int(time_in_market),
+        'no_of_trades' : int(trades),
+        'no_of_winning_trades' : int(winning_trades)
+    }
+    if costs is not None:
+        results['costs'] = float(costs)
+    if trade_list:
+        results['trade_returns'], results['holding_periods'] = closed_trades(equity, buys, sells, start, initial_investment)
+    return results
+
+
+
+# Buy and hold equity curve. Starting with 'investment' the value is compounded by prices[i] / prices[i - 1] for
+# every bar from 'start' onwards
+
+def buy_and_hold_curve(prices, start, investment):
+    prices = np.asarray(prices, dtype = np.float64).ravel()
+    start = max(int(start), 1)
+    if len(prices) <= start:
+        return np.array([float(investment)])
+    return np.concatenate(([float(investment)], investment * np.cumprod(prices[start:] / prices[start - 1 : -1])))
@@ -0,0 +1,186 @@
+import os
+import json
+import time
+import bisect
+from datetime import date
+
+
+
+'''
+ConstituentIndex() keeps dated snapshots of the S&P 500 constituents (in order of market cap) in a local JSON file, so
+looking up a range of tickers is done in memory instead of scraping a web page every time. Its parameters are:
+path = JSON file the snapshots are stored in (defaults to $STOCK_INFO_CONSTITUENTS_PATH or
+       ~/.cache/mean_reversion_quant_trading/sp500_constituents.json)
+fetcher = function() that returns today's constituents as a list of tickers in order of market cap
+ttl = number of seconds a snapshot is considered up to date by refresh()
+
+Lookups never go to the network. The only exception is the first lookup on an empty store, which takes a snapshot so
+sap500_tickers() works out of the box. New snapshots are only taken by refresh(), which downloads the list when the
+latest snapshot is older than ttl (or force = True) and only stores it if the constituents or their order changed.
+
+Snapshots for past dates can be added with add_snapshot() (e.g. from a historical constituents list). The as_of
+lookups then give the index as it was on that date, so a backtest of a past period can use the tickers that were in the
+index at the time instead of today's (which leaves out the companies that have since dropped out):
+
+index = default_constituents
+index.tickers(0, 50)                                 # Top 50 of the latest snapshot
+index.tickers(0, 50, as_of = '2015-06-30')           # Top 50 of the last snapshot on or before that date
+index.members_between('2010-01-01', '2015-01-01')    # Every ticker in the index at some point in the period
+index.rank('AAPL')
+index.refresh()
+'''
+
+
+
+# Scrapes the S&P 500 constituents from stockanalysis.com, in order of market cap
+
+def stockanalysis_fetcher():
+    import requests as rq
+    from bs4 import BeautifulSoup as bs, SoupStrainer
+
+    response = rq.get('https://stockanalysis.com/list/sp-500-stocks/')
+    response.raise_for_status()
+    soup = bs(response.text, 'html.parser', parse_only = SoupStrainer('td')) # Only the table cells are parsed
+    tickers = []
+    for td in soup.find_all('td'):
+        a_tags = td.find('a')
+        if a_tags:
+            tickers.append(a_tags.text)
+    return tickers
+
+
+
+def _to_date(day):
+    if day is None:
+        return date.today().isoformat()
+    if isinstance(day, str):
+        return date.fromisoformat(day[:10]).isoformat()
+    return day.strftime('%Y-%m-%d') # date, datetime or pandas Timestamp
+
+
+
+class ConstituentIndex():
+
+    def __init__(self, path = None, fetcher = stockanalysis_fetcher, ttl = 7 * 24 * 60 * 60):
+        if path is None:
+            path = os.environ.get('STOCK_INFO_CONSTITUENTS_PATH', os.path.join(os.path.expanduser('~'), '.cache', 'mean_reversion_quant_trading', 'sp500_constituents.json'))
+        self.path = path
+        self.fetcher = fetcher
+        self.ttl = ttl
+        self._store = None # {'checked_at' : time of the last refresh, 'snapshots' : {date : tickers}}, loaded on first use
+        self._dates = []
+        self._ranks = {}
+
+
+    '''
+        File handling
+    '''
+
+    def _load(self):
+        if self._store is None:
+            try:
+                with open(self.path) as f:
+                    self._store = json.load(f)
+            except (OSError, ValueError):
+                self._store = {'checked_at' : None, 'snapshots' : {}}
+            self._dates = sorted(self._store['snapshots'])
+            self._ranks = {}
+        return self._store
+
+    def _save(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok = True)
+        tmp_path = self.path + '.tmp' # Write then rename so a crash never leaves a half written file
+        with open(tmp_path, 'w') as f:
+            json.dump(self._store, f)
+        os.replace(tmp_path, self.path)
+
+
+    '''
+        Snapshots
+    '''
+
+    def snapshot_dates(self):
+        self._load()
+        return list(self._dates)
+
+    # Stores the constituents on a date (replacing any snapshot already on that date)
+    def add_snapshot(self, day, tickers):
+        store = self._load()
+        day = _to_date(day)
+        store['snapshots'][day] = list(tickers)
+        self._dates = sorted(store['snapshots'])
+        self._ranks.pop(day, None)
+        self._save()
+
+    # Downloads today's constituents if the latest snapshot is older than ttl. A new snapshot is only stored when the
+    # list differs from the latest one. Returns True if a snapshot was added
+    def refresh(self, force = False):
+        store = self._load()
+        now = time.time()
+        if not force and store['checked_at'] is not None and now - store['checked_at'] < self.ttl:
+            return False
+
+        tickers = list(self.fetcher())
+        if not tickers:
+            raise ValueError("The fetcher returned no constituents")
+        changed = not self._dates or store['snapshots'][self._dates[-1]] != tickers
+        if changed:
+            store['snapshots'][_to_date(None)] = tickers
+            self._dates = sorted(store['snapshots'])
+            self._ranks.pop(_to_date(None), None)
+        store['checked_at'] = now
+        self._save()
+        return changed
+
+
+    '''
+        Lookups
+    '''
+
+    # Date of the last snapshot on or before as_of (the latest snapshot when as_of is None)
+    def _snapshot_date(self, as_of = None):
+        self._load()
+        if not self._dates:
+            self.refresh(force = True)
+        if as_of is None:
+            return self._dates[-1]
+        i = bisect.bisect_right(self._dates, _to_date(as_of))
+        if i == 0:
+            raise ValueError(f"No constituents snapshot on or before {_to_date(as_of)}, the first is from {self._dates[0]}")
+        return self._dates[i - 1]
+
+    # Tickers ranked index_1 to index_2 (exclusive) by market cap, like sap500_tickers()
+    def tickers(self, index_1 = 0, index_2 = None, as_of = None):
+        day = self._snapshot_date(as_of)
+        return self._store['snapshots'][day][index_1 : index_2]
+
+    # Position of the ticker by market cap (0 is the largest), None if it was not in the index
+    def rank(self, ticker, as_of = None):
+        day = self._snapshot_date(as_of)
+        if day not in self._ranks:
+            self._ranks[day] = {ticker : i for i, ticker in enumerate(self._store['snapshots'][day])}
+        return self._ranks[day].get(ticker)
+
+    # Every ticker that was in the index at some point between start and end (both inclusive), in order of their best rank
+    def members_between(self, start, end):
+        self._snapshot_date() # Takes the first snapshot if the store is empty
+        start, end = _to_date(start), _to_date(end)
+        i = max(bisect.bisect_right(self._dates, start) - 1, 0) # Starting from the snapshot in force at the start
+        j = bisect.bisect_right(self._dates, end)
+        best = {}
+        for day in self._dates[i : j]:
+            for rank, ticker in enumerate(self._store['snapshots'][day]):
+                best[ticker] = min(best.get(ticker, rank), rank)
+        return sorted(best, key = best.get)
+
+
+
+# Index used by sap500_tickers()
+
+default_constituents = ConstituentIndex()
+
+def set_default_constituents(index: ConstituentIndex):
+    global default_constituents
+    default_constituents = index
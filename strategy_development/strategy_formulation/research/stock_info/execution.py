@@ -0,0 +1,110 @@
+import numpy as np
+
+
+
+'''
+Execution cost model for the backtests.
+
+By default the strategies buy and sell at the close of the bar after the signal with no costs. ExecutionModel() adds
+commission = fixed cost of every order
+commission_bps, spread_bps, slippage_bps = costs in basis points of the value traded. Half the spread is paid on every
+                                           order, so the cost of each side is commission_bps + spread_bps / 2 + slippage_bps
+fill = 'close' fills at the close of the trading bar, 'next_open' at its open (the first price after the signal bar's
+       close), which needs the open prices
+max_participation = only buy up to this fraction of the entry bar's volume (needs the volumes). What cannot be bought
+                    is kept as cash until the trade is closed
+
+The signals and the bars we trade on are the same as without costs, so the model is applied after the position loop:
+trade_loop() finds the trades, and apply() works out each trade's fills, costs and equity with array operations over
+the bars it was open for. That is a few NumPy calls per trade, so a backtest with costs runs at about the same speed.
+
+model = ExecutionModel(commission_bps = 1, spread_bps = 5, fill = 'next_open')
+stock.tilted_mean_reversion(period, execution = model, opens = open_prices)
+'''
+
+
+
+FILLS = ('close', 'next_open')
+
+
+
+class ExecutionModel():
+
+    def __init__(self, commission = 0.0, commission_bps = 0.0, spread_bps = 0.0, slippage_bps = 0.0, fill = 'close', max_participation = None):
+        if fill not in FILLS:
+            raise ValueError(f"fill must be one of {FILLS}, got {fill}")
+        self.commission = float(commission)
+        self.commission_bps = float(commission_bps)
+        self.spread_bps = float(spread_bps)
+        self.slippage_bps = float(slippage_bps)
+        self.fill = fill
+        self.max_participation = max_participation
+
+    def __repr__(self):
+        return (f"ExecutionModel(commission = {self.commission}, commission_bps = {self.commission_bps}, spread_bps = {self.spread_bps}, "
+                f"slippage_bps = {self.slippage_bps}, fill = '{self.fill}', max_participation = {self.max_participation})")
+
+    # Cost of one side of a trade as a fraction of the value traded
+    @property
+    def rate(self):
+        return (self.commission_bps + self.spread_bps / 2 + self.slippage_bps) / 1e4
+
+    # True when the model is the same as the cost free backtest
+    @property
+    def frictionless(self):
+        return self.rate == 0 and self.commission == 0 and self.fill == 'close' and self.max_participation is None
+
+
+    # The price of every bar that trades fill at
+    def fill_prices(self, prices, opens = None):
+        if self.fill == 'close':
+            return prices
+        if opens is None:
+            raise ValueError("fill = 'next_open' needs the open prices")
+        opens = np.asarray(opens, dtype = np.float64).ravel()
+        if len(opens) != len(prices):
+            raise ValueError(f"opens has {len(opens)} prices but there are {len(prices)} closes")
+        return opens
+
+
+    # Works out the equity of the trades that trade_loop() found (buys[t] / sells[t] are the bars of trade t, a last buy
+    # with no sell is still open at the end). Returns the equity from bar 'start' onwards (0 when out of the market, as in
+    # backtest()), the final investment, the number of winning trades (after costs) and the total costs paid
+
+    def apply(self, prices, buys, sells, start, investment, opens = None, volumes = None):
+        if self.max_participation is not None and volumes is None:
+            raise ValueError("max_participation needs the volumes")
+        n = len(prices)
+        fills = self.fill_prices(prices, opens)
+        rate, commission = self.rate, self.commission
+        # A position bought at the open is already in the market at the close of the bar it was bought on
+        first_mark = 0 if self.fill == 'next_open' else 1
+
+        equity = np.zeros(max(n - start, 0))
+        investment = float(investment)
+        winning_trades, costs = 0, 0.0
+
+        for t, entry in enumerate(buys):
+            capital = investment
+            amount = capital - commission
+            if self.max_participation is not None:
+                amount = min(amount, self.max_participation * float(volumes[entry]) * fills[entry])
+            amount = max(amount, 0.0)
+            cash = capital - commission - amount
+            units = amount * (1 - rate) / fills[entry]
+            costs += commission + amount * rate
+
+            last = sells[t] if t < len(sells) else n - 1
+            marks = slice(entry + first_mark, last + 1)
+            equity[marks.start - start : marks.stop - start] = cash + units * prices[marks]
+
+            if t < len(sells):
+                value = units * fills[last]
+                investment = cash + value * (1 - rate) - commission
+                costs += value * rate + commission
+                equity[last - start] = investment
+                winning_trades += investment > capital
+            else: # Still in the market at the end, valued at the last close
+                investment = cash + units * prices[-1]
+
+        return equity, investment, winning_trades, costs
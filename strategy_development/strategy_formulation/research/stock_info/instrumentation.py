@@ -0,0 +1,212 @@
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+import pandas as pd
+
+
+
+'''
+Opt-in profiling of the stages of a backtest.
+
+StockInfo, MeanReversion and StockUniverse wrap their expensive steps in stage(), e.g.
+
+with stage('signals', self.ticker, period, bars = len(prices), fits = len(prices) - scope + 1):
+    ...
+
+The stages used are 'data_load', 'signals', 'position_loop', 'metrics' and 'plotting'. When profiling is off, stage()
+returns a shared do-nothing object, so the cost is one function call. To profile something:
+
+with profile() as profiler:
+    performance_analysis(periods, tickers_range, relevant_metrics)
+profiler.summary()                              # Time and counters per stage
+profiler.summary(by = ['ticker', 'stage'])      # ... per ticker (or 'period') and stage
+profiler.chrome_trace('trace.json')             # Open in chrome://tracing or https://ui.perfetto.dev
+
+Stages can be nested (e.g. plotting inside metrics). total_ms includes the nested stages while self_ms does not,
+so the self_ms column adds up to the time spent inside all the stages.
+'''
+
+
+
+_profiler = None
+
+
+
+class _Stage():
+
+    __slots__ = ('profiler', 'name', 'ticker', 'period', 'counters', 'start', 'children')
+
+    def __init__(self, profiler, name, ticker, period, counters):
+        self.profiler = profiler
+        self.name = name
+        self.ticker = ticker
+        self.period = period
+        self.counters = counters
+        self.children = 0
+
+    # Adds to the stage's counters once their values are known, e.g. stage.add(trades = 5)
+    def add(self, **counters):
+        for key, value in counters.items():
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def __enter__(self):
+        self.profiler._stack().append(self)
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc_info):
+        duration = time.perf_counter_ns() - self.start
+        stack = self.profiler._stack()
+        stack.pop()
+        if stack:
+            stack[-1].children += duration
+        self.profiler._record(self, duration)
+        return False
+
+
+
+class _NullStage():
+
+    __slots__ = ()
+
+    def add(self, **counters):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+_NULL_STAGE = _NullStage()
+
+
+
+class Profiler():
+
+    def __init__(self):
+        self.events = []
+        self.origin = time.perf_counter_ns()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def _stack(self):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def _record(self, stage, duration):
+        event = {
+            'stage' : stage.name,
+            'ticker' : stage.ticker,
+            'period' : stage.period,
+            'start_ns' : stage.start - self.origin,
+            'total_ns' : duration,
+            'self_ns' : duration - stage.children,
+            'thread' : threading.get_ident(),
+            'counters' : stage.counters,
+        }
+        with self._lock:
+            self.events.append(event)
+
+    def reset(self):
+        with self._lock:
+            self.events = []
+            self.origin = time.perf_counter_ns()
+
+
+    def to_frame(self) -> pd.DataFrame:
+        rows = [{key : event[key] for key in ('stage', 'ticker', 'period', 'start_ns', 'total_ns', 'self_ns', 'thread')} | event['counters'] for event in self.events]
+        return pd.DataFrame(rows, columns = None if rows else ['stage', 'ticker', 'period', 'start_ns', 'total_ns', 'self_ns', 'thread'])
+
+
+    # One row per stage (or per 'by' group) with the number of calls, times in milliseconds and the summed counters
+
+    def summary(self, by = 'stage') -> pd.DataFrame:
+        df = self.to_frame()
+        by = [by] if isinstance(by, str) else list(by)
+        counters = [column for column in df.columns if column not in ('stage', 'ticker', 'period', 'start_ns', 'total_ns', 'self_ns', 'thread')]
+        groups = df.fillna({column : '' for column in by}).groupby(by, sort = False)
+
+        summary = pd.DataFrame({
+            'calls' : groups.size(),
+            'total_ms' : groups['total_ns'].sum() / 1e6,
+            'self_ms' : groups['self_ns'].sum() / 1e6,
+        })
+        summary['mean_ms'] = summary['total_ms'] / summary['calls']
+        total_self = summary['self_ms'].sum()
+        summary['% of time'] = summary['self_ms'] / total_self * 100 if total_self else 0.0
+        for column in counters:
+            summary[column] = groups[column].sum(min_count = 1)
+        return summary.sort_values('self_ms', ascending = False)
+
+
+    # Chrome trace event format (complete 'X' events, times in microseconds)
+
+    def chrome_trace(self, path = None) -> dict:
+        pid = os.getpid()
+        trace_events = []
+        for event in self.events:
+            args = {key : value for key, value in (('ticker', event['ticker']), ('period', event['period'])) if value is not None}
+            args.update({key : value if isinstance(value, (int, float, str)) else str(value) for key, value in event['counters'].items()})
+            trace_events.append({
+                'name' : event['stage'] if event['ticker'] is None else f"{event['stage']} {event['ticker']}",
+                'cat' : event['stage'],
+                'ph' : 'X',
+                'ts' : event['start_ns'] / 1000,
+                'dur' : event['total_ns'] / 1000,
+                'pid' : pid,
+                'tid' : event['thread'],
+                'args' : args,
+            })
+        trace = {'traceEvents' : trace_events, 'displayTimeUnit' : 'ms'}
+        if path is not None:
+            with open(path, 'w') as f:
+                json.dump(trace, f)
+        return trace
+
+
+
+# Turns a [start_date, end_date, investment] period into the same label performance_analysis uses
+
+def period_label(period):
+    if not period:
+        return None
+    return f"{period[0]} to {period[1]}"
+
+
+def stage(name, ticker = None, period = None, **counters):
+    profiler = _profiler
+    if profiler is None:
+        return _NULL_STAGE
+    return _Stage(profiler, name, ticker, period_label(period), counters)
+
+
+def enabled():
+    return _profiler is not None
+
+def enable(profiler = None) -> Profiler:
+    global _profiler
+    _profiler = profiler if profiler is not None else Profiler()
+    return _profiler
+
+def disable():
+    global _profiler
+    profiler, _profiler = _profiler, None
+    return profiler
+
+
+@contextmanager
+def profile(profiler = None):
+    previous = _profiler
+    profiler = enable(profiler)
+    try:
+        yield profiler
+    finally:
+        if previous is None:
+            disable()
+        else:
+            enable(previous)
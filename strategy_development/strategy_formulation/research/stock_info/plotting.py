@@ -0,0 +1,137 @@
+import os
+import re
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+
+
+'''
+PlotQueue() records the figures a batch run wants to draw and draws them afterwards, so plotting is not interleaved with
+the backtests.
+
+The strategies take graph = True to draw their figure straight away (as before), or graph = a PlotQueue to only record it.
+Recording a figure keeps a reference to its arrays (the equity curves are not copied) along with its title, labels and
+line styles. Afterwards
+render(directory) draws every recorded figure to an image file with matplotlib's headless Agg canvas, in batches on a
+                  process pool (max_workers = 1 draws them in this process)
+show()            draws them in the notebook with pyplot
+Before drawing, each line is decimated to max_points points: the series is split into max_points / 2 buckets, and the
+lowest and highest point of each bucket are kept, so the peaks and drawdowns look the same as the full series on screen.
+
+plots = PlotQueue()
+for ticker, stock in stocks.items():
+    stock.tilted_mean_reversion(period, graph = plots, analysis = False)
+stock.scope_analysis(period, graph = plots)   # One line per scope on one figure
+plots.render('charts')                        # ['charts/strategy_versus_buy_and_hold_for_aapl_0000.png', ...]
+
+A strategy called with a PlotQueue always runs (it is not served from the result cache), so its curves can be recorded.
+'''
+
+
+
+# Lowest and highest point of each bucket, in the order they occur. Returns the x positions and the values
+
+def decimate(y, max_points = 2000):
+    y = np.asarray(y, dtype = np.float64).ravel()
+    n = len(y)
+    if n <= max_points:
+        return np.arange(n), y
+    buckets = max(max_points // 2, 1)
+    size = -(-n // buckets) # Bars per bucket, rounded up
+    padded = np.full(buckets * size, np.nan)
+    padded[:n] = y
+    padded = padded.reshape(buckets, size)
+
+    offsets = np.arange(buckets) * size
+    low = offsets + np.argmin(np.where(np.isnan(padded), np.inf, padded), axis = 1)
+    high = offsets + np.argmax(np.where(np.isnan(padded), -np.inf, padded), axis = 1)
+    x = np.stack((np.minimum(low, high), np.maximum(low, high)), axis = 1).ravel()
+    x = x[np.r_[True, x[1:] != x[:-1]] & (x < n)] # A flat bucket gives the same point twice
+    return x, y[x]
+
+
+
+def _slug(text):
+    return re.sub(r'[^a-z0-9]+', '_', text.lower()).strip('_')
+
+
+
+# Draws figures (with their lines already decimated) onto Agg canvases and saves them. Runs in the worker processes
+
+def _render_batch(figures, directory, format = 'png', dpi = 100):
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    paths = []
+    for spec in figures:
+        figure = Figure(figsize = spec['size'])
+        FigureCanvasAgg(figure)
+        _draw(figure.add_subplot(), spec)
+        path = os.path.join(directory, f"{spec['name']}.{format}")
+        figure.savefig(path, dpi = dpi)
+        paths.append(path)
+    return paths
+
+def _draw(axes, spec):
+    for label, x, y, style in spec['lines']:
+        axes.plot(x, y, label = label, **style)
+    axes.set_title(spec['title'])
+    axes.set_xlabel(spec['xlabel'])
+    axes.set_ylabel(spec['ylabel'])
+    if spec['legend']:
+        axes.legend()
+
+
+
+class PlotQueue():
+
+    def __init__(self, max_points = 2000):
+        self.max_points = max_points
+        self.figures = []
+
+    # lines = list of (label, values) or (label, values, style) where style is passed on to plot(), e.g. {'alpha' : 0.4}.
+    # Returns the figure's name, which is also the name of its image file
+    def add(self, title, lines, xlabel = 'Time', ylabel = 'Investment Value', legend = True, name = None, size = (6.4, 4.8)):
+        if name is None:
+            name = f"{_slug(title)}_{len(self.figures):04d}"
+        lines = [(line[0], np.asarray(line[1]), line[2] if len(line) > 2 else {}) for line in lines]
+        self.figures.append({'name' : name, 'title' : title, 'lines' : lines, 'xlabel' : xlabel, 'ylabel' : ylabel, 'legend' : legend, 'size' : size})
+        return name
+
+    def clear(self):
+        self.figures = []
+
+    def _decimated(self, spec):
+        lines = [(label, *decimate(values, self.max_points), style) for label, values, style in spec['lines']]
+        return spec | {'lines' : lines}
+
+
+    # Saves every recorded figure as directory/<name>.<format> and returns their paths. The figures are sent to the workers
+    # in batches (by default split evenly between them, at most 25 per batch) after decimating them, so only a few
+    # thousand points per line are pickled
+    def render(self, directory, format = 'png', dpi = 100, max_workers = None, batch_size = None, clear = True):
+        os.makedirs(directory, exist_ok = True)
+        figures = [self._decimated(spec) for spec in self.figures]
+        if batch_size is None:
+            batch_size = max(1, min(25, -(-len(figures) // (max_workers or os.cpu_count() or 1))))
+        batches = [figures[i : i + batch_size] for i in range(0, len(figures), batch_size)]
+
+        if max_workers == 1 or len(batches) <= 1:
+            paths = [path for batch in batches for path in _render_batch(batch, directory, format, dpi)]
+        else:
+            with ProcessPoolExecutor(max_workers = max_workers) as pool:
+                paths = [path for batch in pool.map(_render_batch, batches, [directory] * len(batches), [format] * len(batches), [dpi] * len(batches)) for path in batch]
+        if clear:
+            self.clear()
+        return paths
+
+    # Draws every recorded figure with pyplot, e.g. in a notebook
+    def show(self, clear = True):
+        import matplotlib.pyplot as plt
+        for spec in self.figures:
+            spec = self._decimated(spec)
+            figure = plt.figure(figsize = spec['size'])
+            _draw(figure.add_subplot(), spec)
+        plt.show()
+        if clear:
+            self.clear()
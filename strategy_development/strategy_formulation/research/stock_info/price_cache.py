@@ -0,0 +1,317 @@
+import os
+import json
+import time
+import threading
+import pandas as pd
+
+try: # Parquet needs pyarrow, without it the cache falls back to pickle files
+    import pyarrow
+    FILE_FORMAT = 'parquet'
+except ImportError:
+    FILE_FORMAT = 'pkl'
+
+
+
+'''
+PriceCache() stores downloaded prices on disk so that StockInfo(ticker) does not download the full history every time.
+
+There is one file per (ticker, interval, adjustment mode) plus a small JSON file next to it recording which date range
+has been downloaded and when. Its parameters are:
+directory = folder the cache lives in (defaults to $STOCK_INFO_CACHE_DIR or ~/.cache/mean_reversion_quant_trading)
+ttl = number of seconds open ended data (no end date) is considered up to date before the missing tail is downloaded
+max_bytes = once the cache is bigger than this the least recently used tickers are removed
+fetcher = function(ticker, start, end, interval, adjusted) that returns a pandas Series of prices indexed by date
+enabled = set to False to always use the fetcher directly
+
+A repeat load is read from disk. If the requested range goes past the start or end of what is cached, only the missing
+head or tail is downloaded, along with the cached bars next to it. Adjusted prices change all the way back whenever a
+dividend is paid or a stock splits, so if those overlapping bars no longer match the cache the whole range is downloaded
+again rather than joining newly adjusted prices onto old ones.
+
+A cache can be shared by several threads (e.g. StockUniverse loads its chunks on a thread pool). Eviction runs under a
+lock that is also held while a ticker's files are read or written, so it never removes a file another thread is reading.
+'''
+
+
+
+PRICE_COLUMNS = {True : 'Adj Close', False : 'Close'}
+
+
+
+# Downloads the prices from yahoo finance. End dates are exclusive, as in yf.download()
+
+def yfinance_fetcher(ticker, start = None, end = None, interval = '1d', adjusted = True):
+    import yfinance as yf
+    return yf.download(ticker, start = start, end = end, interval = interval)[PRICE_COLUMNS[adjusted]]
+
+
+
+# Offline fetcher that serves prices from a dictionary of {ticker : pandas Series}. Useful for running without a network
+
+def fixture_fetcher(fixtures: dict):
+    def fetcher(ticker, start = None, end = None, interval = '1d', adjusted = True):
+        prices = fixtures.get(ticker, pd.Series(dtype = float))
+        return _slice(prices, start, end)
+    return fetcher
+
+
+
+def _to_timestamp(date):
+    return None if date is None else pd.Timestamp(date)
+
+def _slice(prices, start = None, end = None):
+    start, end = _to_timestamp(start), _to_timestamp(end)
+    mask = pd.Series(True, index = prices.index)
+    if start is not None:
+        mask &= prices.index >= start
+    if end is not None:
+        mask &= prices.index < end # End dates are exclusive, as in yf.download()
+    return prices[mask.to_numpy()]
+
+
+
+class PriceCache():
+
+    def __init__(self, directory = None, ttl = 24 * 60 * 60, max_bytes = 1024 ** 3, fetcher = yfinance_fetcher, enabled = True):
+        if directory is None:
+            directory = os.environ.get('STOCK_INFO_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'mean_reversion_quant_trading'))
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.fetcher = fetcher
+        self.enabled = enabled
+        self._lock = threading.RLock() # Eviction removes files, so it is serialised with reading and writing them
+
+
+    '''
+        File handling
+    '''
+
+    def _key(self, ticker, interval, adjusted):
+        return f"{ticker}_{interval}_{'adj' if adjusted else 'raw'}"
+
+    def _data_path(self, key):
+        return os.path.join(self.directory, f"{key}.{FILE_FORMAT}")
+
+    def _meta_path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def _read(self, key):
+        path = self._data_path(key)
+        if FILE_FORMAT == 'parquet':
+            return pd.read_parquet(path).iloc[:, 0]
+        return pd.read_pickle(path)
+
+    def _write(self, key, prices, meta):
+        os.makedirs(self.directory, exist_ok = True)
+        path = self._data_path(key)
+        tmp_path = path + '.tmp' # Write then rename so a crash never leaves a half written file
+        if FILE_FORMAT == 'parquet':
+            prices.to_frame().to_parquet(tmp_path)
+        else:
+            prices.to_pickle(tmp_path)
+        os.replace(tmp_path, path)
+        self._write_meta(key, meta)
+
+    def _read_meta(self, key):
+        try:
+            with open(self._meta_path(key)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_meta(self, key, meta):
+        with open(self._meta_path(key), 'w') as f:
+            json.dump(meta, f)
+
+
+    '''
+        Loading prices
+    '''
+
+    def _fetch(self, ticker, start, end, interval, adjusted):
+        return self._clean(self.fetcher(ticker, start = start, end = end, interval = interval, adjusted = adjusted), adjusted)
+
+    def _clean(self, prices, adjusted):
+        if isinstance(prices, pd.DataFrame): # Some fetchers return a single column DataFrame
+            prices = prices.iloc[:, 0]
+        prices = prices.dropna()
+        prices.name = PRICE_COLUMNS[adjusted]
+        return prices.sort_index()
+
+    def has(self, ticker, interval = '1d', adjusted = True):
+        key = self._key(ticker, interval, adjusted)
+        return self._read_meta(key) is not None and os.path.exists(self._data_path(key))
+
+
+    # Returns the prices between start (inclusive) and end (exclusive) as a pandas Series
+
+    def load(self, ticker, start = None, end = None, interval = '1d', adjusted = True) -> pd.Series:
+        if not self.enabled:
+            return self._fetch(ticker, start, end, interval, adjusted)
+
+        key = self._key(ticker, interval, adjusted)
+        now = time.time()
+        with self._lock:
+            meta = self._read_meta(key)
+            prices = self._read(key) if meta is not None and os.path.exists(self._data_path(key)) else None
+
+        if prices is None:
+            prices = self._fetch(ticker, start, end, interval, adjusted)
+            if prices.empty: # Do not cache tickers that have no data
+                return prices
+            meta = {'start' : start and str(start), 'end' : end and str(end), 'fetched_at' : now}
+
+        else:
+            cached_start, cached_end = _to_timestamp(meta['start']), _to_timestamp(meta['end'])
+            changed = refetch = False
+
+            # The request starts before the cached data => download the missing head. It is downloaded up to and including
+            # the first cached bar, even when the request ends before the cached data starts, so the cached range is never
+            # left with a gap in it
+            if cached_start is not None and (start is None or pd.Timestamp(start) < cached_start):
+                head = self._fetch(ticker, start, prices.index[0] + pd.Timedelta(days = 1), interval, adjusted)
+                if self._overlap_changed(prices, head):
+                    refetch = True
+                else:
+                    prices = self._merge(head, prices)
+                    meta['start'] = start and str(start)
+                changed = True
+
+            # The request ends after the cached data => only download the missing tail. The last two cached bars are
+            # downloaded again: the last one in case it was incomplete and the one before to check the history has not changed
+            if cached_end is None:
+                need_tail = (now - meta['fetched_at'] > self.ttl) and (end is None or pd.Timestamp(end) > pd.Timestamp(meta['fetched_at'], unit = 's'))
+            else:
+                need_tail = end is None or pd.Timestamp(end) > cached_end
+            if need_tail and not refetch:
+                tail = self._fetch(ticker, prices.index[max(len(prices) - 2, 0)], end, interval, adjusted)
+                if self._overlap_changed(prices.iloc[:-1], tail):
+                    refetch = True
+                else:
+                    prices = self._merge(prices, tail)
+                    meta['end'] = end and str(end)
+                    meta['fetched_at'] = now
+                changed = True
+
+            # The downloaded bars do not match the cached ones (e.g. a dividend or split changed every adjusted price
+            # before it), so they can not be joined together. Download everything the cache and the request cover again
+            if refetch:
+                full_start = None if start is None or cached_start is None else min(pd.Timestamp(start), cached_start)
+                full_end = None if end is None or cached_end is None else max(pd.Timestamp(end), cached_end)
+                fresh = self._fetch(ticker, full_start, full_end, interval, adjusted)
+                if fresh.empty: # A failed download, keep what is cached
+                    return _slice(prices, start, end)
+                prices = fresh
+                meta = {'start' : full_start and str(full_start), 'end' : full_end and str(full_end), 'fetched_at' : now}
+
+            if not changed:
+                meta['last_access'] = now
+                with self._lock:
+                    self._write_meta(key, meta)
+                return _slice(prices, start, end)
+
+        meta['last_access'] = now
+        with self._lock:
+            self._write(key, prices, meta)
+            self.evict(keep = key)
+        return _slice(prices, start, end)
+
+
+    # Caches prices that were downloaded some other way (e.g. many tickers in one request) as the ticker's prices between
+    # start and end, replacing anything cached for it. Returns the prices between start and end, like load()
+
+    def put(self, ticker, prices, start = None, end = None, interval = '1d', adjusted = True) -> pd.Series:
+        prices = self._clean(prices, adjusted)
+        if self.enabled and not prices.empty:
+            key = self._key(ticker, interval, adjusted)
+            now = time.time()
+            meta = {'start' : start and str(start), 'end' : end and str(end), 'fetched_at' : now, 'last_access' : now}
+            with self._lock:
+                self._write(key, prices, meta)
+                self.evict(keep = key)
+        return _slice(prices, start, end)
+
+
+    def _merge(self, old, new):
+        prices = pd.concat([old, new])
+        prices = prices[~prices.index.duplicated(keep = 'last')]
+        return prices.sort_index()
+
+
+    # True when bars downloaded again have different prices to the cached ones, or none of them overlap the cache, so the
+    # new bars can not be joined onto the cached ones. No bars at all (e.g. nothing traded before the cached start) is fine
+
+    def _overlap_changed(self, cached, fetched):
+        if fetched.empty:
+            return False
+        common = cached.index.intersection(fetched.index)
+        if common.empty:
+            return True
+        return bool(((fetched[common] - cached[common]).abs() > 1e-9 * cached[common].abs()).any())
+
+
+    '''
+        Eviction
+    '''
+
+    def _entries(self):
+        if not os.path.isdir(self.directory):
+            return []
+        entries = []
+        for file in os.listdir(self.directory):
+            if not file.endswith(f".{FILE_FORMAT}"):
+                continue
+            key = file[: -len(FILE_FORMAT) - 1]
+            meta = self._read_meta(key) or {}
+            size = os.path.getsize(self._data_path(key))
+            entries.append((meta.get('last_access', meta.get('fetched_at', 0)), size, key))
+        return entries
+
+    def size(self):
+        return sum(size for _, size, _ in self._entries())
+
+    # Removes entries that have not been used for max_age seconds, then the least recently used entries until the
+    # cache is smaller than max_bytes
+
+    def evict(self, max_age = None, keep = None):
+        with self._lock:
+            entries = sorted(self._entries())
+            now = time.time()
+            total = sum(size for _, size, _ in entries)
+            for last_access, size, key in entries:
+                if key == keep:
+                    continue
+                too_old = max_age is not None and now - last_access > max_age
+                if too_old or total > self.max_bytes:
+                    self._remove(key)
+                    total -= size
+
+    def invalidate(self, ticker = None, interval = None, adjusted = None):
+        with self._lock:
+            for _, _, key in self._entries():
+                k_ticker, k_interval, k_mode = key.rsplit('_', 2)
+                if ticker is not None and k_ticker != ticker:
+                    continue
+                if interval is not None and k_interval != interval:
+                    continue
+                if adjusted is not None and k_mode != ('adj' if adjusted else 'raw'):
+                    continue
+                self._remove(key)
+
+    def _remove(self, key):
+        for path in (self._data_path(key), self._meta_path(key)):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+
+# Cache shared by every StockInfo instance unless one is passed in. Set STOCK_INFO_CACHE=0 to turn it off by default
+
+default_cache = PriceCache(enabled = os.environ.get('STOCK_INFO_CACHE', '1') != '0')
+
+def set_default_cache(cache: PriceCache):
+    global default_cache
+    default_cache = cache
@@ -0,0 +1,214 @@
+import os
+import json
+import numpy as np
+import pandas as pd
+
+try: # Imported as part of the stock_info package
+    from . import price_cache
+except ImportError: # When the stock_info folder itself is on the path
+    import price_cache
+
+
+
+'''
+PriceStore() keeps prices on disk as flat binary columns that are opened with np.memmap, for data that is too big to
+hold in memory (e.g. minute bars for hundreds of tickers over many years).
+
+Every (ticker, interval, adjustment mode) is a folder holding
+timestamps.bin = int64 nanoseconds, sorted. Intraday bars are stored as exchange (wall clock) times without a timezone
+                 so they compare directly with dates like '2020-01-02 09:30'. The original timezone is kept in meta.json
+prices.bin = float64 (or float32 with dtype = 'float32' to halve the size) prices
+meta.json = dtype, number of rows and timezone. It is written last, so rows from an interrupted write are ignored
+
+open() returns a StoredPrices object whose arrays are read only memory maps. Only the pages that are actually used are
+read from disk, and they can be dropped again by the OS, so memory use stays flat however long the history is.
+to_frame() wraps the memory maps in a DataFrame without copying them, so StockInfo(ticker, store = store) works as usual
+and every period is sliced by binary search on the timestamps into a view.
+
+store = PriceStore('prices')
+store.ingest(sap500_tickers(0, 500), start = '2024-01-01', interval = '1m')
+stock = MeanReversion('AAPL', interval = '1m', store = store)
+'''
+
+
+
+DTYPES = ('float64', 'float32')
+
+
+
+class StoredPrices():
+
+    def __init__(self, ticker, timestamps, values, tz = None):
+        self.ticker = ticker
+        self.timestamps = timestamps # int64 nanoseconds
+        self.values = values
+        self.tz = tz
+        self._index = None
+
+    def __len__(self):
+        return len(self.values)
+
+    # Zero copy DatetimeIndex over the timestamps
+    @property
+    def index(self) -> pd.DatetimeIndex:
+        if self._index is None:
+            self._index = pd.DatetimeIndex(self.timestamps.view('M8[ns]'), copy = False)
+        return self._index
+
+    # Row range [i, j) between start and end (both inclusive, as in DataFrame.loc), found by binary search
+    def index_range(self, start = None, end = None):
+        rows = self.index.slice_indexer(start, end)
+        return rows.start or 0, len(self) if rows.stop is None else rows.stop
+
+    # Views onto the timestamps and prices between start and end
+    def slice(self, start = None, end = None):
+        i, j = self.index_range(start, end)
+        return self.timestamps[i : j], self.values[i : j]
+
+    def to_frame(self, start = None, end = None) -> pd.DataFrame:
+        i, j = self.index_range(start, end)
+        return pd.DataFrame({self.ticker : self.values[i : j]}, index = self.index[i : j], copy = False)
+
+
+
+class PriceStore():
+
+    def __init__(self, directory = None, dtype = 'float64'):
+        if directory is None:
+            directory = os.environ.get('STOCK_INFO_STORE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'mean_reversion_quant_trading', 'store'))
+        if dtype not in DTYPES:
+            raise ValueError(f"dtype must be one of {DTYPES}, got {dtype}")
+        self.directory = directory
+        self.dtype = dtype
+
+
+    '''
+        File handling
+    '''
+
+    def _folder(self, ticker, interval, adjusted):
+        return os.path.join(self.directory, interval, 'adj' if adjusted else 'raw', ticker)
+
+    def _read_meta(self, folder):
+        try:
+            with open(os.path.join(folder, 'meta.json')) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_meta(self, folder, meta):
+        path = os.path.join(folder, 'meta.json')
+        with open(path + '.tmp', 'w') as f:
+            json.dump(meta, f)
+        os.replace(path + '.tmp', path)
+
+    # Splits a Series of prices into int64 wall clock timestamps and prices
+    def _columns(self, prices, tz):
+        prices = prices.dropna().sort_index()
+        prices = prices[~prices.index.duplicated(keep = 'last')]
+        index = pd.DatetimeIndex(prices.index)
+        if index.tz is not None:
+            index = index.tz_convert(tz).tz_localize(None)
+        return index.as_unit('ns').asi8, prices.to_numpy(dtype = self.dtype)
+
+
+    '''
+        Writing prices
+    '''
+
+    # Replaces the stored prices of the ticker with 'prices' (a pandas Series, or a single column DataFrame)
+    def write(self, ticker, prices, interval = '1d', adjusted = True):
+        if isinstance(prices, pd.DataFrame):
+            prices = prices.iloc[:, 0]
+        folder = self._folder(ticker, interval, adjusted)
+        os.makedirs(folder, exist_ok = True)
+        tz = None if prices.index.tz is None else str(prices.index.tz)
+        timestamps, values = self._columns(prices, tz)
+
+        for name, column in (('timestamps.bin', timestamps), ('prices.bin', values)):
+            path = os.path.join(folder, name)
+            column.tofile(path + '.tmp')
+            os.replace(path + '.tmp', path)
+        self._write_meta(folder, {'dtype' : self.dtype, 'length' : len(values), 'tz' : tz})
+
+    # Adds the prices that come after the last stored timestamp to the end of the files without rewriting them
+    def append(self, ticker, prices, interval = '1d', adjusted = True):
+        if isinstance(prices, pd.DataFrame):
+            prices = prices.iloc[:, 0]
+        folder = self._folder(ticker, interval, adjusted)
+        meta = self._read_meta(folder)
+        if meta is None:
+            return self.write(ticker, prices, interval, adjusted)
+
+        timestamps, values = self._columns(prices, meta['tz'])
+        stored = self.open(ticker, interval, adjusted)
+        if len(stored):
+            new = timestamps > stored.timestamps[-1]
+            timestamps, values = timestamps[new], values[new]
+        if not len(values):
+            return
+
+        length = meta['length']
+        for name, column, itemsize in (('timestamps.bin', timestamps, 8), ('prices.bin', values.astype(meta['dtype']), np.dtype(meta['dtype']).itemsize)):
+            with open(os.path.join(folder, name), 'r+b') as f:
+                f.truncate(length * itemsize) # Drops anything left over from an interrupted append
+                f.seek(0, os.SEEK_END)
+                column.tofile(f)
+        meta['length'] = length + len(values)
+        self._write_meta(folder, meta)
+
+
+    # Downloads (through a PriceCache, by default the one StockInfo uses) and stores the prices of every ticker one at a time.
+    # Returns the tickers that could not be loaded
+
+    def ingest(self, tickers, start = None, end = None, interval = '1d', adjusted = True, cache = None):
+        cache = price_cache.default_cache if cache is None else cache
+        failed = []
+        for ticker in tickers:
+            try:
+                prices = cache.load(ticker, start = start, end = end, interval = interval, adjusted = adjusted)
+                if prices.empty:
+                    raise ValueError(f"No data found for ticker {ticker} in the given date range")
+                self.append(ticker, prices, interval, adjusted)
+            except Exception as e:
+                print(f"An unexpected error occurred loading {ticker}: {e}")
+                failed.append(ticker)
+        return failed
+
+
+    '''
+        Reading prices
+    '''
+
+    def has(self, ticker, interval = '1d', adjusted = True):
+        return self._read_meta(self._folder(ticker, interval, adjusted)) is not None
+
+    def tickers(self, interval = '1d', adjusted = True) -> list:
+        folder = os.path.join(self.directory, interval, 'adj' if adjusted else 'raw')
+        if not os.path.isdir(folder):
+            return []
+        return sorted(ticker for ticker in os.listdir(folder) if self._read_meta(os.path.join(folder, ticker)) is not None)
+
+    def open(self, ticker, interval = '1d', adjusted = True) -> StoredPrices:
+        folder = self._folder(ticker, interval, adjusted)
+        meta = self._read_meta(folder)
+        if meta is None:
+            raise KeyError(f"{ticker} ({interval}) is not in the price store")
+        length = meta['length']
+        if length == 0: # np.memmap cannot map an empty file
+            return StoredPrices(ticker, np.empty(0, dtype = np.int64), np.empty(0, dtype = meta['dtype']), meta['tz'])
+        timestamps = np.memmap(os.path.join(folder, 'timestamps.bin'), dtype = np.int64, mode = 'r', shape = (length,))
+        values = np.memmap(os.path.join(folder, 'prices.bin'), dtype = meta['dtype'], mode = 'r', shape = (length,))
+        return StoredPrices(ticker, timestamps, values, meta['tz'])
+
+    def remove(self, ticker, interval = '1d', adjusted = True):
+        folder = self._folder(ticker, interval, adjusted)
+        for name in ('meta.json', 'timestamps.bin', 'prices.bin'):
+            try:
+                os.remove(os.path.join(folder, name))
+            except OSError:
+                pass
+        try:
+            os.rmdir(folder)
+        except OSError:
+            pass
@@ -0,0 +1,126 @@
+import re
+import numpy as np
+import pandas as pd
+
+
+
+'''
+Builds coarser bars from a finer price series, so a stock only has to be downloaded once at its finest interval
+(e.g. 1m) and its 5m, 1h, 1d and 1wk bars are worked out from it instead of being downloaded separately.
+
+resample_closes(data, interval) keeps the last price of every bar of the new interval. The bars are found with one
+pass over the timestamps (no Python loop per bar):
+intraday intervals  are counted from the first bar of each day, like yahoo's intraday bars which start at the open
+                    (60m bars from 1m prices are 9:30 to 10:30, 10:30 to 11:30, ...)
+1d, 1wk, 1mo, 3mo   are calendar days, weeks (starting on Monday), months and quarters, labelled by the date they start on
+                    and without a time zone, like yahoo's daily bars
+Intraday intervals have to be a whole number of the input's bars (e.g. 15m from 5m prices, not 2m).
+
+bars_in(index, duration) turns a length of calendar time (e.g. '30D', '6h', '1Y') into a number of bars: the typical
+number of bars in a window of that length, counted over the index. Trading hours, weekends and holidays are taken into
+account, so '1Y' is about 252 daily bars and '1D' is about 390 one minute bars.
+'''
+
+
+
+# Length of every intraday interval yahoo finance offers, and the calendar intervals above them in order of length
+
+INTRADAY_INTERVALS = {'1m' : 1, '2m' : 2, '5m' : 5, '15m' : 15, '30m' : 30, '60m' : 60, '90m' : 90, '1h' : 60}
+
+CALENDAR_INTERVALS = ['1d', '1wk', '1mo', '3mo']
+
+_MINUTE_NS = 60 * 10 ** 9
+_DAY_NS = 24 * 60 * _MINUTE_NS
+
+
+
+# Rough length of an interval in minutes, used to check that bars are only resampled to a coarser interval
+
+def interval_minutes(interval):
+    if interval in INTRADAY_INTERVALS:
+        return INTRADAY_INTERVALS[interval]
+    lengths = {'1d' : 24 * 60, '1wk' : 7 * 24 * 60, '1mo' : 31 * 24 * 60, '3mo' : 92 * 24 * 60}
+    if interval not in lengths:
+        raise ValueError(f"Can not resample to interval {interval!r}, valid intervals are {list(INTRADAY_INTERVALS) + CALENDAR_INTERVALS}")
+    return lengths[interval]
+
+
+
+# Last price of every bar of 'interval'. data is a DataFrame (or Series) of prices indexed by time, base is the interval
+# of its bars (None works it out from the most common gap between them)
+
+def resample_closes(data, interval, base = None):
+    minutes = interval_minutes(interval)
+    data = data.dropna(how = 'all')
+    index = pd.DatetimeIndex(data.index)
+    if len(index) == 0:
+        return data
+
+    # Wall clock times, so days start at midnight in the exchange's time zone
+    local = (index.tz_localize(None) if index.tz is not None else index).as_unit('ns').asi8
+    if base in INTRADAY_INTERVALS or base in CALENDAR_INTERVALS:
+        base_minutes = interval_minutes(base)
+    else: # The most common gap between the bars
+        base_minutes = (np.median(np.diff(local)) if len(local) > 1 else _MINUTE_NS) / _MINUTE_NS
+        base = f"{base_minutes:g}m"
+    if minutes < base_minutes:
+        raise ValueError(f"Can not resample {base} bars to the finer interval {interval}")
+
+    days = local // _DAY_NS
+    if interval in INTRADAY_INTERVALS:
+        if minutes % base_minutes:
+            raise ValueError(f"{interval} bars can not be built from {base} bars, it has to be a whole number of them")
+        step = minutes * _MINUTE_NS
+        day_starts = np.flatnonzero(np.r_[True, days[1:] != days[:-1]])
+        session_start = np.repeat(local[day_starts], np.diff(np.r_[day_starts, len(local)]))
+        labels = session_start + (local - session_start) // step * step
+    elif interval == '1d':
+        labels = days * _DAY_NS
+    elif interval == '1wk':
+        labels = (days - (days + 3) % 7) * _DAY_NS # 1970-01-01 was a Thursday, so this is the Monday on or before each day
+    else:
+        months = local.astype('datetime64[ns]').astype('datetime64[M]').astype(np.int64)
+        if interval == '3mo':
+            months = months // 3 * 3
+        labels = months.astype('datetime64[M]').astype('datetime64[ns]').astype(np.int64)
+
+    last = np.flatnonzero(np.r_[labels[1:] != labels[:-1], True]) # Last row of every bar
+    new_index = pd.DatetimeIndex(labels[last].astype('datetime64[ns]'), name = index.name)
+    if interval in INTRADAY_INTERVALS and index.tz is not None:
+        new_index = new_index.tz_localize(index.tz)
+    return data.iloc[last].set_axis(new_index)
+
+
+
+# A length of calendar time: a pandas Timedelta or a string pandas understands ('30D', '6h', '90min', '4W'), plus years
+# and months ('1Y', '6M' or '6mo')
+
+def to_timedelta(duration):
+    if isinstance(duration, str):
+        match = re.fullmatch(r'\s*(\d+(?:\.\d+)?)\s*(Y|y|yr|year|years|mo|month|months|M)\s*', duration)
+        if match:
+            days = 365.25 if match.group(2) in ('Y', 'y', 'yr', 'year', 'years') else 365.25 / 12
+            return pd.Timedelta(days = float(match.group(1)) * days)
+    return pd.Timedelta(duration)
+
+
+
+# Typical (median) number of bars in a window of 'duration' over the index. Integers are already a number of bars and are
+# returned as they are
+
+def bars_in(index, duration):
+    if isinstance(duration, (int, np.integer)):
+        return int(duration)
+    length = to_timedelta(duration).value
+    if length <= 0:
+        raise ValueError(f"duration must be positive, got {duration!r}")
+    times = pd.DatetimeIndex(index).as_unit('ns').asi8
+    if len(times) < 2:
+        raise ValueError(f"Need at least 2 bars to work out how many there are in {duration!r}")
+
+    full = times >= times[0] + length # Windows that fit inside the data
+    if full.any():
+        counts = np.arange(len(times)) - np.searchsorted(times, times - length, side = 'right') + 1
+        return max(int(np.median(counts[full])), 1)
+    # Longer than the data, so scale up the number of bars per unit of time
+    return max(int(round((len(times) - 1) * length / (times[-1] - times[0]))), 1)
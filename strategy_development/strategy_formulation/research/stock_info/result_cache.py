@@ -0,0 +1,276 @@
+import os
+import time
+import pickle
+import sqlite3
+import hashlib
+import inspect
+import functools
+from contextlib import contextmanager
+import numpy as np
+import pandas as pd
+
+
+
+'''
+ResultCache() stores the results of strategy runs in a SQLite file so that running the same (prices, parameters) again
+is a lookup instead of a backtest, e.g. when a notebook re-runs performance_analysis over the same tickers and periods.
+
+The key of a result is a hash of
+- the strategy's name and version. Bump the version whenever the strategy's logic changes so old results are not used
+- the prices the result depends on (the dates and values of the period, plus any bars before it the strategy looks back
+  at). Results are found by content, so new or revised prices give a new key and never return a stale result
+- the parameters of the call
+so nothing has to be invalidated by hand when the data changes. Its parameters are:
+path = SQLite file (defaults to $STOCK_INFO_RESULT_CACHE_PATH or ~/.cache/mean_reversion_quant_trading/results.sqlite)
+max_bytes = once the stored results are bigger than this the least recently used ones are removed
+enabled = set to False to always run the strategy
+
+Strategies opt in with the cached_strategy() decorator (see MeanReversion.tilted_mean_reversion). Calls that plot or
+print (graph = True or analysis = True) are always run, so the output appears, and their result is stored.
+
+Like the profiler, the cache is off unless it is turned on, so nothing is written to disk by default. Pass a ResultCache
+to StockInfo(result_cache = ...), or turn on the shared default cache (or set STOCK_INFO_RESULT_CACHE=1):
+
+cache = enable()                       # Or enable(path = ..., max_bytes = ...)
+performance_analysis(periods, tickers_range, relevant_metrics)
+cache.stats()                          # Hits, misses, entries and size
+cache.invalidate(ticker = 'AAPL')      # Or strategy = ..., version = ...
+cache.clear()
+disable()
+
+with caching() as cache:               # On for the duration of the block
+    ...
+'''
+
+
+
+SIZE_RESYNC_EVERY = 1000 # The stored size is kept as a running total and counted again every this many puts, which
+                         # also picks up results written by other processes
+
+
+
+class ResultCache():
+
+    def __init__(self, path = None, max_bytes = 256 * 1024 ** 2, enabled = True):
+        if path is None:
+            path = os.environ.get('STOCK_INFO_RESULT_CACHE_PATH', os.path.join(os.path.expanduser('~'), '.cache', 'mean_reversion_quant_trading', 'results.sqlite'))
+        self.path = path
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self.hits, self.misses = 0, 0
+        self._connection = None
+        self._pid = None
+        self._size = None # Running total of the stored sizes, None when it has to be counted again
+        self._puts = 0
+
+
+    '''
+        Database handling
+    '''
+
+    # One connection per process, since SQLite connections cannot be shared with the workers of a process pool
+    def _db(self):
+        if self._connection is None or self._pid != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok = True)
+            self._connection = sqlite3.connect(self.path, timeout = 30, isolation_level = None)
+            self._connection.execute('PRAGMA journal_mode = WAL')
+            self._connection.execute('''CREATE TABLE IF NOT EXISTS results (
+                key TEXT PRIMARY KEY, strategy TEXT, version TEXT, ticker TEXT, value BLOB, size INTEGER, last_access REAL)''')
+            self._connection.execute('CREATE INDEX IF NOT EXISTS results_last_access ON results (last_access)')
+            self._pid = os.getpid()
+            self._size = None
+        return self._connection
+
+    def close(self):
+        if self._connection is not None and self._pid == os.getpid():
+            self._connection.close()
+        self._connection = None
+
+
+    '''
+        Keys
+    '''
+
+    # Hash of a slice of prices (DataFrame, Series or array). The dates are part of the hash, so the same prices on
+    # different dates are different data
+    @staticmethod
+    def fingerprint(prices) -> str:
+        digest = hashlib.sha256()
+        if isinstance(prices, (pd.DataFrame, pd.Series)):
+            digest.update(np.ascontiguousarray(pd.DatetimeIndex(prices.index).as_unit('ns').asi8).tobytes())
+            prices = prices.to_numpy()
+        values = np.ascontiguousarray(prices, dtype = np.float64)
+        digest.update(str(values.shape).encode())
+        digest.update(values.tobytes())
+        return digest.hexdigest()
+
+    # Arrays and pandas objects in the parameters are hashed by content, everything else by its repr()
+    @classmethod
+    def key(cls, strategy, version, fingerprint, parameters: dict) -> str:
+        def encode(value):
+            if isinstance(value, (np.ndarray, pd.DataFrame, pd.Series)):
+                return cls.fingerprint(value)
+            return repr(value)
+        text = repr((strategy, str(version), fingerprint, sorted((name, encode(value)) for name, value in parameters.items())))
+        return hashlib.sha256(text.encode()).hexdigest()
+
+
+    '''
+        Reading and writing results
+    '''
+
+    # Returns (True, result) for a hit and (False, None) for a miss
+    def get(self, key):
+        if not self.enabled:
+            return False, None
+        db = self._db()
+        row = db.execute('SELECT value FROM results WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return False, None
+        db.execute('UPDATE results SET last_access = ? WHERE key = ?', (time.time(), key))
+        self.hits += 1
+        return True, pickle.loads(row[0])
+
+    def put(self, key, result, strategy = None, version = None, ticker = None):
+        if not self.enabled:
+            return
+        value = pickle.dumps(result, protocol = pickle.HIGHEST_PROTOCOL)
+        db = self._db()
+        replaced = db.execute('SELECT size FROM results WHERE key = ?', (key,)).fetchone()
+        db.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?)',
+                   (key, strategy, None if version is None else str(version), ticker, value, len(value), time.time()))
+
+        # Only count the stored size from scratch every SIZE_RESYNC_EVERY puts, and only evict once it is too big
+        self._puts += 1
+        if self._size is None or self._puts % SIZE_RESYNC_EVERY == 0:
+            self._size = self.size()
+        else:
+            self._size += len(value) - (replaced[0] if replaced else 0)
+        if self._size > self.max_bytes:
+            self.evict()
+
+
+    '''
+        Eviction
+    '''
+
+    def size(self):
+        return self._db().execute('SELECT COALESCE(SUM(size), 0) FROM results').fetchone()[0]
+
+    # Removes results that have not been used for max_age seconds, then the least recently used results until the
+    # cache is smaller than max_bytes
+    def evict(self, max_age = None):
+        db = self._db()
+        if max_age is not None:
+            db.execute('DELETE FROM results WHERE last_access < ?', (time.time() - max_age,))
+        size = self.size()
+        self._size = size
+        excess = size - self.max_bytes
+        if excess <= 0:
+            return
+        removed, keys = 0, []
+        for key, size in db.execute('SELECT key, size FROM results ORDER BY last_access'):
+            if removed >= excess:
+                break
+            keys.append((key,))
+            removed += size
+        db.executemany('DELETE FROM results WHERE key = ?', keys)
+        self._size -= removed
+
+    def invalidate(self, ticker = None, strategy = None, version = None):
+        conditions = [(column, value) for column, value in (('ticker', ticker), ('strategy', strategy), ('version', version)) if value is not None]
+        where = ' AND '.join(f"{column} = ?" for column, _ in conditions) or '1'
+        self._db().execute(f"DELETE FROM results WHERE {where}", [str(value) for _, value in conditions])
+        self._size = None
+
+    def clear(self):
+        self.invalidate()
+
+    def stats(self) -> dict:
+        entries, size = self._db().execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results').fetchone()
+        return {'hits' : self.hits, 'misses' : self.misses, 'entries' : entries, 'bytes' : size}
+
+
+
+# Cache shared by every StockInfo instance unless one is passed in. It is off unless STOCK_INFO_RESULT_CACHE=1 is set or
+# enable() is called
+
+default_result_cache = ResultCache(enabled = os.environ.get('STOCK_INFO_RESULT_CACHE', '0') == '1')
+
+def set_default_result_cache(cache: ResultCache):
+    global default_result_cache
+    default_result_cache = cache
+
+
+# Turns the default cache on and returns it. Passing any ResultCache parameters (e.g. path = ...) replaces it with a new one
+
+def enable(path = None, **kwargs) -> ResultCache:
+    cache = default_result_cache if path is None and not kwargs else ResultCache(path = path, **kwargs)
+    cache.enabled = True
+    set_default_result_cache(cache)
+    return cache
+
+def disable():
+    default_result_cache.enabled = False
+
+
+# Turns the default cache on for the duration of a with block, then puts back the cache that was there before
+
+@contextmanager
+def caching(path = None, **kwargs):
+    previous, was_enabled = default_result_cache, default_result_cache.enabled
+    cache = enable(path, **kwargs)
+    try:
+        yield cache
+    finally:
+        if cache is not previous:
+            cache.close()
+        previous.enabled = was_enabled
+        set_default_result_cache(previous)
+
+
+
+# Decorator for StockInfo strategy methods that take a period as their first argument and return a dictionary of results.
+# ignore = arguments that do not change the result. lookback(arguments) = number of bars before the period's start that
+# the result also depends on (e.g. a rolling test whose windows start before the period). durations = arguments that can
+# be a length of calendar time, they are turned into a number of bars first (so scope = '6W' and the same number of bars
+# share a result)
+
+def cached_strategy(name, version, ignore = ('graph', 'analysis'), lookback = None, durations = ()):
+    def decorator(method):
+        signature = inspect.signature(method)
+
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            cache = getattr(self, 'result_cache', None)
+            cache = default_result_cache if cache is None else cache
+            if cache is False or not cache.enabled:
+                return method(self, *args, **kwargs)
+
+            arguments = signature.bind(self, *args, **kwargs)
+            arguments.apply_defaults()
+            arguments = dict(arguments.arguments)
+            del arguments['self']
+            period = self.default_period(arguments.pop('period'))
+            for argument in durations:
+                arguments[argument] = self.bars(arguments[argument])
+
+            # The period's prices plus the bars it looks back at
+            i, j = self.data.index.slice_indexer(period[0], period[1]).indices(len(self.data))[:2]
+            prices = self.data.iloc[max(i - (lookback(arguments) if lookback else 0), 0) : j]
+            parameters = {key : value for key, value in arguments.items() if key not in ignore}
+            key = cache.key(name, version, cache.fingerprint(prices), parameters | {'investment' : period[2]})
+
+            if not any(arguments.get(output) for output in ('graph', 'analysis')):
+                hit, result = cache.get(key)
+                if hit:
+                    return result
+            result = method(self, *args, **kwargs)
+            cache.put(key, result, strategy = name, version = version, ticker = self.ticker)
+            return result
+
+        return wrapper
+    return decorator
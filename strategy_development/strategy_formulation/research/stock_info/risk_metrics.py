@@ -0,0 +1,177 @@
+import numpy as np
+
+
+
+'''
+Risk metrics worked out with NumPy over equity curves, for one backtest or a batch of them at once.
+
+The curves are (bars,) arrays or (bars x series) arrays with a column per ticker / parameter set, in the layout the
+backtests use: the strategy's equity is 0 while it is out of the market (as in strat_array_returns) and the benchmark
+is the buy and hold curve. account_curve() turns the strategy's equity into the value of the account, which stays at
+the last sale's value while out of the market, and every metric is worked out from that:
+
+Sharpe ratio, Sortino ratio = annualised mean return over the standard deviation (downside deviation for Sortino) of
+                              the bar returns, with no risk free rate
+Max drawdown % = largest fall from a previous high. Max drawdown duration = most bars spent below a previous high
+CAGR % = compound annual growth rate
+Exposure % = share of the bars we were in the market
+Avg trade return %, Avg holding period (bars), Profit factor (sum of winning trade returns / sum of losing ones, 0 with
+    no losing trades as for the Win / Loss Ratio) = worked out from the closed trades, which the backtests pass in as
+    trade_returns / holding_periods
+B&H Sharpe ratio, B&H Sortino ratio, B&H Max drawdown %, B&H CAGR % = the same for the benchmark
+
+risk_metrics() only works out the metrics asked for in relevant_metrics (and the steps they share once), so asking for
+more metrics only costs what they need.
+'''
+
+
+
+TRADE_METRICS = ['Avg trade return %', 'Avg holding period', 'Profit factor']
+
+RISK_METRICS = ['Sharpe ratio', 'Sortino ratio', 'Max drawdown %', 'Max drawdown duration', 'CAGR %', 'Exposure %',
+                'Avg trade return %', 'Avg holding period', 'Profit factor',
+                'B&H Sharpe ratio', 'B&H Sortino ratio', 'B&H Max drawdown %', 'B&H CAGR %']
+
+
+
+# Number of bars per year of a DatetimeIndex, so the same code works for daily and intraday data
+
+def periods_per_year(index, default = 252):
+    if len(index) < 2:
+        return default
+    years = (index[-1] - index[0]) / np.timedelta64(31557600, 's') # 365.25 days
+    return (len(index) - 1) / years if years > 0 else default
+
+
+
+# Value of the account at every bar: the equity while in the market, otherwise the value we last sold at (or the
+# starting investment before the first trade)
+
+def account_curve(equity, investment):
+    equity = np.asarray(equity, dtype = np.float64)
+    in_market = equity > 0
+    rows = np.arange(len(equity)).reshape((-1,) + (1,) * (equity.ndim - 1))
+    last = np.maximum.accumulate(np.where(in_market, rows, -1), axis = 0) # Last bar we were in the market
+    filled = np.take_along_axis(equity, np.maximum(last, 0), axis = 0)
+    return np.where(last >= 0, filled, np.asarray(investment, dtype = np.float64))
+
+
+
+def bar_returns(curve):
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        return curve[1:] / curve[:-1] - 1
+
+def sharpe_ratio(returns, periods_per_year = 252):
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        ratio = returns.mean(axis = 0) / returns.std(axis = 0, ddof = 1) * np.sqrt(periods_per_year)
+    return np.where(np.isfinite(ratio), ratio, 0.0)
+
+def sortino_ratio(returns, periods_per_year = 252):
+    downside = np.sqrt((np.minimum(returns, 0) ** 2).mean(axis = 0))
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        ratio = returns.mean(axis = 0) / downside * np.sqrt(periods_per_year)
+    return np.where(np.isfinite(ratio), ratio, 0.0)
+
+def max_drawdown(curve):
+    return (curve / np.maximum.accumulate(curve, axis = 0) - 1).min(axis = 0) * 100
+
+# Longest run of bars below the previous high
+def max_drawdown_duration(curve):
+    at_high = curve >= np.maximum.accumulate(curve, axis = 0)
+    rows = np.arange(len(curve)).reshape((-1,) + (1,) * (curve.ndim - 1))
+    last_high = np.maximum.accumulate(np.where(at_high, rows, 0), axis = 0)
+    return (rows - last_high).max(axis = 0)
+
+def cagr(curve, periods_per_year = 252):
+    years = (len(curve) - 1) / periods_per_year
+    if years <= 0:
+        return np.zeros(curve.shape[1:])
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        growth = (curve[-1] / curve[0]) ** (1 / years) - 1
+    return np.where(np.isfinite(growth), growth * 100, 0.0)
+
+
+
+# Average return, average holding period and profit factor of the closed trades. For a batch, trade_returns and
+# holding_periods are lists with an array per series
+
+def trade_statistics(trade_returns, holding_periods):
+    if isinstance(trade_returns, np.ndarray) and trade_returns.dtype != object:
+        trade_returns, holding_periods = [trade_returns], [holding_periods]
+    counts = np.array([len(returns) for returns in trade_returns])
+    returns = np.concatenate([np.asarray(r, dtype = np.float64) for r in trade_returns] + [np.empty(0)])
+    holding = np.concatenate([np.asarray(h, dtype = np.float64) for h in holding_periods] + [np.empty(0)])
+    series = np.repeat(np.arange(len(counts)), counts)
+
+    total = np.bincount(series, weights = returns, minlength = len(counts))
+    held = np.bincount(series, weights = holding, minlength = len(counts))
+    profit = np.bincount(series, weights = np.maximum(returns, 0), minlength = len(counts))
+    loss = np.bincount(series, weights = np.maximum(-returns, 0), minlength = len(counts))
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        return {
+            'Avg trade return %' : np.where(counts > 0, total / counts * 100, 0.0),
+            'Avg holding period' : np.where(counts > 0, held / counts, 0.0),
+            'Profit factor' : np.where(loss > 0, profit / loss, 0.0),
+        }
+
+
+
+# equity = strategy equity curve(s), 0 while out of the market. benchmark = buy and hold curve(s) of the same bars.
+# Returns {metric : value} for one curve, or {metric : array with one value per column} for a batch
+
+def risk_metrics(equity, investment, benchmark = None, trade_returns = None, holding_periods = None, periods_per_year = 252, relevant_metrics = None):
+    relevant_metrics = RISK_METRICS if relevant_metrics is None else [metric for metric in relevant_metrics if metric in RISK_METRICS]
+    equity = np.asarray(equity, dtype = np.float64)
+    one_dimensional = equity.ndim == 1
+    if one_dimensional:
+        equity = equity[:, None]
+
+    steps = {} # Intermediate results shared by several metrics, each worked out once when first needed
+    def step(name):
+        if name not in steps:
+            if name == 'curve':
+                steps[name] = account_curve(equity, investment)
+            elif name == 'returns':
+                steps[name] = bar_returns(step('curve'))
+            elif name == 'benchmark':
+                benchmark_curve = np.asarray(benchmark, dtype = np.float64)
+                steps[name] = benchmark_curve[:, None] if benchmark_curve.ndim == 1 else benchmark_curve
+            elif name == 'benchmark returns':
+                steps[name] = bar_returns(step('benchmark'))
+            elif name == 'trades':
+                steps[name] = trade_statistics(trade_returns, holding_periods)
+        return steps[name]
+
+    output = {}
+    for metric in relevant_metrics:
+        if metric.startswith('B&H ') and benchmark is None:
+            continue
+        if metric in TRADE_METRICS and trade_returns is None:
+            continue
+
+        if metric == 'Sharpe ratio':
+            value = sharpe_ratio(step('returns'), periods_per_year)
+        elif metric == 'Sortino ratio':
+            value = sortino_ratio(step('returns'), periods_per_year)
+        elif metric == 'Max drawdown %':
+            value = max_drawdown(step('curve'))
+        elif metric == 'Max drawdown duration':
+            value = max_drawdown_duration(step('curve'))
+        elif metric == 'CAGR %':
+            value = cagr(step('curve'), periods_per_year)
+        elif metric == 'Exposure %':
+            value = (equity[1:] > 0).mean(axis = 0) * 100 if len(equity) > 1 else np.zeros(equity.shape[1])
+        elif metric in TRADE_METRICS:
+            value = step('trades')[metric]
+        elif metric == 'B&H Sharpe ratio':
+            value = sharpe_ratio(step('benchmark returns'), periods_per_year)
+        elif metric == 'B&H Sortino ratio':
+            value = sortino_ratio(step('benchmark returns'), periods_per_year)
+        elif metric == 'B&H Max drawdown %':
+            value = max_drawdown(step('benchmark'))
+        elif metric == 'B&H CAGR %':
+            value = cagr(step('benchmark'), periods_per_year)
+
+        output[metric] = float(value[0]) if one_dimensional else value
+
+    return output
@@ -0,0 +1,192 @@
+import os
+import math
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+
+'''
+Vectorised Augmented Dickey-Fuller test.
+
+points_of_entry() in Dickey_Fuller_Analysis.ipynb calls statsmodels' adfuller() on every rolling window, which fits a
+separate OLS model for every lag of every window. rolling_adf() instead stacks the lagged difference matrices of many
+windows into one 3D array and solves all of their least squares problems at once with a batched QR decomposition.
+
+For each window the regression is (the same as adfuller(x, regression = 'c'))
+diff(y)_t = const + gamma * y_(t-1) + b_1 * diff(y)_(t-1) + ... + b_lag * diff(y)_(t-lag)
+and the test statistic is the t-statistic of gamma. With lag = None the number of lags is chosen by AIC from
+0 ... maxlag (adfuller's default autolag = 'AIC'), otherwise a fixed number of lags is used, which is faster.
+P-values use MacKinnon's (1994) approximation, exactly as statsmodels does.
+
+ADFCache() stores rolling results keyed by (ticker, scope, lag) so repeated backtests do not recompute them.
+'''
+
+
+
+# MacKinnon (1994) constants for one series with a constant, taken from statsmodels' adfvalues.py
+
+TAU_MAX = 2.74
+TAU_MIN = -18.83
+TAU_STAR = -1.61
+TAU_SMALLP = [2.1659, 1.4412, 0.038269]
+TAU_LARGEP = [1.7339, 0.93202, -0.12745, -0.010368]
+
+_norm_cdf = np.vectorize(lambda z : 0.5 * math.erfc(-z / math.sqrt(2)), otypes = [np.float64])
+
+def mackinnon_pvalue(tstat):
+    tstat = np.asarray(tstat, dtype = np.float64)
+    small = np.polynomial.polynomial.polyval(tstat, TAU_SMALLP)
+    large = np.polynomial.polynomial.polyval(tstat, TAU_LARGEP)
+    pvalue = _norm_cdf(np.where(tstat <= TAU_STAR, small, large))
+    pvalue = np.where(tstat > TAU_MAX, 1.0, pvalue)
+    pvalue = np.where(tstat < TAU_MIN, 0.0, pvalue)
+    return np.where(np.isnan(tstat), np.nan, pvalue)
+
+
+
+# The default maximum lag used by adfuller() for a window of 'length' prices
+
+def default_maxlag(length):
+    return min(length // 2 - 2, int(np.ceil(12.0 * np.power(length / 100.0, 1 / 4.0))))
+
+
+
+# Fits the ADF regression with 'lag' lags on every window (row of 'windows') using its last 'nobs' differences.
+# Returns the t-statistic of gamma and the sum of squared residuals of every window
+
+def _fit(windows, lag, nobs):
+    diffs = np.diff(windows, axis = 1)
+    k = lag + 2
+    design = np.empty((len(windows), nobs, k))
+    design[:, :, 0] = 1.0
+    design[:, :, 1] = windows[:, -nobs - 1 : -1] # Lagged level
+    for j in range(1, lag + 1):
+        design[:, :, j + 1] = diffs[:, -nobs - j : -j] # Lagged differences
+    target = diffs[:, -nobs:]
+
+    q, r = np.linalg.qr(design)
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        r_inv = np.linalg.inv(r)
+        beta = np.einsum('wij,wj->wi', r_inv, np.einsum('wji,wj->wi', q, target))
+        residuals = target - np.einsum('wij,wj->wi', design, beta)
+        ssr = np.einsum('wi,wi->w', residuals, residuals)
+        variance = ssr / (nobs - k)
+        se_gamma = np.sqrt(variance * np.einsum('wj,wj->w', r_inv[:, 1, :], r_inv[:, 1, :]))
+        tstat = beta[:, 1] / se_gamma
+    return tstat, ssr
+
+
+
+# ADF t-statistic of every row of 'windows' (a 2D array of price windows of equal length)
+
+def adf_tstat(windows, lag = None):
+    windows = np.asarray(windows, dtype = np.float64)
+    length = windows.shape[1]
+    constant = windows.max(axis = 1) == windows.min(axis = 1) # adfuller() refuses constant series
+
+    if lag is not None:
+        tstat, _ = _fit(windows, lag, length - 1 - lag)
+        usedlag = np.full(len(windows), lag)
+
+    else:
+        maxlag = default_maxlag(length)
+        if maxlag < 0:
+            raise ValueError(f"A window of {length} prices is too short for the ADF test")
+
+        # Choose the lag with the smallest AIC, with every lag fitted on the same observations so they are comparable
+        nobs = length - 1 - maxlag
+        aic = np.empty((maxlag + 1, len(windows)))
+        for p in range(maxlag + 1):
+            _, ssr = _fit(windows, p, nobs)
+            with np.errstate(divide = 'ignore'):
+                aic[p] = nobs * (np.log(2 * np.pi) + np.log(ssr / nobs) + 1) + 2 * (p + 2)
+        usedlag = np.argmin(np.where(np.isnan(aic), np.inf, aic), axis = 0)
+
+        # Refit each window with its chosen lag on all the observations that lag allows
+        tstat = np.full(len(windows), np.nan)
+        for p in np.unique(usedlag):
+            rows = usedlag == p
+            tstat[rows], _ = _fit(windows[rows], int(p), length - 1 - int(p))
+
+    tstat = np.where(constant, np.nan, tstat)
+    return tstat, usedlag
+
+
+
+# The ADF test on a single series, returns (test statistic, p-value)
+
+def adf_test(prices, lag = None):
+    tstat, _ = adf_tstat(np.asarray(prices, dtype = np.float64).reshape(1, -1), lag = lag)
+    return float(tstat[0]), float(mackinnon_pvalue(tstat)[0])
+
+
+
+# ADF test of every 'scope' sized window. Like rolling_regression(), the value at index e is for the window that ends
+# at e, and the first scope - 1 values are NaN. Windows are processed 'chunk_size' at a time to limit memory use
+
+def rolling_adf(prices, scope, lag = None, chunk_size = 256):
+    y = np.asarray(prices, dtype = np.float64).ravel()
+    n = len(y)
+    tstat = np.full(n, np.nan)
+    usedlag = np.full(n, -1)
+    if n >= scope:
+        windows = sliding_window_view(y, scope)
+        for start in range(0, len(windows), chunk_size):
+            chunk = windows[start : start + chunk_size]
+            ok = ~np.isnan(chunk).any(axis = 1)
+            chunk_tstat = np.full(len(chunk), np.nan)
+            chunk_lag = np.full(len(chunk), -1)
+            if ok.any():
+                chunk_tstat[ok], chunk_lag[ok] = adf_tstat(chunk[ok], lag = lag)
+            tstat[scope - 1 + start : scope - 1 + start + len(chunk)] = chunk_tstat
+            usedlag[scope - 1 + start : scope - 1 + start + len(chunk)] = chunk_lag
+
+    return {'tstat' : tstat, 'pvalue' : mackinnon_pvalue(tstat), 'usedlag' : usedlag}
+
+
+
+class ADFCache():
+
+    # directory = optional folder to also save the results in, so they survive between sessions
+
+    def __init__(self, directory = None):
+        self.directory = directory
+        self.results = {}
+
+    def _path(self, key):
+        ticker, scope, lag = key
+        return os.path.join(self.directory, f"adf_{ticker}_{scope}_{'aic' if lag is None else lag}.npz")
+
+    # Returns rolling_adf(prices, scope, lag) for the ticker, computing it only if it is not cached for these prices
+
+    def rolling_adf(self, ticker, prices, scope, lag = None):
+        y = np.asarray(prices, dtype = np.float64).ravel()
+        key = (ticker, scope, lag)
+
+        result = self.results.get(key)
+        if result is None and self.directory is not None and os.path.exists(self._path(key)):
+            with np.load(self._path(key)) as stored:
+                result = {name : stored[name] for name in stored.files}
+
+        # The cached result is only reused if it was computed on the same prices
+        if result is not None and len(result['prices']) == len(y) and np.array_equal(result['prices'], y, equal_nan = True):
+            self.results[key] = result
+            return result
+
+        result = rolling_adf(y, scope, lag = lag)
+        result['prices'] = y
+        self.results[key] = result
+        if self.directory is not None:
+            os.makedirs(self.directory, exist_ok = True)
+            np.savez(self._path(key), **result)
+        return result
+
+    def invalidate(self, ticker = None):
+        for key in [key for key in self.results if ticker is None or key[0] == ticker]:
+            del self.results[key]
+            if self.directory is not None and os.path.exists(self._path(key)):
+                os.remove(self._path(key))
+
+
+
+adf_cache = ADFCache()
@@ -1,11 +1,24 @@
-import yfinance as yf
 import pandas as pd
-import matplotlib.pyplot as plt
 import numpy as np
-#from statsmodels.tsa.stattools import adfuller
 
-import requests as rq
-from bs4 import BeautifulSoup as bs
+try: # Imported as part of the stock_info package
+    from .backtest import buy_and_hold_curve
+    from . import price_cache
+    from .stationarity import adf_test, adf_cache
+    from .instrumentation import stage
+    from .risk_metrics import risk_metrics, periods_per_year
+    from . import constituents
+    from .plotting import PlotQueue
+    from .resample import resample_closes, bars_in, interval_minutes
+except ImportError: # When the stock_info folder itself is on the path
+    from backtest import buy_and_hold_curve
+    import price_cache
+    from stationarity import adf_test, adf_cache
+    from instrumentation import stage
+    from risk_metrics import risk_metrics, periods_per_year
+    import constituents
+    from plotting import PlotQueue
+    from resample import resample_closes, bars_in, interval_minutes
 
 '''
 StockInfo() is used to gather the 'Adj Close' stock price of stocks from yahoo finance using yfinance.
@@ -16,6 +29,20 @@ end = end date of information retrieval
 interval = frequency of data points
 Valid values for interval include:
 1m, 2m, 5m, 15m, 30m, 60m, 90m, 1d, 5d, 1wk, 1mo, 3mo
+cache = PriceCache used to load the prices (see price_cache.py). None uses the shared default cache, False always downloads
+store = optional PriceStore (see price_store.py). The prices are memory mapped from it instead of being held in memory,
+        which is needed for long intraday histories. Tickers that are not in the store yet are loaded through the cache and added
+result_cache = ResultCache used to memoise strategy results (see result_cache.py). None uses the shared default, which is
+               off until result_cache.enable() is called. False turns it off
+
+Coarser bars do not need another download: load the finest interval wanted once and use resample('1h') for its prices at a
+coarser interval, or at_interval('1h') for a StockInfo of them (see resample.py). The derived bars are kept on the instance.
+Scopes can be given as a length of calendar time instead of a number of bars (e.g. scope = '6W', adf_scope = '1Y'),
+bars(duration) is the number of bars it works out to at this interval:
+
+stock = MeanReversion('AAPL', interval = '1m')
+stock.at_interval('1h').tilted_mean_reversion(None, scope = '5D')
+stock.timeframe_analysis(None, intervals = ['5m', '1h', '1d'], scope = '5D')
 
 
 This methods of this class allow you to conduct mathematical computations on the stock info, 
@@ -28,11 +55,22 @@ class StockInfo():
     
     # By default (no values for start or end) this class stores all the available data as a pandas DataFrame.
     
-    def __init__(self, ticker: str, start = None, end = None, interval = '1d') -> pd.DataFrame:
+    def __init__(self, ticker: str, start = None, end = None, interval = '1d', cache = None, store = None, result_cache = None) -> pd.DataFrame:
         
+        self.result_cache = result_cache
+        if cache is None:
+            cache = price_cache.default_cache
+        elif cache is False:
+            cache = price_cache.PriceCache(enabled = False)
+
         # Includes custom exception handling so future methods do not break if stock info is not available for a set of given parameters
         try:
-            adj_close_prices = yf.download(ticker, start = start, end = end, interval = interval)['Adj Close'].to_frame()
+            with stage('data_load', ticker) as loading:
+                if store is not None:
+                    adj_close_prices = self._open_from_store(store, cache, ticker, start, end, interval)
+                else:
+                    adj_close_prices = cache.load(ticker, start = start, end = end, interval = interval).to_frame()
+                loading.add(bars = len(adj_close_prices))
 
             if adj_close_prices.empty:
                 raise ValueError(f"No Data foound for ticker {ticker} in the given date range")
@@ -49,8 +87,79 @@ class StockInfo():
             print(f"An unexpected error occurres: {e}")
             self.data = pd.DataFrame()
             self.ticker = ticker
+        self.interval = interval
+        self._resampled = {}
     
     
+    # Opens the ticker's prices from the store. Tickers that are not in the store yet are loaded through the cache and
+    # added, and when the request ends after the last stored bar (or is open ended) the missing tail is added first
+
+    @staticmethod
+    def _open_from_store(store, cache, ticker, start, end, interval):
+        if not store.has(ticker, interval):
+            prices = cache.load(ticker, start = start, end = end, interval = interval)
+            if prices.empty:
+                return prices.to_frame()
+            store.append(ticker, prices, interval)
+        else:
+            stored = store.open(ticker, interval)
+            last = stored.index[-1] if len(stored) else None
+            try:
+                bar = pd.Timedelta(minutes = interval_minutes(interval))
+            except ValueError:
+                bar = pd.Timedelta(0)
+            requested = pd.Timestamp.now(tz = stored.tz).tz_localize(None) if end is None else pd.Timestamp(end)
+            if last is None or requested > last + bar:
+                if last is not None and stored.tz is not None: # The store keeps wall clock times, the cache the ticker's timezone
+                    last = last.tz_localize(stored.tz)
+                prices = cache.load(ticker, start = start if last is None else last, end = end, interval = interval)
+                store.append(ticker, prices, interval)
+        data = store.open(ticker, interval).to_frame(start)
+        if end is not None: # End dates are exclusive, as in yf.download()
+            data = data.iloc[: data.index.searchsorted(pd.Timestamp(end))]
+        return data
+
+
+    # Creates an instance from prices that have already been loaded (e.g. by StockUniverse) without downloading anything.
+    # data should be a single column DataFrame of prices indexed by date, interval = the interval of its bars
+
+    @classmethod
+    def from_data(cls, ticker: str, data: pd.DataFrame, result_cache = None, interval = '1d'):
+        stock = cls.__new__(cls)
+        stock.data = data
+        stock.ticker = ticker
+        stock.result_cache = result_cache
+        stock.interval = interval
+        stock._resampled = {}
+        return stock
+
+
+    '''
+        Other intervals
+    '''
+
+    # Prices at a coarser interval (e.g. '5m', '1h', '1d' or '1wk'), built from the loaded bars without downloading anything.
+    # Each interval is only built once
+    def resample(self, interval):
+        if interval == self.interval:
+            return self.data
+        if interval not in self._resampled:
+            with stage('data_load', self.ticker, bars = len(self.data)):
+                self._resampled[interval] = resample_closes(self.data, interval, base = self.interval)
+        return self._resampled[interval]
+
+    # An instance of the same class holding the prices at a coarser interval, so every method can be run on those bars
+    def at_interval(self, interval):
+        if interval == self.interval:
+            return self
+        return type(self).from_data(self.ticker, self.resample(interval), result_cache = self.result_cache, interval = interval)
+
+    # Number of bars in a length of calendar time such as '30D', '6h' or '1Y' (see resample.bars_in). Integers are
+    # already a number of bars and are returned as they are
+    def bars(self, duration):
+        return bars_in(self.data.index, duration)
+
+
     # For all methods we will assume that period is a list with the following layout:
     # period = [start_date, end_date, investment_amount]
     
@@ -68,9 +177,11 @@ class StockInfo():
     '''
 
 
+    # The rows between the period's start and end dates (both inclusive). The dates are found by binary search on the
+    # (sorted) index and the result is a view, so no prices are copied even when the data is memory mapped (see price_store.py)
     def display_data(self, period = None):
         period = self.default_period(period)
-        return self.data.loc[period[0] : period[1]]
+        return self.data.iloc[self.data.index.slice_indexer(period[0], period[1])]
 
     def plot_stock_price(self, period = None):
         period, segment = self.default_period(period), self.display_data(period)
@@ -82,7 +193,7 @@ class StockInfo():
     
     def variance(self, period = None): 
         period = self.default_period(period)
-        segment = self.data.loc[period[0] : period[1]]
+        segment = self.display_data(period)
         return segment.var()
     
     def std(self, period = None):
@@ -90,7 +201,7 @@ class StockInfo():
     
     def mean(self, period = None):
         period = self.default_period(period)
-        segment = self.data.loc[period[0] : period[1]]
+        segment = self.display_data(period)
         return segment.mean()
 
 
@@ -105,7 +216,7 @@ class StockInfo():
     # 'returns' function outputs the returns of the stock in a given interval
     def df_returns(self, period = None) -> pd.DataFrame:
         period = self.default_period(period)
-        segment = self.data.loc[period[0] : period[1]]
+        segment = self.display_data(period)
         return segment.div(segment.iloc[0]).mul(period[2])
 
     def returns(self, period = None) -> float:
@@ -132,7 +243,7 @@ class StockInfo():
 
     def variance_of_returns(self, period = None): # Finds the variance of the Adj Close values
         period = self.default_period(period)
-        segment = self.data.loc[period[0] : period[1]]
+        segment = self.display_data(period)
         return segment.pct_change().mul(period[2]).dropna().var()
 
     def std_of_returns(self, period = None):
@@ -140,7 +251,7 @@ class StockInfo():
     
     def mean_of_returns(self, period = None):
         period = self.default_period(period)
-        segment = self.data.loc[period[0] : period[1]]
+        segment = self.display_data(period)
         return segment.pct_change().mul(period[2]).dropna().mean()
 
 
@@ -151,14 +262,23 @@ class StockInfo():
         Augmented Dickey-Fuller Test
     '''
 
-    # def adf_test(self, period = None, graph = False):
-    #     period = self.default_period(period)
-    #     segment = self.data.loc[period[0] : period[1]]
-    #     arr = segment.iloc[:,0] # Converts 1D Pandas DataFrame to series
-    #     result = adfuller(arr)
-    #     if graph:
-    #         self.plot_stock_price(period)
-    #     return f" ADF Statistic: {result[0]} \np-value: {result[1]}"
+    # lag = None picks the number of lags by AIC like statsmodels' adfuller(), otherwise a fixed number of lags is used
+    def adf_test(self, period = None, graph = False, lag = None):
+        period = self.default_period(period)
+        segment = self.display_data(period)
+        arr = segment.iloc[:,0] # Converts 1D Pandas DataFrame to series
+        result = adf_test(arr.to_numpy(), lag = lag)
+        if graph:
+            self.plot_stock_price(period)
+        return f" ADF Statistic: {result[0]} \np-value: {result[1]}"
+
+    # Rolling ADF test of every 'scope' day window of the whole price history, cached by (ticker, scope, lag).
+    # Returns a DataFrame of the test statistic, p-value and lags used, indexed by the date each window ends on
+    def rolling_adf(self, scope = 252, lag = None):
+        scope = self.bars(scope)
+        key = self.ticker if self.interval == '1d' else f"{self.ticker}_{self.interval}" # Each interval has its own prices
+        result = adf_cache.rolling_adf(key, self.data.iloc[:,0].to_numpy(), scope, lag = lag)
+        return pd.DataFrame({name : result[name] for name in ('tstat', 'pvalue', 'usedlag')}, index = self.data.index)
 
 
 
@@ -166,21 +286,18 @@ class StockInfo():
 
     def buy_and_hold(self, period, scope = 30, graph = True, plotting = False, analysis = True):
         period = self.default_period(period)
-        segment = self.data.loc[period[0] : period[1]]
+        segment = self.display_data(period)
+        scope = self.bars(scope)
         
-        bah_investment = [ period[2] ]
-
-        for i in range(scope, len(segment)):
-            bah_perc_change = segment.iloc[i] / segment.iloc[i - 1]
-            bah_investment.append(bah_investment[-1] * bah_perc_change.iloc[0])
+        with stage('metrics', self.ticker, period, bars = len(segment)):
+            bah_investment = buy_and_hold_curve(segment.iloc[:, 0].to_numpy(dtype = np.float64), scope, period[2]).tolist()
 
         if graph:
-            plt.figure()
-            plt.plot(bah_investment, label = 'Buy and Hold Returns')
-            plt.title(f"Buy and Hold Returns for stock {self.ticker}")
-            plt.xlabel('Time')
-            plt.ylabel('Investment Value')
-            plt.show()
+            with stage('plotting', self.ticker, period):
+                plots = graph if isinstance(graph, PlotQueue) else PlotQueue()
+                plots.add(f"Buy and Hold Returns for stock {self.ticker}", [('Buy and Hold Returns', bah_investment)], legend = False)
+                if plots is not graph:
+                    plots.show()
 
         if analysis:
             print('Buy and Hold Returns:',round(bah_investment[-1], 2), f"  percentage_increase:  {(bah_investment[-1] / period[2] - 1) * 100:.2f} %")
@@ -202,43 +319,56 @@ class StockInfo():
             'no_of_trades'          : The quantity of trades (int),
             'no_of_winning_trades'  : The quantity of winning trades (int)
         }
+        It can also contain 'bah_array_returns' (the buy and hold value at each data point) if the strategy has worked it out already
 
         Then return this function in your custom method
 
     '''
     
-    def strategy_template(self, results: dict, scope, period = None, graph = True, analysis = True):
+    # metrics = names of extra metrics from risk_metrics.py (e.g. ['Sharpe ratio', 'Max drawdown %']) to add to the output.
+    # The trade metrics need the strategy to have run backtest() with trade_list = True
+
+    def strategy_template(self, results: dict, scope, period = None, graph = True, analysis = True, metrics = None):
         period = self.default_period(period)
-        segment = self.data.loc[period[0] : period[1]]
+        segment = self.display_data(period)
+        scope = self.bars(scope)
         
-        bah_investment = self.buy_and_hold(period, scope = scope, graph = False, plotting = True, analysis = False)
+        with stage('metrics', self.ticker, period, bars = len(segment)):
+            # A strategy that has already worked out the buy and hold curve (e.g. the streaming backtest) can pass it in
+            if 'bah_array_returns' in results:
+                bah_investment = results['bah_array_returns']
+            else:
+                bah_investment = self.buy_and_hold(period, scope = scope, graph = False, plotting = True, analysis = False)
+
+            w_l_ratio = 0
+            # Works out the win / loss Ratio
+            if results['no_of_trades'] - results['no_of_winning_trades']:
+                w_l_ratio = results['no_of_winning_trades'] / (results['no_of_trades'] - results['no_of_winning_trades'] )
+            
+            
+            # Works out the risk adjusted return
 
-        w_l_ratio = 0
-        # Works out the win / loss Ratio
-        if results['no_of_trades'] - results['no_of_winning_trades']:
-            w_l_ratio = results['no_of_winning_trades'] / (results['no_of_trades'] - results['no_of_winning_trades'] )
-        
-        
-        # Works out the risk adjusted return
+            perc_in_market = results['time_in_market'] / ( len(segment) - scope )
+            if perc_in_market:
+                risk_adj_returns = ( (results['strat_returns'] / period[2] - 1) * 100 ) / perc_in_market
+            else:
+                risk_adj_returns = 0
 
-        perc_in_market = results['time_in_market'] / ( len(segment) - scope )
-        if perc_in_market:
-            risk_adj_returns = ( (results['strat_returns'] / period[2] - 1) * 100 ) / perc_in_market
-        else:
-            risk_adj_returns = 0
+            if metrics:
+                extra_metrics = risk_metrics(results['strat_array_returns'], period[2], benchmark = bah_investment, trade_returns = results.get('trade_returns'),
+                                             holding_periods = results.get('holding_periods'), periods_per_year = periods_per_year(segment.index), relevant_metrics = metrics)
         
 
         # Plots the results if required
         
+        # graph = a PlotQueue only records the figure, to be drawn after the run (see plotting.py)
         if graph:
-            plt.figure()
-            plt.plot(results['strat_array_returns'], label = 'Stratgey Returns')
-            plt.plot(bah_investment, label = 'Buy and Hold Returns', alpha = 0.4)
-            plt.title(f"Strategy versus Buy and Hold for {self.ticker}")
-            plt.xlabel('Time')
-            plt.ylabel('Investment Value')
-            plt.legend()
-            plt.show()
+            with stage('plotting', self.ticker, period):
+                plots = graph if isinstance(graph, PlotQueue) else PlotQueue()
+                plots.add(f"Strategy versus Buy and Hold for {self.ticker}", [('Stratgey Returns', results['strat_array_returns']),
+                                                                                 ('Buy and Hold Returns', bah_investment, {'alpha' : 0.4})])
+                if plots is not graph:
+                    plots.show()
         
 
         # Rounds all of our key results to 2 decimal places
@@ -246,8 +376,8 @@ class StockInfo():
         def round_2_dp(x):
             return round(x,2)
 
-        bah_returns = round_2_dp(bah_investment[-1])
-        bah_perc_returns = round_2_dp((bah_investment[-1] / period[2] - 1) * 100)
+        bah_returns = round_2_dp(float(bah_investment[-1]))
+        bah_perc_returns = round_2_dp((float(bah_investment[-1]) / period[2] - 1) * 100)
 
         strat_returns = round_2_dp(results['strat_returns'])
         strat_perc_returns = round_2_dp((results['strat_returns'] / period[2] - 1) * 100)
@@ -258,8 +388,10 @@ class StockInfo():
 
         if analysis:
             print('Initial Investment:',period[2],'\nBuy and Hold Returns:',bah_returns, f"  Percentage Increase:  {bah_perc_returns} %" ,'\nStrategy Returns:',strat_returns,f"      Percentage Increase:  {strat_perc_returns} %",f" Risk-Adjusted Returns: {strat_risk_adj_returns} %",'\nNumber of Trades:',trades,'       Win / Loss Ratio:', w_l_ratio)
+            if 'costs' in results:
+                print('Trading Costs:', round_2_dp(results['costs']))
         
-        return {
+        output = {
             'B&H increase'                  : bah_returns, 
             'B&H % increase'                : bah_perc_returns, 
             'Strat increase'                : strat_returns, 
@@ -268,23 +400,20 @@ class StockInfo():
             'No. of trades'                 : trades, 
             'Win / Loss Ratio'              : w_l_ratio,
         }
+        # Backtests run with an ExecutionModel (see execution.py) are already net of costs, this is how much they were
+        if 'costs' in results:
+            output['Trading costs'] = round_2_dp(results['costs'])
+        if metrics:
+            output.update({metric : round_2_dp(value) for metric, value in extra_metrics.items()})
+        return output
 
 
 
 
 
 
-# This function finds S&P500 stock tickers in order of market cap
-
-def sap500_tickers(index_1, index_2):
+# This function finds S&P500 stock tickers in order of market cap. They are looked up in the local snapshots of the
+# constituents (see constituents.py), as_of = date gives the index as it was on that date
 
-    url = 'https://stockanalysis.com/list/sp-500-stocks/'
-    response = rq.get(url)
-    soup = bs(response.text, 'html.parser')
-    table_entries = soup.find_all('td')
-    tickers = []
-    for td in table_entries:
-        a_tags = td.find('a')
-        if a_tags:
-            tickers.append(a_tags.text)
-    return tickers[index_1 : index_2]
\ No newline at end of file
+def sap500_tickers(index_1, index_2, as_of = None):
+    return constituents.default_constituents.tickers(index_1, index_2, as_of = as_of)
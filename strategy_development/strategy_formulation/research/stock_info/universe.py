@@ -0,0 +1,167 @@
+import numpy as np
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+
+try: # Imported as part of the stock_info package
+    from . import price_cache
+    from .price_cache import PRICE_COLUMNS
+    from .instrumentation import stage
+except ImportError: # When the stock_info folder itself is on the path
+    import price_cache
+    from price_cache import PRICE_COLUMNS
+    from instrumentation import stage
+
+
+
+'''
+StockUniverse() loads the prices of a whole list of tickers (e.g. the output of sap500_tickers) into one panel.
+
+The tickers are loaded in chunks of 'chunk_size' with at most 'max_workers' chunks loading at once. By default the
+chunks are loaded through the shared PriceCache (see price_cache.py) by cached_panel_fetcher(): tickers already
+downloaded are read from disk, the tickers of a chunk that are not cached yet are downloaded in one yf.download and
+cached, and cached tickers whose range has to be extended download their missing head or tail one ticker at a time.
+fetcher = yfinance_panel_fetcher downloads each whole chunk in one yf.download instead, without the cache. The result is
+stored as:
+self.dates = the union of every ticker's dates (pandas DatetimeIndex)
+self.tickers = the tickers that returned data, in the order they were given (tickers with no data are in self.failed)
+self.values = 2D float64 array of prices with shape (dates, tickers). It is column major so each ticker's prices are contiguous
+self.valid = boolean array with the same shape, True where the ticker actually had a price on that date
+
+A ticker's prices are NaN on every date it did not trade, including gaps in the middle of its history (e.g. a trading
+halt, or a holiday of its own exchange in a universe of several), so no flat bars are made up for it. The panel
+backtests run such a ticker on its own dates only (see panel_backtest.py).
+stock(ticker) and stocks() create StockInfo objects (or any subclass such as MeanReversion) of the ticker's own dates,
+the same data as loading it on its own. When the ticker has no gaps its data is a view onto the panel, so no prices
+are copied.
+'''
+
+
+
+# Downloads the prices for a list of tickers in one request. Returns a DataFrame with one column per ticker
+
+def yfinance_panel_fetcher(tickers, start = None, end = None, interval = '1d', adjusted = True):
+    import yfinance as yf
+    prices = yf.download(list(tickers), start = start, end = end, interval = interval, group_by = 'column')[PRICE_COLUMNS[adjusted]]
+    if isinstance(prices, pd.Series): # A single ticker comes back as a Series
+        prices = prices.to_frame(tickers[0])
+    return prices
+
+
+
+# Panel fetcher that loads the tickers through a PriceCache, so previously downloaded tickers are read from disk. None
+# uses the shared default cache (price_cache.default_cache) at the time of loading. The tickers that are not cached yet
+# are downloaded together with one call of panel_fetcher and then cached. panel_fetcher = None uses yfinance_panel_fetcher
+# when the cache downloads from yahoo finance, otherwise (e.g. a fixture_fetcher) they are loaded one at a time
+
+def cached_panel_fetcher(cache = None, panel_fetcher = None):
+    def fetcher(tickers, start = None, end = None, interval = '1d', adjusted = True):
+        loader = price_cache.default_cache if cache is None else cache
+        bulk = panel_fetcher
+        if bulk is None and loader.fetcher is price_cache.yfinance_fetcher:
+            bulk = yfinance_panel_fetcher
+
+        columns = {}
+        missing = [ticker for ticker in tickers if not loader.has(ticker, interval, adjusted)]
+        if bulk is not None and missing:
+            try:
+                downloaded = bulk(missing, start = start, end = end, interval = interval, adjusted = adjusted)
+            except Exception as e:
+                print(f"An unexpected error occurred loading {missing[0]} to {missing[-1]}: {e}")
+                downloaded = pd.DataFrame()
+            for ticker in missing:
+                if ticker in downloaded.columns and downloaded[ticker].notna().any():
+                    columns[ticker] = loader.put(ticker, downloaded[ticker], start = start, end = end, interval = interval, adjusted = adjusted)
+
+        # Cached tickers, and any the download above did not return
+        for ticker in tickers:
+            if ticker in columns:
+                continue
+            try:
+                columns[ticker] = loader.load(ticker, start = start, end = end, interval = interval, adjusted = adjusted)
+            except Exception as e:
+                print(f"An unexpected error occurred loading {ticker}: {e}")
+        return pd.DataFrame({ticker : columns[ticker] for ticker in tickers if ticker in columns})
+    return fetcher
+
+
+
+class StockUniverse():
+
+    def __init__(self, tickers, start = None, end = None, interval = '1d', adjusted = True, fetcher = None, chunk_size = 50, max_workers = 4):
+        if fetcher is None:
+            fetcher = cached_panel_fetcher()
+        tickers = list(dict.fromkeys(tickers)) # Removes duplicates but keeps the order
+        chunks = [tickers[i : i + chunk_size] for i in range(0, len(tickers), chunk_size)]
+
+        def fetch_chunk(chunk):
+            try:
+                with stage('data_load', f"{chunk[0]} to {chunk[-1]}", tickers = len(chunk)):
+                    return fetcher(chunk, start = start, end = end, interval = interval, adjusted = adjusted)
+            except Exception as e:
+                print(f"An unexpected error occurred loading {chunk[0]} to {chunk[-1]}: {e}")
+                return pd.DataFrame()
+
+        with ThreadPoolExecutor(max_workers = max_workers) as pool:
+            frames = [frame for frame in pool.map(fetch_chunk, chunks) if not frame.empty]
+
+        panel = pd.concat(frames, axis = 1).sort_index() if frames else pd.DataFrame()
+        panel = panel.loc[:, ~panel.columns.duplicated()]
+        panel = panel.dropna(axis = 1, how = 'all') # Filters out tickers with no data
+
+        self.interval = interval
+        self.tickers = [ticker for ticker in tickers if ticker in panel.columns]
+        self.failed = [ticker for ticker in tickers if ticker not in panel.columns]
+        self.ticker_index = {ticker : i for i, ticker in enumerate(self.tickers)}
+        self.dates = pd.DatetimeIndex(panel.index)
+
+        panel = panel[self.tickers]
+        self.valid = panel.notna().to_numpy()
+        self.values = np.asfortranarray(panel.to_numpy(dtype = np.float64))
+
+        # First and last row that each ticker has a price for
+        any_valid = self.valid.any(axis = 0)
+        self.first = np.where(any_valid, self.valid.argmax(axis = 0), 0)
+        self.last = np.where(any_valid, len(self.dates) - 1 - self.valid[::-1].argmax(axis = 0), -1)
+
+        if self.failed:
+            print(f"No data found for tickers {self.failed}")
+
+
+    def __len__(self):
+        return len(self.tickers)
+
+    def __contains__(self, ticker):
+        return ticker in self.ticker_index
+
+
+    # The rows of the dates a single ticker traded on. A slice (so its prices are a view onto the panel) when it has no
+    # gaps, otherwise the row numbers
+
+    def _rows(self, ticker):
+        j = self.ticker_index[ticker]
+        rows = slice(self.first[j], self.last[j] + 1)
+        if self.valid[rows, j].all():
+            return rows
+        return np.flatnonzero(self.valid[:, j])
+
+    def prices(self, ticker) -> np.ndarray:
+        return self.values[self._rows(ticker), self.ticker_index[ticker]]
+
+    def to_frame(self) -> pd.DataFrame:
+        return pd.DataFrame(self.values, index = self.dates, columns = self.tickers)
+
+
+    # Creates a StockInfo (or subclass) object for the ticker without downloading anything
+
+    def stock(self, ticker, stock_class = None):
+        if stock_class is None:
+            try:
+                from .stock_info import StockInfo
+            except ImportError:
+                from stock_info import StockInfo
+            stock_class = StockInfo
+        data = pd.DataFrame({ticker : self.prices(ticker)}, index = self.dates[self._rows(ticker)], copy = False)
+        return stock_class.from_data(ticker, data, interval = self.interval)
+
+    def stocks(self, stock_class = None) -> dict:
+        return {ticker : self.stock(ticker, stock_class) for ticker in self.tickers}
@@ -0,0 +1,250 @@
+try: # When doing analysis is strategy_analysis folder
+    from strategy_formulation.strategy.rolling_regression import rolling_regression, threshold_signals
+    from strategy_formulation.research.stock_info.risk_metrics import risk_metrics, periods_per_year, RISK_METRICS, TRADE_METRICS
+except ImportError: # When tunning this script directly
+    from strategy.rolling_regression import rolling_regression, threshold_signals
+    from research.stock_info.risk_metrics import risk_metrics, periods_per_year, RISK_METRICS, TRADE_METRICS
+import numpy as np
+
+
+
+'''
+Cross-sectional version of MeanReversion.tilted_mean_reversion().
+
+Instead of running the strategy one ticker and one period at a time, panel_tilted_mean_reversion() takes a 2D
+(dates x tickers) price array, such as StockUniverse.values, and runs every ticker at once:
+1. The regression bands and buy / sell signals of every column are computed together by rolling_regression()
+2. The position loop steps through the dates once, with the position, investment and counters of every ticker held
+   in arrays so each step is a handful of NumPy operations over all tickers
+
+Missing prices should be NaN. Within each period a ticker's segment runs from its first to its last price, exactly like
+self.data.loc[period[0] : period[1]] does for a single ticker, so the results match strategy_template(). A ticker with
+missing prices inside its segment (dates it did not trade) is run on its own dates only, as it would be on its own.
+
+An ExecutionModel (see execution.py) with close fills and no volume cap can be passed in to charge its commission and
+basis point costs on every buy and sell, giving the same results as backtest() with that model. Any RISK_METRICS
+(see risk_metrics.py) in relevant_metrics are worked out for every column from the same equity curves.
+'''
+
+
+
+TEMPLATE_METRICS = ['B&H increase', 'B&H % increase', 'Strat increase', 'Strat % increase', 'Strat risk-adj % increase', 'No. of trades', 'Win / Loss Ratio']
+
+
+
+# Steps through every date once for all tickers. starts[j] / ends[j] are the first and last bar the loop runs over for
+# column j. Returns the strategy equity curves along with the final investment, time in market, trades, winning
+# trades, buy and hold value and trading costs (0 without an execution model) of every column, and the closed trades'
+# summed returns, profits, losses and holding periods (for the trade metrics of risk_metrics.py)
+
+def panel_position_loop(prices, entries, exits, starts, ends, investment, execution = None):
+    if execution is not None and (execution.fill != 'close' or execution.max_participation is not None):
+        raise ValueError("The panel backtest only supports execution models with fill = 'close' and no max_participation")
+    rate, commission = (execution.rate, execution.commission) if execution is not None else (0.0, 0.0)
+    n, k = prices.shape
+    equity = np.zeros((n, k))
+    position = np.zeros(k, dtype = bool)
+    strat_investment = np.full(k, float(investment))
+    bah_investment = np.full(k, float(investment))
+    starting_point = np.zeros(k)
+    trade_capital = np.zeros(k) # Investment before the open trade (and its costs)
+    entry_bar = np.zeros(k, dtype = int)
+    costs = np.zeros(k)
+    closed = {'count' : np.zeros(k, dtype = int), 'returns' : np.zeros(k), 'profit' : np.zeros(k), 'loss' : np.zeros(k), 'holding' : np.zeros(k, dtype = int)}
+    time_in_market, trades, winning_trades = np.zeros(k, dtype = int), np.zeros(k, dtype = int), np.zeros(k, dtype = int)
+
+    first_bar = max(int(starts.min()), 1) if k else n
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        for i in range(first_bar, n):
+            active = (starts <= i) & (i <= ends)
+            perc_change = prices[i] / prices[i - 1]
+            bah_investment = np.where(active, bah_investment * perc_change, bah_investment)
+
+            # Increase investment if we are in the market
+            held = position & active
+            strat_investment = np.where(held, strat_investment * perc_change, strat_investment)
+            equity[i] = np.where(held, strat_investment, 0)
+            time_in_market += held
+
+            # If we go above n std above the linear model line => sell
+            sell = held & exits[i]
+            if sell.any():
+                if execution is None:
+                    winning_trades += sell & (prices[i] > starting_point)
+                else:
+                    costs += np.where(sell, strat_investment * rate + commission, 0)
+                    strat_investment = np.where(sell, strat_investment * (1 - rate) - commission, strat_investment)
+                    equity[i] = np.where(sell, strat_investment, equity[i])
+                    winning_trades += sell & (strat_investment > trade_capital)
+                trade_return = np.where(sell, strat_investment / trade_capital - 1, 0)
+                closed['count'] += sell
+                closed['returns'] += trade_return
+                closed['profit'] += np.maximum(trade_return, 0)
+                closed['loss'] += np.maximum(-trade_return, 0)
+                closed['holding'] += np.where(sell, i - entry_bar, 0)
+                position &= ~sell
+
+            # if we are not in the market and the price is below n std below the linear model line -> buy
+            buy = active & ~position & entries[i]
+            trades += buy
+            starting_point = np.where(buy, prices[i], starting_point)
+            trade_capital = np.where(buy, strat_investment, trade_capital)
+            entry_bar = np.where(buy, i, entry_bar)
+            if execution is not None:
+                costs += np.where(buy, (strat_investment - commission) * rate + commission, 0)
+                strat_investment = np.where(buy, (strat_investment - commission) * (1 - rate), strat_investment)
+            position |= buy
+
+    return equity, strat_investment, time_in_market, trades, winning_trades, bah_investment, costs, closed
+
+
+
+# Runs the strategy on every column of one period's segment of prices and returns each strategy_template() metric as
+# an array with one value per column (unrounded). A regression that has already been computed for this segment and
+# scope can be passed in to avoid recomputing it. metrics = extra metrics from risk_metrics.py to work out as well
+
+def panel_period_results(segment, investment, scope = 30, buy_range = 2, sell_range = 2, regression = None, execution = None,
+                         metrics = None, periods_per_year = 252):
+    n = len(segment)
+
+    # First and last price of each ticker inside the period
+    valid = ~np.isnan(segment)
+    has_data = valid.any(axis = 0)
+    first = np.where(has_data, valid.argmax(axis = 0), 0)
+    last = np.where(has_data, n - 1 - valid[::-1].argmax(axis = 0), -1)
+    segment_length = np.where(has_data, last - first + 1, 0)
+
+    # buy_signal[i - 1] / sell_signal[i - 1] are the decisions made at bar i
+    if regression is None:
+        regression = rolling_regression(segment, scope)
+    buy_signal, sell_signal = threshold_signals(segment, regression, buy_range = buy_range, sell_range = sell_range)
+    entries = np.zeros_like(buy_signal)
+    exits = np.zeros_like(sell_signal)
+    entries[1:] = buy_signal[:-1]
+    exits[1:] = sell_signal[:-1]
+
+    equity, strat_investment, time_in_market, trades, winning_trades, bah_investment, costs, closed = panel_position_loop(segment, entries, exits, first + scope, last, investment, execution = execution)
+
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        losing_trades = trades - winning_trades
+        w_l_ratio = np.where(losing_trades != 0, winning_trades / losing_trades, 0)
+
+        days_after_scope = segment_length - scope
+        perc_in_market = np.where(days_after_scope != 0, time_in_market / days_after_scope, 0)
+        risk_adj_returns = np.where(perc_in_market != 0, ( (strat_investment / investment - 1) * 100 ) / perc_in_market, 0)
+
+    results = {
+        'B&H increase'                  : bah_investment,
+        'B&H % increase'                : (bah_investment / investment - 1) * 100,
+        'Strat increase'                : strat_investment,
+        'Strat % increase'              : (strat_investment / investment - 1) * 100,
+        'Strat risk-adj % increase'     : risk_adj_returns,
+        'No. of trades'                 : trades,
+        'Win / Loss Ratio'              : w_l_ratio,
+        'equity'                        : equity,
+    }
+    if execution is not None:
+        results['Trading costs'] = costs
+    if metrics:
+        results.update(panel_risk_metrics(segment, equity, first + scope, last, investment, closed, metrics, periods_per_year))
+
+    # Tickers with dates they did not trade inside the segment are run again on just their own dates. On the missing
+    # dates their equity carries on from the last date while the position is held, and is 0 out of the market
+    rows = np.arange(n)[:, None]
+    gapped = np.flatnonzero(((rows >= first) & (rows <= last) & ~valid).any(axis = 0))
+    for j in gapped:
+        traded = np.flatnonzero(valid[:, j])
+        single = panel_period_results(segment[traded, j : j + 1], investment, scope = scope, buy_range = buy_range, sell_range = sell_range,
+                                      execution = execution, metrics = metrics, periods_per_year = periods_per_year)
+        for metric, values in single.items():
+            if metric != 'equity':
+                results[metric][j] = values[0]
+        column = np.full(n, np.nan)
+        column[traded] = single['equity'][:, 0]
+        held = forward_fill(column[:, None])[:, 0]
+        following = forward_fill(column[::-1, None])[::-1, 0] # Equity on the next date it traded
+        results['equity'][:, j] = np.where(np.isnan(column), np.where(following > 0, held, 0), column)
+    return results
+
+
+
+# Fills each column's missing prices with its last known price, like pd.DataFrame(prices).ffill()
+
+def forward_fill(prices):
+    rows = np.arange(len(prices))[:, None]
+    last = np.maximum.accumulate(np.where(np.isnan(prices), 0, rows), axis = 0) # Last row with a price (or row 0)
+    return np.take_along_axis(prices, last, axis = 0)
+
+
+
+# risk_metrics() of every column over the same bars strategy_template() uses (from the bar before the ticker's first
+# trading bar to its last price). Columns that share those bars are worked out together
+
+def panel_risk_metrics(segment, equity, starts, ends, investment, closed, metrics, periods_per_year = 252):
+    k = segment.shape[1]
+    output = {metric : np.zeros(k) for metric in metrics if metric in RISK_METRICS}
+    prices = forward_fill(segment)
+
+    tradeable = ends >= starts
+    windows = np.stack((starts, ends), axis = 1)
+    for start, end in np.unique(windows[tradeable], axis = 0):
+        columns = np.flatnonzero(tradeable & (starts == start) & (ends == end))
+        rows = slice(start - 1, end + 1)
+        benchmark = investment * prices[rows, columns] / prices[start - 1, columns]
+        values = risk_metrics(equity[rows, columns], investment, benchmark = benchmark, periods_per_year = periods_per_year, relevant_metrics = metrics)
+        for metric, value in values.items():
+            output[metric][columns] = value
+
+    # Trade metrics from the loop's running totals of the closed trades
+    count = closed['count']
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        trade_metrics = {
+            'Avg trade return %' : np.where(count > 0, closed['returns'] / count * 100, 0.0),
+            'Avg holding period' : np.where(count > 0, closed['holding'] / count, 0.0),
+            'Profit factor' : np.where(closed['loss'] > 0, closed['profit'] / closed['loss'], 0.0),
+        }
+    for metric in TRADE_METRICS:
+        if metric in output:
+            output[metric] = trade_metrics[metric]
+    return output
+
+
+
+# Rounds the metrics in the same way as strategy_template()
+
+def round_metric(metric, value):
+    if metric == 'No. of trades':
+        return int(value)
+    return round(float(value), 2)
+
+
+
+def panel_tilted_mean_reversion(prices, dates, tickers, periods, scope = 30, buy_range = 2, sell_range = 2, relevant_metrics = None, return_equity = False, execution = None):
+    import pandas as pd # Only needed for the output, so the position loop can be imported with just NumPy
+    prices = np.asarray(prices, dtype = np.float64)
+    dates = pd.DatetimeIndex(dates)
+    if relevant_metrics is None:
+        relevant_metrics = TEMPLATE_METRICS
+
+    output_data = {(ticker, metric) : [] for ticker in tickers for metric in relevant_metrics}
+    index_labels = [f"{start} to {end}" for start, end, _ in periods]
+    equity_curves = {}
+    metrics = [metric for metric in relevant_metrics if metric in RISK_METRICS]
+
+    for label, (start, end, investment) in zip(index_labels, periods):
+        rows = dates.slice_indexer(start, end)
+        segment = prices[rows]
+        results = panel_period_results(segment, investment, scope = scope, buy_range = buy_range, sell_range = sell_range, execution = execution,
+                                       metrics = metrics, periods_per_year = periods_per_year(dates[rows]))
+        equity_curves[label] = results['equity']
+
+        for j, ticker in enumerate(tickers):
+            for metric in relevant_metrics:
+                output_data[(ticker, metric)].append(round_metric(metric, results[metric][j]))
+
+    output_df = pd.DataFrame(output_data)
+    output_df.index = index_labels
+
+    if return_equity:
+        return output_df, equity_curves
+    return output_df
@@ -0,0 +1,213 @@
+try: # When doing analysis is strategy_analysis folder
+    from strategy_formulation.strategy.rolling_regression import rolling_regression, threshold_signals
+except ImportError: # When tunning this script directly
+    from strategy.rolling_regression import rolling_regression, threshold_signals
+import numpy as np
+import pandas as pd
+
+
+
+'''
+Portfolio version of the tilted mean reversion strategy, where every ticker of a universe trades out of one pool of capital.
+
+panel_tilted_mean_reversion() gives every ticker its own period[2] investment. portfolio_position_loop() instead steps
+through the dates once with a single cash balance, and at each date
+1. sells the positions whose exit signal fired (or whose ticker has no more prices later in the period)
+2. buys the tickers whose entry signal fired, sized by the 'sizing' rule out of the cash available:
+   'equal'         = each new position gets equity / number of tickers trading on that date
+   'max_positions' = each new position gets equity / max_positions, and no more than max_positions are held at once
+   'volatility'    = the 'equal' size scaled by the median volatility of the tickers divided by the ticker's own
+                     volatility (the standard deviation of its last vol_scope daily returns), so calmer tickers get more
+   max_positions can also be used with 'equal' and 'volatility'. When there are more signals than free positions the
+   'priority' array decides which are bought first (for the tilted strategy, the furthest below the regression band)
+   If the new positions need more than the cash left, they are all scaled down by the same factor
+3. marks every position to market. Positions are held in arrays (shares, entry price, held) with one value per ticker
+
+Positions are never resized once bought, and a sell and a buy can happen on the same date (the sale is done first).
+The output has the portfolio equity, cash, exposure (invested / equity), number of positions and turnover (value
+traded / equity) at each date, and the trades, winning trades and time in market of each ticker.
+'''
+
+
+
+SIZING_RULES = ('equal', 'max_positions', 'volatility')
+
+PORTFOLIO_METRICS = ['Strat increase', 'Strat % increase', 'Max drawdown %', 'Average exposure %', 'Turnover', 'No. of trades', 'Win / Loss Ratio']
+
+
+
+# Standard deviation of the last 'scope' returns of every column, known at the close of each date
+
+def rolling_volatility(prices, scope = 20):
+    returns = pd.DataFrame(prices).pct_change(fill_method = None)
+    return returns.rolling(scope, min_periods = 2).std().to_numpy()
+
+
+
+# prices, entries, exits (and priority / volatility) are (dates x tickers) arrays. starts[j] / ends[j] are the first and
+# last date column j can be traded on
+
+def portfolio_position_loop(prices, entries, exits, starts, ends, capital = 100, sizing = 'equal', max_positions = None,
+                            priority = None, volatility = None):
+    if sizing not in SIZING_RULES:
+        raise ValueError(f"sizing must be one of {SIZING_RULES}, got {sizing}")
+    if sizing == 'max_positions' and not max_positions:
+        raise ValueError("sizing = 'max_positions' needs max_positions")
+    if sizing == 'volatility' and volatility is None:
+        raise ValueError("sizing = 'volatility' needs the volatility of every ticker")
+
+    n, k = prices.shape
+    valid = ~np.isnan(prices)
+    marks = pd.DataFrame(prices).ffill().fillna(0.0).to_numpy() # Last known price, used to value positions on missing dates
+
+    shares = np.zeros(k)
+    entry_price = np.zeros(k)
+    held = np.zeros(k, dtype = bool)
+    cash = float(capital)
+    trades, winning_trades, time_in_market = np.zeros(k, dtype = int), np.zeros(k, dtype = int), np.zeros(k, dtype = int)
+
+    equity = np.full(n, float(capital))
+    cash_curve = np.full(n, float(capital))
+    invested = np.zeros(n)
+    positions = np.zeros(n, dtype = int)
+    turnover = np.zeros(n)
+
+    first_bar = max(int(starts.min()), 1) if k else n
+    for i in range(first_bar, n):
+        price = marks[i]
+        traded = 0.0
+
+        # Sell first, so the cash can be used by today's buys. Tickers whose prices stop before the end of the period are
+        # sold on their last date, positions still open at the end are only marked to market as in strategy_template()
+        sell = held & ((exits[i] & valid[i]) | ((ends == i) & (i < n - 1)))
+        if sell.any():
+            sold = np.flatnonzero(sell)
+            proceeds = shares[sold] * price[sold]
+            cash += proceeds.sum()
+            traded += proceeds.sum()
+            winning_trades[sold] += price[sold] > entry_price[sold]
+            shares[sold] = 0.0
+            held[sold] = False
+
+        buy = entries[i] & valid[i] & ~held & (starts <= i) & (i < ends)
+        if buy.any() and cash > 0:
+            bought = np.flatnonzero(buy)
+            value = cash + shares @ price
+            free = len(bought) if max_positions is None else max_positions - int(held.sum())
+            if free < len(bought) and priority is not None:
+                bought = bought[np.argsort(-priority[i, bought], kind = 'stable')]
+            bought = bought[: max(free, 0)]
+
+            if len(bought):
+                slots = max_positions if max_positions else int(((starts <= i) & (i <= ends)).sum())
+                size = np.full(len(bought), value / slots)
+                if sizing == 'volatility':
+                    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+                        scale = np.nanmedian(volatility[i - 1]) / volatility[i - 1, bought]
+                    size *= np.where(np.isfinite(scale), scale, 1.0)
+                if size.sum() > cash:
+                    size *= cash / size.sum()
+
+                shares[bought] = size / price[bought]
+                entry_price[bought] = price[bought]
+                held[bought] = True
+                trades[bought] += 1
+                cash -= size.sum()
+                traded += size.sum()
+
+        time_in_market += held
+        invested[i] = shares @ price
+        equity[i] = cash + invested[i]
+        cash_curve[i] = cash
+        positions[i] = held.sum()
+        turnover[i] = traded / equity[i] if equity[i] else 0.0
+
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        exposure = np.where(equity != 0, invested / equity, 0.0)
+
+    return {
+        'equity' : equity,
+        'cash' : cash_curve,
+        'exposure' : exposure,
+        'positions' : positions,
+        'turnover' : turnover,
+        'no_of_trades' : trades,
+        'no_of_winning_trades' : winning_trades,
+        'time_in_market' : time_in_market,
+    }
+
+
+
+# Summary metrics of a portfolio_position_loop() result, named like strategy_template()'s
+
+def portfolio_metrics(results, capital, start = 0):
+    equity = results['equity'][start:]
+    trades = int(results['no_of_trades'].sum())
+    losing_trades = trades - int(results['no_of_winning_trades'].sum())
+    drawdown = equity / np.maximum.accumulate(equity) - 1 if len(equity) else np.zeros(1)
+
+    return {
+        'Strat increase'        : round(float(equity[-1]) if len(equity) else float(capital), 2),
+        'Strat % increase'      : round(((float(equity[-1]) if len(equity) else capital) / capital - 1) * 100, 2),
+        'Max drawdown %'        : round(float(drawdown.min()) * 100, 2),
+        'Average exposure %'    : round(float(results['exposure'][start:].mean()) * 100 if len(equity) else 0.0, 2),
+        'Turnover'              : round(float(results['turnover'][start:].sum()), 2),
+        'No. of trades'         : trades,
+        'Win / Loss Ratio'      : round((trades - losing_trades) / losing_trades, 2) if losing_trades else 0,
+    }
+
+
+
+# Runs the tilted mean reversion strategy on a (dates x tickers) price array, such as StockUniverse.values, as one
+# portfolio per period with period[2] as the starting capital. Returns a DataFrame with one row of PORTFOLIO_METRICS per
+# period, and with return_curves = True also the portfolio_position_loop() results of each period (with their dates)
+
+def portfolio_tilted_mean_reversion(prices, dates, tickers, periods, scope = 30, buy_range = 2, sell_range = 2, sizing = 'equal',
+                                    max_positions = None, vol_scope = 20, relevant_metrics = None, return_curves = False):
+    prices = np.asarray(prices, dtype = np.float64)
+    dates = pd.DatetimeIndex(dates)
+    if relevant_metrics is None:
+        relevant_metrics = PORTFOLIO_METRICS
+
+    output_data = {metric : [] for metric in relevant_metrics}
+    index_labels = [f"{start} to {end}" for start, end, _ in periods]
+    curves = {}
+    for label, (start, end, investment) in zip(index_labels, periods):
+        rows = dates.slice_indexer(start, end)
+        segment = prices[rows]
+        n = len(segment)
+
+        # Same trading window per ticker as panel_period_results()
+        valid = ~np.isnan(segment)
+        has_data = valid.any(axis = 0)
+        first = np.where(has_data, valid.argmax(axis = 0), n)
+        last = np.where(has_data, n - 1 - valid[::-1].argmax(axis = 0), -1)
+
+        regression = rolling_regression(segment, scope)
+        buy_signal, sell_signal = threshold_signals(segment, regression, buy_range = buy_range, sell_range = sell_range)
+        entries = np.zeros_like(buy_signal)
+        exits = np.zeros_like(sell_signal)
+        entries[1:] = buy_signal[:-1]
+        exits[1:] = sell_signal[:-1]
+
+        # Signals further below the regression band are bought first when positions are limited
+        priority = np.full(segment.shape, np.nan)
+        with np.errstate(invalid = 'ignore', divide = 'ignore'):
+            priority[1:] = ((regression['endpoint'] - segment) / regression['stddev'])[:-1]
+
+        volatility = rolling_volatility(segment, vol_scope) if sizing == 'volatility' else None
+        results = portfolio_position_loop(segment, entries, exits, first + scope, last, capital = investment, sizing = sizing,
+                                          max_positions = max_positions, priority = priority, volatility = volatility)
+        results['dates'] = dates[rows]
+        results['tickers'] = list(tickers)
+
+        curves[label] = results
+        metrics = portfolio_metrics(results, investment)
+        for metric in relevant_metrics:
+            output_data[metric].append(metrics[metric])
+
+    output_df = pd.DataFrame(output_data)
+    output_df.index = index_labels
+    if return_curves:
+        return output_df, curves
+    return output_df
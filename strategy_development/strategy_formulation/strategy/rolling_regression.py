@@ -0,0 +1,224 @@
+import numpy as np
+
+
+
+'''
+Vectorised version of the regression used by tilted_mean().
+
+Instead of fitting a new LinearRegression for every bar, rolling_regression() works out the slope, intercept,
+fitted endpoint and residual standard deviation of every 'scope' sized window in one pass. It does this with the
+closed form least squares solution, using prefix sums of y, i*y and y^2 (the x values 0 ... scope - 1 are the same
+for every window so their sums are constants).
+
+All output arrays have the same shape as the prices. The value at index e describes the window that ENDS at e
+(prices[e - scope + 1 : e + 1]), and the first scope - 1 entries are NaN as there is not enough data for a full window.
+A 2D array of prices is treated as one series per column. Windows that contain a NaN price are NaN.
+
+The prefix sums do not depend on the scope, so RollingStats() keeps them and can answer the regression for any number
+of scopes (e.g. the 20 to 252 scope study) while only building them once. regression(scope, start, stop) only works out
+the windows ending in rows start ... stop - 1, so many overlapping periods (e.g. walk forward folds) can share one
+RollingStats of the full history.
+
+Prefix sums over a long history get large, and a window's sums are the difference of two of them, so the rounding
+error would grow with the length of the history. The sums are therefore started again every block_size rows, with the
+prices of each block measured from the block's mean price. A window's sums are put together from the blocks it
+overlaps, which keeps the error down to that of a block of bars however long the history is (a window's results agree
+with a least squares fit of it to about 1e-11 or better on a million bars).
+'''
+
+
+
+BLOCK_SIZE = 256 # The error grows with the square of the block size, and longer scopes overlap more blocks
+
+
+
+class RollingStats():
+
+    def __init__(self, prices, block_size = BLOCK_SIZE):
+        y = np.asarray(prices, dtype = np.float64)
+        self.one_dimensional = y.ndim == 1
+        y = y[:, None] if self.one_dimensional else y # Every column is its own series, e.g. a (dates x tickers) price panel
+        self.prices = y
+        self.n = n = len(y)
+        self.block_size = B = block_size
+        self.n_blocks = n_blocks = max(-(-n // B), 1)
+
+        # Missing prices are left out of the sums, and any window containing one is set to NaN
+        missing = np.isnan(y)
+        self.has_missing = missing.any()
+
+        # The rows are split into blocks of block_size. Each block's prices are centred on the block's mean price and
+        # its prefix sums start again from 0, so no sum grows past one block of bars
+        blocks = np.full((n_blocks * B, y.shape[1]), np.nan)
+        blocks[:n] = y
+        blocks = blocks.reshape(n_blocks, B, y.shape[1])
+        present = ~np.isnan(blocks)
+        self.offsets = np.where(present, blocks, 0.0).sum(axis = 1) / np.maximum(present.sum(axis = 1), 1) # (blocks, columns)
+        y_c = np.where(present, blocks - self.offsets[:, None], 0.0)
+        j = np.arange(B, dtype = np.float64)[None, :, None] # Row number inside the block
+
+        # w_y[b * (B + 1) + j] = sum of the first j centred prices of block b (and the same for j * y and y^2)
+        zeros = np.zeros((n_blocks, 1, y.shape[1]))
+        self.w_y, self.w_jy, self.w_yy = (np.concatenate((zeros, np.cumsum(values, axis = 1)), axis = 1).reshape(n_blocks * (B + 1), y.shape[1])
+                                          for values in (y_c, j * y_c, y_c * y_c))
+        zeros = np.zeros((1, y.shape[1]))
+        self.cum_missing = np.concatenate((zeros, np.cumsum(missing, axis = 0))) if self.has_missing else None
+
+
+    # The arrays behind the regression, so they can be put in shared memory and a RollingStats rebuilt from them in
+    # another process with from_arrays() (see walk_forward.py)
+
+    def arrays(self):
+        arrays = {'prices' : self.prices, 'offsets' : self.offsets, 'w_y' : self.w_y, 'w_jy' : self.w_jy, 'w_yy' : self.w_yy}
+        if self.cum_missing is not None:
+            arrays['cum_missing'] = self.cum_missing
+        return arrays
+
+
+    @classmethod
+    def from_arrays(cls, arrays, one_dimensional = False, block_size = BLOCK_SIZE):
+        stats = cls.__new__(cls)
+        stats.one_dimensional = one_dimensional
+        stats.prices = arrays['prices']
+        stats.n = len(stats.prices)
+        stats.block_size = block_size
+        stats.offsets = arrays['offsets']
+        stats.n_blocks = len(stats.offsets)
+        stats.w_y, stats.w_jy, stats.w_yy = arrays['w_y'], arrays['w_jy'], arrays['w_yy']
+        stats.cum_missing = arrays.get('cum_missing')
+        stats.has_missing = stats.cum_missing is not None
+        return stats
+
+
+    # Sums of y, x * y and y^2 over the windows s ... s + m - 1, with x = 0 ... m - 1 counted from the start of each window
+    # and y measured from 'anchor', the offset of the block the window starts in. A window is made of the parts of the
+    # blocks it overlaps (at most (m - 1) // block_size + 2 of them). Each part's sums come from its block's prefix sums
+    # and are moved over to the window's x and y origin
+
+    def _window_sums(self, s, m):
+        B = self.block_size
+        e = s + m
+        b0 = s // B
+        anchor = self.offsets[b0]
+        sum_y, sum_xy, sum_yy = (np.zeros((len(s), self.prices.shape[1])) for _ in range(3))
+
+        for k in range((m - 1) // B + 2):
+            b = b0 + k
+            u, v = np.maximum(s, b * B), np.minimum(e, (b + 1) * B)
+            overlaps = v > u
+            if not overlaps.any():
+                break
+            b = np.where(overlaps, b, 0) # Windows that do not reach this block add nothing
+            ju, jv = np.where(overlaps, u - b * B, 0), np.where(overlaps, v - b * B, 0)
+
+            count = (jv - ju)[:, None].astype(np.float64)
+            iu, iv = b * (B + 1) + ju, b * (B + 1) + jv
+            part_y = self.w_y.take(iv, axis = 0) - self.w_y.take(iu, axis = 0)
+            part_jy = self.w_jy.take(iv, axis = 0) - self.w_jy.take(iu, axis = 0)
+            part_yy = self.w_yy.take(iv, axis = 0) - self.w_yy.take(iu, axis = 0)
+            sum_j = ((jv * (jv - 1) - ju * (ju - 1)) / 2)[:, None]
+
+            d = self.offsets[b] - anchor # y - anchor = (y - block offset) + d
+            t = (b * B - s)[:, None].astype(np.float64) # x = j + t
+            sum_y += part_y + count * d
+            sum_xy += part_jy + t * part_y + d * sum_j + t * d * count
+            sum_yy += part_yy + 2 * d * part_y + count * d * d
+
+        return sum_y, sum_xy, sum_yy, anchor
+
+
+    # The same output as rolling_regression(prices, scope), worked out from the stored prefix sums. With start / stop
+    # only the rows start ... stop - 1 are returned (windows may begin before start)
+
+    def regression(self, scope, start = 0, stop = None):
+        if scope < 2:
+            raise ValueError(f"scope must be at least 2 to fit a regression line, got {scope}")
+
+        stop = self.n if stop is None else min(stop, self.n)
+        start = min(start, stop)
+        first_end = max(start, scope - 1) # The first row that has a full window
+        slope, intercept, endpoint, stddev = (np.full((stop - start,) + self.prices.shape[1:], np.nan) for _ in range(4))
+        if stop > first_end:
+            # Window sums for every window start s
+            s = np.arange(first_end - scope + 1, stop - scope + 1)
+            sum_y, sum_xy, sum_yy, anchor = self._window_sums(s, scope)
+
+            m = scope
+            sum_x = m * (m - 1) / 2
+            sxx = m * (m * m - 1) / 12 # sum of (x - mean(x))^2
+            sxy = sum_xy - sum_x * sum_y / m
+            syy = sum_yy - sum_y * sum_y / m
+
+            w_slope = sxy / sxx
+            w_intercept = (sum_y - w_slope * sum_x) / m
+            residual_ss = np.maximum(syy - w_slope * sxy, 0)
+            w_endpoint = w_intercept + w_slope * (m - 1) # What you would expect the current price to be based off of trends
+            w_stddev = np.sqrt(residual_ss / (m - 1)) # ddof = 1, the same as pandas .std()
+
+            if self.has_missing:
+                incomplete = (self.cum_missing[s + scope] - self.cum_missing[s]) > 0
+                for array in (w_slope, w_intercept, w_endpoint, w_stddev):
+                    array[incomplete] = np.nan
+
+            slope[first_end - start:] = w_slope
+            intercept[first_end - start:] = w_intercept + anchor
+            endpoint[first_end - start:] = w_endpoint + anchor
+            stddev[first_end - start:] = w_stddev
+
+        if self.one_dimensional:
+            slope, intercept, endpoint, stddev = slope[:, 0], intercept[:, 0], endpoint[:, 0], stddev[:, 0]
+
+        return {'slope' : slope, 'intercept' : intercept, 'endpoint' : endpoint, 'stddev' : stddev}
+
+
+    # Buy / sell signals for every scope at once. Returns two boolean arrays of shape (len(scopes), *prices.shape)
+    # where buy[a, e] is tilted_mean_signals(prices, scopes[a], ...)[0][e]
+
+    def signal_cube(self, scopes, buy_range = 2, sell_range = 2):
+        prices = self.prices[:, 0] if self.one_dimensional else self.prices
+        buy = np.zeros((len(scopes),) + prices.shape, dtype = bool)
+        sell = np.zeros_like(buy)
+        for a, scope in enumerate(scopes):
+            buy[a], sell[a] = threshold_signals(prices, self.regression(int(scope)), buy_range = buy_range, sell_range = sell_range)
+        return buy, sell
+
+
+
+def rolling_regression(prices, scope):
+    return RollingStats(prices).regression(scope)
+
+
+
+# Array equivalent of calling tilted_mean() on every window. buy[e] is True when prices[e] is more than buy_range
+# standard deviations below the regression line of the window ending at e, sell[e] when it is sell_range above it.
+# prices can also be a 2D (dates x tickers) array, in which case every column gets its own signals
+
+def tilted_mean_signals(prices, scope, buy_range = 2, sell_range = 2):
+    y = np.asarray(prices, dtype = np.float64)
+    return threshold_signals(y, rolling_regression(y, scope), buy_range = buy_range, sell_range = sell_range)
+
+
+
+# A window whose prices all lie on its regression line (e.g. a forward filled gap) has a standard deviation of 0 and its
+# last price is the endpoint, so comparing them only compares rounding errors, which differ between a RollingStats of the
+# whole history, one of the period, tilted_mean() and OnlineTiltedMean. The standard deviation of a flat window comes out
+# as the square root of a rounding error, about 1e-8 of the price, so windows with a standard deviation below 1e-6 of
+# the price (far below a tick) give no signal
+
+FLAT_TOLERANCE = 1e-6
+
+
+
+# Turns the output of rolling_regression() into buy / sell signals. Computing the regression once and calling this for
+# several buy_range / sell_range values avoids repeating the regression for every pair
+
+def threshold_signals(prices, regression, buy_range = 2, sell_range = 2):
+    y = np.asarray(prices, dtype = np.float64)
+    endpoint, stddev = regression['endpoint'], regression['stddev']
+
+    with np.errstate(invalid = 'ignore'): # NaN comparisons (incomplete windows) are just False
+        trending = stddev > FLAT_TOLERANCE * np.abs(endpoint)
+        buy = (y < (endpoint - buy_range * stddev)) & trending
+        sell = (y > (endpoint + sell_range * stddev)) & trending
+
+    return buy, sell
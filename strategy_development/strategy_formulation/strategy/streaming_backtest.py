@@ -0,0 +1,165 @@
+try: # When doing analysis is strategy_analysis folder
+    from strategy_formulation.research.stock_info.backtest import trade_loop
+    from strategy_formulation.strategy.rolling_regression import RollingStats, threshold_signals
+except ImportError: # When tunning this script directly
+    from research.stock_info.backtest import trade_loop
+    from strategy.rolling_regression import RollingStats, threshold_signals
+import numpy as np
+import pandas as pd
+
+
+
+'''
+Streaming version of the tilted mean reversion backtest, for histories that are too long to load at once (e.g. years of
+minute bars opened from a PriceStore).
+
+StreamingTiltedMeanReversion() is fed the prices one chunk at a time (e.g. one trading day). Between chunks it only keeps
+the last 'scope' prices (enough for the regression window that spans the boundary), whether we hold a position, the
+price we bought at and the running totals, so memory use depends on the chunk size and not the length of the history.
+Each call to update(chunk) returns
+bars = number of bars seen so far
+start, end = first and last date (or bar number) of the chunk
+equity = the strategy's value at each bar of the chunk (0 when out of the market, like strat_array_returns)
+events = the trades made in the chunk, as {'type' : 'buy' / 'sell', 'bar', 'date', 'price'} dictionaries
+investment, position = the current value of the strategy and whether we are in the market
+
+results() gives the same dictionary as backtest(), plus 'bah_array_returns' so strategy_template() does not need the whole
+price history. With keep_equity = False (the default) strat_array_returns and bah_array_returns only hold the value at
+the end of each chunk, keep_equity = True keeps every bar.
+
+stream_backtest(chunks) wraps this in a generator that yields an update per chunk, followed by {'final' : True, 'results' : ...}.
+MeanReversion.stream_tilted_mean_reversion() does the same for a period of a stock's data.
+'''
+
+
+
+class StreamingTiltedMeanReversion():
+
+    def __init__(self, scope = 30, buy_range = 2, sell_range = 2, investment = 100, keep_equity = False):
+        if scope < 2:
+            raise ValueError(f"scope must be at least 2 to fit a regression line, got {scope}")
+        self.scope = scope
+        self.buy_range = buy_range
+        self.sell_range = sell_range
+        self.initial_investment = investment
+        self.keep_equity = keep_equity
+
+        self.tail = np.empty(0) # The last 'scope' prices of the previous chunks
+        self.bars = 0
+        self.investment = float(investment)
+        self.position = False
+        self.entry_price = 0.0
+        self.time_in_market, self.no_of_trades, self.no_of_winning_trades = 0, 0, 0
+        self.bah_growth = 1.0 # Product of every price ratio since we started buy and hold at bar 'scope'
+
+        self.equity = [] # Equity per chunk (keep_equity) or at the end of each chunk
+        self.bah = []
+
+
+    def update(self, prices, dates = None) -> dict:
+        y = np.asarray(prices, dtype = np.float64).ravel()
+        prices = np.concatenate((self.tail, y))
+        first = self.bars - len(self.tail) # Bar number of prices[0]
+        start = max(len(self.tail), self.scope - first) # First bar of 'prices' that we trade on
+        equity = np.zeros(len(y))
+        events = []
+
+        if start < len(prices):
+            # entries[i] / exits[i] use the regression line of the window that ends on the bar before i, as in tilted_mean_reversion()
+            buy_signal, sell_signal = threshold_signals(prices, RollingStats(prices).regression(self.scope), buy_range = self.buy_range, sell_range = self.sell_range)
+            entries = np.zeros(len(prices), dtype = bool)
+            exits = np.zeros(len(prices), dtype = bool)
+            entries[1:] = buy_signal[:-1]
+            exits[1:] = sell_signal[:-1]
+
+            chunk_equity, self.investment, time_in_market, trades, winning_trades, self.position, self.entry_price, buys, sells = trade_loop(
+                prices, entries, exits, start, self.investment, position = self.position, entry_price = self.entry_price)
+            equity[start - len(self.tail):] = chunk_equity
+            self.time_in_market += time_in_market
+            self.no_of_trades += trades
+            self.no_of_winning_trades += winning_trades
+
+            # Buy and hold, multiplied in the same order as buy_and_hold_curve() so the numbers match exactly
+            growth = np.cumprod(np.concatenate(([self.bah_growth], prices[start:] / prices[start - 1 : -1])))[1:]
+            self.bah_growth = float(growth[-1])
+            bah = self.initial_investment * growth
+
+            # Sells come before buys on the same bar
+            for kind, bars in (('sell', sells), ('buy', buys)):
+                for bar in bars:
+                    i = bar - len(self.tail)
+                    events.append({'type' : kind, 'bar' : first + bar, 'date' : None if dates is None else dates[i], 'price' : float(prices[bar])})
+            events.sort(key = lambda event : (event['bar'], event['type'] == 'buy'))
+
+            if self.keep_equity:
+                self.equity.append(equity[start - len(self.tail):])
+                self.bah.append(bah)
+            else:
+                self.equity.append(equity[-1])
+                self.bah.append(bah[-1])
+
+        self.tail = prices[-self.scope:].copy() # Copied so the chunk itself can be freed
+        self.bars += len(y)
+
+        return {
+            'final' : False,
+            'bars' : self.bars,
+            'start' : first + len(prices) - len(y) if dates is None or not len(y) else dates[0],
+            'end' : self.bars - 1 if dates is None or not len(y) else dates[-1],
+            'equity' : equity,
+            'events' : events,
+            'investment' : self.investment,
+            'position' : self.position,
+        }
+
+
+    def results(self) -> dict:
+        if self.keep_equity:
+            equity = np.concatenate([[0.0]] + self.equity)
+            bah = np.concatenate([[float(self.initial_investment)]] + self.bah)
+        else:
+            equity = np.array([0.0] + self.equity)
+            bah = np.array([float(self.initial_investment)] + self.bah)
+
+        return {
+            'strat_returns' : float(self.investment),
+            'strat_array_returns' : equity,
+            'time_in_market' : int(self.time_in_market),
+            'no_of_trades' : int(self.no_of_trades),
+            'no_of_winning_trades' : int(self.no_of_winning_trades),
+            'bah_array_returns' : bah,
+        }
+
+
+
+# Splits a DataFrame (or Series) into chunks of 'chunk' rows, or of a fixed length of time such as '1D' or '4h'.
+# The chunk boundaries are found by binary search so nothing is copied
+
+def iter_chunks(data, chunk = '1D'):
+    if isinstance(chunk, (int, np.integer)):
+        for i in range(0, len(data), chunk):
+            yield data.iloc[i : i + chunk]
+        return
+
+    length = pd.Timedelta(chunk)
+    index = data.index
+    i = 0
+    while i < len(index):
+        j = index.searchsorted(index[i].floor(length) + length)
+        yield data.iloc[i : j]
+        i = j
+
+
+
+# Generator that runs the streaming backtest over 'chunks' (pandas Series / single column DataFrames, or arrays of prices)
+
+def stream_backtest(chunks, scope = 30, buy_range = 2, sell_range = 2, investment = 100, keep_equity = False):
+    backtest = StreamingTiltedMeanReversion(scope, buy_range, sell_range, investment, keep_equity = keep_equity)
+    for chunk in chunks:
+        if isinstance(chunk, pd.DataFrame):
+            chunk = chunk.iloc[:, 0]
+        if isinstance(chunk, pd.Series):
+            yield backtest.update(chunk.to_numpy(dtype = np.float64), chunk.index)
+        else:
+            yield backtest.update(chunk)
+    yield {'final' : True, 'results' : backtest.results()}
@@ -1,46 +1,76 @@
 import sys
 sys.path.append('../')
+# Only one of these import paths is used. Importing stock_info under both names would give two copies of its module
+# level state (the price cache, ADF cache and profiler)
 try: # When doing analysis is strategy_analysis folder
     from strategy_formulation.research.stock_info.stock_info import StockInfo
-except:
-    pass
-try: # When tunning this script directly
+    from strategy_formulation.research.stock_info.backtest import backtest
+    from strategy_formulation.research.stock_info.instrumentation import stage
+    from strategy_formulation.research.stock_info.result_cache import cached_strategy
+    from strategy_formulation.research.stock_info.risk_metrics import TRADE_METRICS
+    from strategy_formulation.research.stock_info.plotting import PlotQueue
+    from strategy_formulation.strategy.rolling_regression import RollingStats, threshold_signals, FLAT_TOLERANCE
+    from strategy_formulation.strategy.streaming_backtest import stream_backtest, iter_chunks
+except ImportError: # When tunning this script directly
     from research.stock_info.stock_info import StockInfo
-except:
-    pass
+    from research.stock_info.backtest import backtest
+    from research.stock_info.instrumentation import stage
+    from research.stock_info.result_cache import cached_strategy
+    from research.stock_info.risk_metrics import TRADE_METRICS
+    from research.stock_info.plotting import PlotQueue
+    from strategy.rolling_regression import RollingStats, threshold_signals, FLAT_TOLERANCE
+    from strategy.streaming_backtest import stream_backtest, iter_chunks
 import numpy as np
-import yfinance as yf
-from sklearn.linear_model import LinearRegression
-import matplotlib.pyplot as plt
+import pandas as pd
 
 
 
 # Function computes a Linear Regression line to fit the data based on the previous 'scope' data points. It outputs True
-# if the current price is n below the Linear Regression line
+# if the current price is n below the Linear Regression line. The line is the closed form least squares fit from
+# RollingStats, which gives the same line as sklearn's LinearRegression
         
 def tilted_mean(data, scope, n, check = 'buy'):
-    actual_prices = data[-scope:]
-    data_points = np.arange(scope).reshape(-1,1)
-    model = LinearRegression().fit(data_points, actual_prices)
-    predicted_prices = model.predict(data_points)
-    current_predicted_price = model.predict([[scope - 1]])[0][0] # What you would expect the current price to be based off of trends
-    residuals = actual_prices - predicted_prices
-    stddev = residuals.std().iloc[0]
-    #print(type(stddev),type(current_predicted_price),type(n),type(data.iloc[-1]))
+    actual_prices = np.asarray(data[-scope:], dtype = np.float64).ravel()
+    with stage('signals', fits = 1, bars = scope):
+        regression = RollingStats(actual_prices).regression(scope)
+    current_predicted_price = regression['endpoint'][-1] # What you would expect the current price to be based off of trends
+    stddev = regression['stddev'][-1]
+    if not stddev > FLAT_TOLERANCE * abs(current_predicted_price): # A flat window gives no signal, as in threshold_signals()
+        return False
     if check == 'buy':
-        return data.iloc[-1].iloc[0] < (current_predicted_price - n * stddev)
+        return actual_prices[-1] < (current_predicted_price - n * stddev)
 
     else:
-        return data.iloc[-1].iloc[0] > (current_predicted_price + n * stddev)
+        return actual_prices[-1] > (current_predicted_price + n * stddev)
     
 
 
 
+# Bump this whenever a change to tilted_mean_reversion() changes its results, so results cached by older versions are not used
+
+TILTED_MEAN_REVERSION_VERSION = 3
+
+
+
 class MeanReversion(StockInfo):
 
-    def tilted_mean_reversion(self, period, scope = 30, buy_range = 2, sell_range = 2, graph = True, analysis = True):
+    # stats can be a RollingStats of this period's prices that has already been built (e.g. when trying many scopes)
+    # p_value = only buy when the ADF test on the last 'adf_scope' prices has a p-value below this (None = no filter).
+    # adf_lag = fixed number of lags for the ADF test, None chooses it by AIC like adfuller()
+    # execution = optional ExecutionModel of the trading costs and fills (see execution.py). opens / volumes = pandas Series
+    # of the open prices / volumes by date, needed by models that fill at the next open or cap the size by volume
+    # metrics = extra risk metrics to add to the results (see risk_metrics.py)
+    # scope and adf_scope can be a number of bars or a length of calendar time such as '6W' or '1Y' (see resample.py)
+    # Results are memoised in the stock's result cache (see result_cache.py), keyed by the prices and parameters
+
+    @cached_strategy('tilted_mean_reversion', TILTED_MEAN_REVERSION_VERSION, ignore = ('graph', 'analysis', 'stats'), durations = ('scope', 'adf_scope'),
+                     lookback = lambda arguments : arguments['adf_scope'] if arguments['p_value'] is not None else 0)
+    def tilted_mean_reversion(self, period, scope = 30, buy_range = 2, sell_range = 2, graph = True, analysis = True, stats = None,
+                              p_value = None, adf_scope = 252, adf_lag = None, execution = None, opens = None, volumes = None,
+                              metrics = None):
         period = self.default_period(period)
-        segment = self.data.loc[period[0] : period[1]]
+        segment = self.display_data(period)
+        scope, adf_scope = self.bars(scope), self.bars(adf_scope)
 
         
         '''
@@ -48,40 +78,107 @@ class MeanReversion(StockInfo):
         '''
 
         
-        investment = period[2]
-        strat_investment = [ 0 ]
-        position = False
-        time_in_market = 0
-        trades, winning_trades = 0, 0
-
-        # Loop over every data point once there is enough data to analyse previous data
-        for i in range(scope, len(segment)):
-            if position:
-                time_in_market += 1
-                perc_change = segment.iloc[i] / segment.iloc[i - 1]
-                investment *= perc_change.iloc[0] # Increase investment if we are in the market
-                strat_investment.append(investment) 
-                # If we go above n std above the linear model line => sell
-                if tilted_mean(segment.iloc[i - scope : i], scope = scope, n = sell_range, check = 'sell'):
-                    position = False
-                    if segment.iloc[i].iloc[0] > starting_point:
-                        winning_trades += 1
-            else:
-                strat_investment.append(0) # If we're not in the market, append 0 to investment amount
-                
-            if not position and tilted_mean(segment.iloc[i - scope : i], scope = scope, n = buy_range, check = 'buy'):
-                trades += 1
-                starting_point = segment.iloc[i].iloc[0]
-                position = True # if we are not in the market and the price is below 2std below the mean -> buy
-
-
-
-        results = {
-            'strat_returns' : investment,
-            'strat_array_returns' : strat_investment,
-            'time_in_market' : time_in_market,
-            'no_of_trades' : trades,
-            'no_of_winning_trades' : winning_trades
-        }
-
-        return self.strategy_template(results, period = period, scope = scope, graph = graph, analysis = analysis)
\ No newline at end of file
+        # Every regression line is worked out up front. buy_signal[i - 1] is the same as calling
+        # tilted_mean(segment.iloc[i - scope : i], ...) so the position loop only has to replay these arrays
+        prices = segment.iloc[:, 0].to_numpy(dtype = np.float64)
+        with stage('signals', self.ticker, period, bars = len(prices), fits = max(len(prices) - scope + 1, 0)):
+            if stats is None:
+                stats = RollingStats(prices)
+            buy_signal, sell_signal = threshold_signals(prices, stats.regression(scope), buy_range = buy_range, sell_range = sell_range)
+
+            # Shift the signals by one bar so entries[i] / exits[i] are the decisions made at bar i
+            entries = np.zeros(len(prices), dtype = bool)
+            exits = np.zeros(len(prices), dtype = bool)
+            entries[1:] = buy_signal[:-1]
+            exits[1:] = sell_signal[:-1]
+
+            # The ADF test is run over the whole price history (so windows can start before the period) and cached
+            if p_value is not None:
+                stationary = self.rolling_adf(adf_scope, lag = adf_lag)['pvalue'].reindex(segment.index).to_numpy() < p_value
+                entries[1:] &= stationary[:-1]
+
+        # If we go above n std above the linear model line => sell
+        # if we are not in the market and the price is below n std below the linear model line -> buy
+        with stage('position_loop', self.ticker, period, bars = max(len(prices) - scope, 0)) as position_loop:
+            if opens is not None:
+                opens = opens.reindex(segment.index).to_numpy(dtype = np.float64)
+            if volumes is not None:
+                volumes = volumes.reindex(segment.index).to_numpy(dtype = np.float64)
+            results = backtest(prices, entries, exits, start = scope, investment = period[2], execution = execution, opens = opens, volumes = volumes,
+                               trade_list = bool(metrics) and any(metric in TRADE_METRICS for metric in metrics))
+            position_loop.add(trades = results['no_of_trades'])
+
+        return self.strategy_template(results, period = period, scope = scope, graph = graph, analysis = analysis, metrics = metrics)
+
+
+
+    # Runs the strategy for every scope in 'scopes' and returns a DataFrame with one row of strategy_template() results
+    # per scope. The prefix sums behind the regression are only built once and shared by every scope. graph = True (or a
+    # PlotQueue to draw it later) plots the strategy returns of every scope on one figure
+
+    def scope_analysis(self, period, scopes = range(20, 252), buy_range = 2, sell_range = 2, graph = False):
+        period = self.default_period(period)
+        segment = self.display_data(period)
+        scopes = [self.bars(scope) for scope in scopes]
+        prices = segment.iloc[:, 0].to_numpy(dtype = np.float64)
+
+        with stage('signals', self.ticker, period, bars = len(prices) * len(scopes), fits = sum(max(len(prices) - scope + 1, 0) for scope in scopes)):
+            stats = RollingStats(prices)
+            buy_cube, sell_cube = stats.signal_cube(scopes, buy_range = buy_range, sell_range = sell_range)
+
+        output_data = {}
+        lines = []
+        for buy_signal, sell_signal, scope in zip(buy_cube, sell_cube, scopes):
+            entries = np.zeros(len(prices), dtype = bool)
+            exits = np.zeros(len(prices), dtype = bool)
+            entries[1:] = buy_signal[:-1]
+            exits[1:] = sell_signal[:-1]
+
+            with stage('position_loop', self.ticker, period, bars = max(len(prices) - scope, 0)) as position_loop:
+                results = backtest(prices, entries, exits, start = scope, investment = period[2])
+                position_loop.add(trades = results['no_of_trades'])
+            output_data[scope] = self.strategy_template(results, period = period, scope = scope, graph = False, analysis = False)
+            if graph:
+                lines.append((f"scope {scope}", results['strat_array_returns'], {'linewidth' : 0.5}))
+
+        if graph:
+            plots = graph if isinstance(graph, PlotQueue) else PlotQueue()
+            plots.add(f"Strategy returns by scope for {self.ticker}", lines, legend = len(lines) <= 10)
+            if plots is not graph:
+                plots.show()
+
+        output_df = pd.DataFrame.from_dict(output_data, orient = 'index')
+        output_df.index.name = 'scope'
+        return output_df
+
+
+
+    # Runs the strategy on the bars of every interval in 'intervals', built from the loaded prices (see resample.py) so
+    # nothing is downloaded again. scope is best given in calendar time (e.g. '5D') so it covers the same stretch of time at
+    # every interval. Returns a DataFrame with one row of strategy_template() results per interval
+
+    def timeframe_analysis(self, period, intervals = ('5m', '1h', '1d'), scope = '30D', buy_range = 2, sell_range = 2, **kwargs):
+        output_data = {}
+        for interval in intervals:
+            stock = self.at_interval(interval)
+            output_data[interval] = {'Scope (bars)' : stock.bars(scope)} | stock.tilted_mean_reversion(period, scope = scope, buy_range = buy_range, sell_range = sell_range,
+                                                                                                      graph = False, analysis = False, **kwargs)
+        output_df = pd.DataFrame.from_dict(output_data, orient = 'index')
+        output_df.index.name = 'interval'
+        return output_df
+
+
+
+    # Generator version of tilted_mean_reversion() that works through the period 'chunk' at a time (a number of bars or a
+    # length of time such as '1D'), so long intraday histories never have to be fully in memory (see streaming_backtest.py).
+    # It yields an update per chunk and finishes with {'final' : True, 'results' : ..., 'metrics' : strategy_template() output}
+
+    def stream_tilted_mean_reversion(self, period, chunk = '1D', scope = 30, buy_range = 2, sell_range = 2, keep_equity = False, graph = False, analysis = False):
+        period = self.default_period(period)
+        segment = self.display_data(period)
+        scope = self.bars(scope)
+
+        for update in stream_backtest(iter_chunks(segment, chunk), scope = scope, buy_range = buy_range, sell_range = sell_range, investment = period[2], keep_equity = keep_equity):
+            if update['final']:
+                update['metrics'] = self.strategy_template(update['results'], period = period, scope = scope, graph = graph, analysis = analysis)
+            yield update
@@ -0,0 +1,123 @@
+import os
+import sys
+import time
+import asyncio
+import pytest
+
+pytest.importorskip('alpaca.trading.client')
+from alpaca.trading.client import TradingClient
+from alpaca.trading.requests import MarketOrderRequest
+from alpaca.trading.enums import OrderSide, TimeInForce
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from order_router import OrderRouter
+from mock_broker import MockBroker
+from replay import SimulatedBroker
+
+
+
+# Runs route(router, broker) on a new event loop with an OrderRouter sending to a MockBroker over HTTP
+
+def run(route, broker_options = {}, **router_options):
+    broker = MockBroker(**broker_options)
+    client = TradingClient('key', 'secret', url_override = broker.start())
+
+    async def main():
+        router = OrderRouter(client, **({'backoff' : 0.01} | router_options))
+        broker.subscribe_trade_updates(router.on_trade_update)
+        try:
+            return await route(router, broker)
+        finally:
+            await router.close()
+    try:
+        return asyncio.run(main()), broker
+    finally:
+        broker.stop()
+
+def order(symbol = 'SPY'):
+    return MarketOrderRequest(symbol = symbol, notional = 100, side = OrderSide.BUY, time_in_force = TimeInForce.DAY)
+
+
+
+def test_errors_are_retried_with_the_same_client_order_id():
+    async def route(router, broker):
+        return await router.submit(order())
+
+    report, broker = run(route, {'errors' : [429, 503, 500]})
+    assert report['status'] == 'accepted' and report['attempts'] == 4
+    assert [status for _, _, status in broker.requests] == [429, 503, 500, 200]
+    assert {client_order_id for _, client_order_id, _ in broker.requests} == {report['client_order_id']}
+    assert list(broker.orders) == [report['client_order_id']]
+
+
+
+def test_errors_are_not_retried_forever():
+    async def route(router, broker):
+        return await router.submit_many([order()])
+
+    (result,), broker = run(route, {'errors' : [429] * 3}, max_retries = 2)
+    assert isinstance(result, Exception) and len(broker.requests) == 3 and not broker.orders
+
+
+
+def test_rate_limit_holds():
+    rate_limit, per = 5, 0.25
+
+    async def route(router, broker):
+        return await router.submit_many([order() for _ in range(20)])
+
+    reports, broker = run(route, rate_limit = rate_limit, per = per)
+    assert all(report['status'] == 'accepted' for report in reports)
+    arrivals = sorted(arrived for arrived, _, _ in broker.requests)
+
+    # A token bucket lets at most rate_limit requests through at once, then rate_limit / per a second
+    assert arrivals[-1] - arrivals[0] >= (len(arrivals) - rate_limit) * per / rate_limit * 0.9
+    for i, start in enumerate(arrivals):
+        in_window = sum(start <= arrived < start + per for arrived in arrivals[i:])
+        assert in_window <= 2 * rate_limit
+
+
+
+def test_submit_many_sends_orders_concurrently():
+    latency = 0.2
+
+    async def route(router, broker):
+        start = time.perf_counter()
+        reports = await router.submit_many([order() for _ in range(8)])
+        return reports, time.perf_counter() - start
+
+    (reports, concurrent), _ = run(route, {'latency' : latency}, max_concurrency = 8)
+    (_, one_at_a_time), _ = run(route, {'latency' : latency}, max_concurrency = 1)
+    assert all(report['status'] == 'accepted' for report in reports)
+    assert one_at_a_time >= 8 * latency
+    assert concurrent < 3 * latency
+
+
+
+def test_fills_are_reconciled_through_trade_updates():
+    async def route(router, broker):
+        orders = [order(symbol) for symbol in ('SPY', 'QQQ', 'IWM')]
+        await router.submit_many(orders)
+        return [await router.wait_for_fill(request.client_order_id, timeout = 5) for request in orders]
+
+    prices = {'SPY' : 400.0, 'QQQ' : 350.0, 'IWM' : 200.0}
+    reports, broker = run(route, {'errors' : [429, 503], 'fill_prices' : prices})
+    for report in reports:
+        assert report['status'] == 'fill'
+        assert float(report['filled_avg_price']) == prices[report['symbol']]
+        assert float(report['filled_qty']) == pytest.approx(100 / prices[report['symbol']])
+    assert len(broker.requests) == 5
+
+
+
+def test_router_turns_off_the_client_retries():
+    client = TradingClient('key', 'secret', url_override = 'http://127.0.0.1:1')
+    assert client._retry > 0
+    OrderRouter(client)
+    assert client._retry == 0
+
+
+
+def test_router_leaves_clients_without_retries_alone():
+    broker = SimulatedBroker(cash = 100)
+    OrderRouter(broker)
+    assert not hasattr(broker, '_retry')
@@ -0,0 +1,48 @@
+import os
+from types import SimpleNamespace
+import numpy as np
+import pandas as pd
+from strategy_analysis.performance.parameter_sweep import parameter_sweep, data_fingerprint
+
+
+
+GRID = {'scope' : [20, 30], 'buy_range' : [1, 2], 'sell_range' : [1]}
+
+PERIODS = [['2020-01-01', '2021-01-01', 100], ['2021-01-01', '2022-01-01', 100]]
+
+
+
+def universe(seed = 0, n = 600):
+    dates = pd.bdate_range('2019-06-03', periods = n)
+    values = 100 * np.exp(np.cumsum(np.random.default_rng(seed).normal(0, 0.015, (n, 3)), axis = 0))
+    return SimpleNamespace(values = values, dates = dates, tickers = ['A', 'B', 'C'])
+
+
+
+def test_fingerprint_changes_with_the_data():
+    assert data_fingerprint(universe()) == data_fingerprint(universe())
+    assert data_fingerprint(universe()) != data_fingerprint(universe(seed = 1))
+    shifted = universe()
+    shifted.dates = shifted.dates + pd.Timedelta(days = 1)
+    assert data_fingerprint(shifted)['sha256'] != data_fingerprint(universe())['sha256']
+
+
+
+def test_checkpoints_are_not_shared_between_different_prices(tmp_path):
+    first = parameter_sweep(universe(), GRID, PERIODS, max_workers = 1, checkpoint_dir = str(tmp_path))
+    again = parameter_sweep(universe(), GRID, PERIODS, max_workers = 1, checkpoint_dir = str(tmp_path))
+    pd.testing.assert_frame_equal(first, again)
+    assert len(os.listdir(tmp_path)) == 1
+
+    other = parameter_sweep(universe(seed = 1), GRID, PERIODS, max_workers = 1, checkpoint_dir = str(tmp_path))
+    fresh = parameter_sweep(universe(seed = 1), GRID, PERIODS, max_workers = 1)
+    assert len(os.listdir(tmp_path)) == 2
+    pd.testing.assert_frame_equal(other, fresh)
+    assert not other.equals(first)
+
+
+
+def test_process_pool_matches_this_process():
+    in_process = parameter_sweep(universe(), GRID, PERIODS, max_workers = 1)
+    pooled = parameter_sweep(universe(), GRID, PERIODS, max_workers = 2)
+    pd.testing.assert_frame_equal(pooled, in_process)
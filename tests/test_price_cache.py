@@ -0,0 +1,97 @@
+import numpy as np
+import pandas as pd
+import pytest
+from strategy_formulation.research.stock_info.price_cache import PriceCache, fixture_fetcher
+
+
+
+# A PriceCache over a fixture_fetcher that records every download, so the tests can change the "remote" prices (e.g. a
+# dividend adjusting the whole history) between loads
+
+class Remote():
+
+    def __init__(self, prices):
+        self.prices = prices
+        self.calls = []
+
+    def __call__(self, ticker, start = None, end = None, interval = '1d', adjusted = True):
+        self.calls.append((start, end))
+        return fixture_fetcher({'SPY' : self.prices})(ticker, start, end, interval, adjusted)
+
+
+
+@pytest.fixture
+def remote():
+    dates = pd.bdate_range('2018-01-01', '2022-12-30')
+    prices = pd.Series(100 * np.exp(np.cumsum(np.random.default_rng(0).normal(0, 0.01, len(dates)))), index = dates)
+    return Remote(prices)
+
+@pytest.fixture
+def cache(tmp_path, remote):
+    return PriceCache(directory = str(tmp_path), fetcher = remote)
+
+
+
+def expected(remote, start = None, end = None):
+    prices = remote.prices
+    if start is not None:
+        prices = prices[prices.index >= pd.Timestamp(start)]
+    if end is not None:
+        prices = prices[prices.index < pd.Timestamp(end)]
+    return prices
+
+
+
+def test_repeat_load_is_read_from_disk(cache, remote):
+    first = cache.load('SPY', '2020-01-01', '2021-01-01')
+    calls = len(remote.calls)
+    second = cache.load('SPY', '2020-01-01', '2021-01-01')
+    assert len(remote.calls) == calls
+    pd.testing.assert_series_equal(first, second, check_freq = False)
+
+
+
+def test_head_that_ends_before_the_cache_leaves_no_gap(cache, remote):
+    cache.load('SPY', '2020-06-01', '2021-01-01')
+    head = cache.load('SPY', '2019-01-01', '2019-06-01')
+    np.testing.assert_array_equal(head.to_numpy(), expected(remote, '2019-01-01', '2019-06-01').to_numpy())
+
+    # The cached range now runs from 2019-01-01, so the months between the two requests must be there too
+    calls = len(remote.calls)
+    whole = cache.load('SPY', '2019-01-01', '2021-01-01')
+    assert len(remote.calls) == calls
+    pd.testing.assert_index_equal(whole.index, expected(remote, '2019-01-01', '2021-01-01').index, check_names = False)
+    np.testing.assert_array_equal(whole.to_numpy(), expected(remote, '2019-01-01', '2021-01-01').to_numpy())
+
+
+
+def test_adjusted_history_change_refetches_instead_of_splicing(cache, remote):
+    cache.load('SPY', '2020-01-01', '2021-01-01')
+    remote.prices = remote.prices * np.where(remote.prices.index < pd.Timestamp('2021-03-01'), 0.98, 1.0) # Dividend on 2021-03-01
+
+    prices = cache.load('SPY', '2020-01-01', '2022-01-01')
+    np.testing.assert_allclose(prices.to_numpy(), expected(remote, '2020-01-01', '2022-01-01').to_numpy())
+    np.testing.assert_allclose(cache.load('SPY', '2020-01-01', '2021-01-01').to_numpy(), expected(remote, '2020-01-01', '2021-01-01').to_numpy())
+
+
+
+def test_adjusted_history_change_refetches_the_head(cache, remote):
+    cache.load('SPY', '2020-01-01', '2021-01-01')
+    remote.prices = remote.prices * np.where(remote.prices.index < pd.Timestamp('2021-03-01'), 0.98, 1.0)
+
+    prices = cache.load('SPY', '2019-01-01', '2020-06-01')
+    np.testing.assert_allclose(prices.to_numpy(), expected(remote, '2019-01-01', '2020-06-01').to_numpy())
+    np.testing.assert_allclose(cache.load('SPY', '2019-01-01', '2021-01-01').to_numpy(), expected(remote, '2019-01-01', '2021-01-01').to_numpy())
+
+
+
+def test_unchanged_history_only_downloads_the_tail(cache, remote):
+    cache.load('SPY', '2020-01-01', '2021-01-01')
+    last = remote.prices[remote.prices.index < pd.Timestamp('2021-01-01')].index[-1]
+    remote.prices[last] *= 1.01 # The last cached bar was incomplete when it was downloaded
+
+    calls = len(remote.calls)
+    prices = cache.load('SPY', '2020-01-01', '2022-01-01')
+    assert len(remote.calls) == calls + 1
+    assert pd.Timestamp(remote.calls[-1][0]) > pd.Timestamp('2020-12-01')
+    np.testing.assert_array_equal(prices.to_numpy(), expected(remote, '2020-01-01', '2022-01-01').to_numpy())
@@ -0,0 +1,54 @@
+import numpy as np
+import pandas as pd
+import pytest
+from strategy_formulation.research.stock_info.price_cache import PriceCache, fixture_fetcher
+from strategy_formulation.research.stock_info.price_store import PriceStore
+from strategy_formulation.research.stock_info.stock_info import StockInfo
+
+
+
+DATES = pd.bdate_range('2019-01-01', '2022-12-30')
+
+PRICES = pd.Series(100 * np.exp(np.cumsum(np.random.default_rng(0).normal(0, 0.01, len(DATES)))), index = DATES)
+
+
+
+# A price store filled through a PriceCache over fixture prices
+
+@pytest.fixture
+def cache(tmp_path):
+    return PriceCache(directory = str(tmp_path / 'cache'), fetcher = fixture_fetcher({'SPY' : PRICES}))
+
+@pytest.fixture
+def store(tmp_path):
+    return PriceStore(directory = str(tmp_path / 'store'))
+
+def expected(start, end):
+    return PRICES[(PRICES.index >= pd.Timestamp(start)) & (PRICES.index < pd.Timestamp(end))]
+
+
+
+def test_request_past_the_stored_range_tops_up_the_store(cache, store):
+    first = StockInfo('SPY', '2020-01-01', '2021-01-01', cache = cache, store = store)
+    np.testing.assert_array_equal(first.data['SPY'].to_numpy(), expected('2020-01-01', '2021-01-01').to_numpy())
+
+    later = StockInfo('SPY', '2020-01-01', '2022-01-01', cache = cache, store = store)
+    np.testing.assert_array_equal(later.data['SPY'].to_numpy(), expected('2020-01-01', '2022-01-01').to_numpy())
+    assert store.open('SPY').index[-1] == expected('2020-01-01', '2022-01-01').index[-1]
+
+
+
+def test_open_ended_request_tops_up_the_store(cache, store):
+    StockInfo('SPY', '2020-01-01', '2021-01-01', cache = cache, store = store)
+    stock = StockInfo('SPY', '2020-01-01', cache = cache, store = store)
+    assert stock.data.index[-1] == PRICES.index[-1]
+
+
+
+def test_request_inside_the_stored_range_does_not_load(cache, store, monkeypatch):
+    StockInfo('SPY', '2020-01-01', '2021-01-01', cache = cache, store = store)
+    loads = []
+    monkeypatch.setattr(cache, 'load', lambda *args, **kwargs : loads.append(args))
+    stock = StockInfo('SPY', '2020-06-01', '2020-12-01', cache = cache, store = store)
+    assert not loads
+    np.testing.assert_array_equal(stock.data['SPY'].to_numpy(), expected('2020-06-01', '2020-12-01').to_numpy())
@@ -0,0 +1,103 @@
+import os
+import sys
+import asyncio
+from types import SimpleNamespace
+import numpy as np
+import pandas as pd
+import pytest
+from strategy_formulation.strategy.rolling_regression import RollingStats, threshold_signals
+from strategy_formulation.research.stock_info.backtest import backtest, trade_loop
+
+pytest.importorskip('alpaca.trading.requests')
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from online_signal import OnlineTiltedMean
+from order_router import OrderRouter
+from handlers import live_handlers
+from replay import BarReplay, SimulatedBroker, replay_parity
+
+
+
+# Replays the stored daily bars in data/bars.csv through the live path (OnlineTiltedMean, live_handlers, OrderRouter and
+# the simulated broker) and checks that it makes exactly the trades backtest() makes on the same closes
+
+BARS = pd.read_csv(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'bars.csv'), index_col = 'Date', parse_dates = True)
+
+PARAMETERS = [(30, 2, 2), (20, 1, 1), (60, 1.5, 0.5), (10, 0, 0)]
+
+
+
+def live_fills(bars, scope, buy_range, sell_range, investment = 100):
+    broker = SimulatedBroker(cash = investment)
+    signal = OnlineTiltedMean(scope = scope, buy_range = buy_range, sell_range = sell_range)
+    replay = BarReplay({'SPY' : bars}, broker)
+
+    async def run():
+        router = OrderRouter(broker, rate_limit = 10 ** 9)
+        on_bar, trade_status = live_handlers(broker, router, signal, 'SPY', notional = None, log = None)
+        replay.subscribe_daily_bars(on_bar, 'SPY')
+        broker.subscribe_trade_updates(trade_status)
+        await replay.replay()
+        await router.close()
+    asyncio.run(run())
+
+    bar_numbers = {timestamp : i for i, timestamp in enumerate(bars.index)}
+    fills = [order for order in broker.orders.values() if order['status'] == 'filled']
+    return broker, [(order['side'], bar_numbers[order['filled_at']], float(order['filled_avg_price'])) for order in fills]
+
+
+
+def backtest_trades(closes, scope, buy_range, sell_range, investment = 100):
+    buy_signal, sell_signal = threshold_signals(closes, RollingStats(closes).regression(scope), buy_range = buy_range, sell_range = sell_range)
+    entries = np.zeros(len(closes), dtype = bool)
+    exits = np.zeros(len(closes), dtype = bool)
+    entries[1:] = buy_signal[:-1]
+    exits[1:] = sell_signal[:-1]
+    _, _, _, _, _, _, _, buys, sells = trade_loop(closes, entries, exits, scope, float(investment))
+    results = backtest(closes, entries, exits, start = scope, investment = investment, trade_list = True)
+    return results, buys, sells
+
+
+
+@pytest.mark.parametrize('scope, buy_range, sell_range', PARAMETERS)
+def test_live_trades_match_backtest(scope, buy_range, sell_range):
+    closes = BARS['Close'].to_numpy(dtype = np.float64)
+    broker, fills = live_fills(BARS, scope, buy_range, sell_range)
+    results, buys, sells = backtest_trades(closes, scope, buy_range, sell_range)
+
+    assert [bar for side, bar, _ in fills if side == 'buy'] == buys
+    assert [bar for side, bar, _ in fills if side == 'sell'] == sells
+    assert [price for _, bar, price in fills] == [closes[bar] for _, bar, _ in fills] # Filled at the close, like the backtest
+    assert len(buys) == results['no_of_trades'] > 0
+
+    # The same trades give the same returns
+    live_returns = [sell_price / buy_price - 1 for (_, _, buy_price), (_, _, sell_price) in zip(fills[::2], fills[1::2])]
+    np.testing.assert_allclose(live_returns, results['trade_returns'], rtol = 1e-9, atol = 1e-12)
+    np.testing.assert_array_equal(np.array(sells) - np.array(buys[: len(sells)]), results['holding_periods'])
+    assert broker.equity() == pytest.approx(results['strat_returns'], rel = 1e-9)
+
+
+
+@pytest.mark.parametrize('scope, buy_range, sell_range', PARAMETERS)
+def test_replay_parity(scope, buy_range, sell_range):
+    summary = replay_parity(BARS, scope = scope, buy_range = buy_range, sell_range = sell_range)
+    assert summary['parity']
+    assert summary['replay_trades'] == summary['backtest_trades']
+
+
+
+# A sell signal with no position to sell (e.g. a duplicate signal or a manual close) is skipped instead of raising
+
+def test_sell_without_a_position_is_skipped():
+    broker = SimulatedBroker(cash = 100)
+    signal = SimpleNamespace(update = lambda price : 'sell', last_latency_us = 0.0)
+    logged = []
+
+    async def run():
+        router = OrderRouter(broker, rate_limit = 10 ** 9)
+        on_bar, _ = live_handlers(broker, router, signal, 'SPY', notional = None, log = logged.append)
+        await on_bar(SimpleNamespace(symbol = 'SPY', close = 100.0))
+        await router.close()
+    asyncio.run(run())
+
+    assert not broker.orders
+    assert logged[-1] == 'No SPY position to sell, skipping the sell'
@@ -0,0 +1,33 @@
+import numpy as np
+import pandas as pd
+import pytest
+from test_parameter_sweep import universe, GRID, PERIODS
+from strategy_analysis.performance.parameter_sweep import parameter_sweep
+
+pytest.importorskip('pyarrow')
+from strategy_analysis.performance.report import generate_report, read_report, report_runs
+
+
+
+def test_report_matches_the_sweep(tmp_path):
+    run = generate_report(universe(), GRID, PERIODS, str(tmp_path), max_workers = 1)
+    report = read_report(str(tmp_path), run = run)
+    sweep = parameter_sweep(universe(), GRID, PERIODS, max_workers = 1)
+    long = sweep.melt(id_vars = ['scope', 'buy_range', 'sell_range', 'period', 'ticker'], var_name = 'metric', value_name = 'value')
+
+    columns = ['scope', 'buy_range', 'sell_range', 'period', 'ticker', 'metric']
+    merged = report.merge(long, on = columns, suffixes = ('', '_sweep'))
+    assert len(merged) == len(report) == len(long)
+    np.testing.assert_allclose(merged['value'].to_numpy(), merged['value_sweep'].astype(float).to_numpy())
+
+
+
+def test_report_run_depends_on_the_data(tmp_path):
+    first = generate_report(universe(), GRID, PERIODS, str(tmp_path), max_workers = 1)
+    assert generate_report(universe(), GRID, PERIODS, str(tmp_path), max_workers = 1) == first
+    second = generate_report(universe(seed = 1), GRID, PERIODS, str(tmp_path), max_workers = 1)
+    assert second != first
+
+    runs = report_runs(str(tmp_path)).set_index('run')
+    assert runs.loc[first, 'data'] != runs.loc[second, 'data']
+    assert not read_report(str(tmp_path), run = first)['value'].equals(read_report(str(tmp_path), run = second)['value'])
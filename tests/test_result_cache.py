@@ -0,0 +1,67 @@
+import numpy as np
+import pandas as pd
+import pytest
+from strategy_formulation.research.stock_info import result_cache
+from strategy_formulation.research.stock_info.result_cache import ResultCache
+from strategy_formulation.strategy.tilted_mean_reversion_strategy import MeanReversion
+
+
+
+PRICES = pd.Series(100 * np.exp(np.cumsum(np.random.default_rng(0).normal(0, 0.015, 600))), index = pd.bdate_range('2018-01-01', periods = 600))
+
+PERIOD = ['2018-01-01', '2020-06-01', 100]
+
+
+
+# Runs the strategy once with the stock's default result cache and returns the cache that was used
+
+def run(result_cache = None):
+    stock = MeanReversion.from_data('SPY', PRICES.to_frame('SPY'), result_cache = result_cache)
+    return stock.tilted_mean_reversion(PERIOD, scope = 30, graph = False, analysis = False)
+
+@pytest.fixture
+def default(monkeypatch):
+    monkeypatch.setattr(result_cache, 'default_result_cache', ResultCache(enabled = False))
+    return result_cache
+
+
+
+def test_default_cache_is_off_until_enabled(default, tmp_path):
+    path = tmp_path / 'results.sqlite'
+    run()
+    assert not path.exists() and default.default_result_cache.misses == 0
+
+    with default.caching(path = str(path)) as cache:
+        first, second = run(), run()
+        assert (cache.hits, cache.misses) == (1, 1)
+        assert first == second
+    assert path.exists() and not default.default_result_cache.enabled
+
+    cache = default.enable(path = str(path))
+    run()
+    assert cache.hits == 1
+    default.disable()
+    run()
+    assert cache.hits == 1
+
+
+
+def test_put_keeps_a_running_size_instead_of_summing(tmp_path):
+    cache = ResultCache(path = str(tmp_path / 'results.sqlite'), max_bytes = 10 ** 9)
+    statements = []
+    cache._db().set_trace_callback(statements.append)
+
+    for i in range(50):
+        cache.put(f'key {i % 20}', np.zeros(i + 1)) # Every key is replaced after the first 20
+    assert sum('SUM(size)' in statement for statement in statements) == 1
+    assert cache._size == cache.size()
+
+
+
+def test_eviction_keeps_the_size_under_max_bytes(tmp_path):
+    cache = ResultCache(path = str(tmp_path / 'results.sqlite'), max_bytes = 20000)
+    for i in range(100):
+        cache.put(f'key {i}', np.zeros(100))
+        assert cache.size() <= 20000
+        assert cache._size == cache.size()
+    assert cache.get('key 99')[0] and not cache.get('key 0')[0]
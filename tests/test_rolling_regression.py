@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+from strategy_formulation.strategy.rolling_regression import RollingStats, rolling_regression
+
+
+
+# The closed form regression has to give the same line and residual standard deviation as fitting sklearn's
+# LinearRegression to each window, as tilted_mean() used to, however long the history is
+
+LinearRegression = pytest.importorskip('sklearn.linear_model').LinearRegression
+
+
+
+def trending_prices(n, seed = 0):
+    rng = np.random.default_rng(seed)
+    return 100 * np.exp(np.cumsum(rng.normal(20 / n, 0.01, n)))
+
+
+
+def sklearn_fit(window):
+    m = len(window)
+    x = np.arange(m).reshape(-1, 1)
+    model = LinearRegression().fit(x, window)
+    residuals = window - model.predict(x)
+    return model.coef_[0], model.intercept_, model.predict([[m - 1]])[0], np.sqrt(residuals @ residuals / (m - 1))
+
+
+
+@pytest.mark.parametrize('n', [1_000, 100_000, 1_000_000])
+@pytest.mark.parametrize('scope', [10, 30, 252])
+def test_matches_sklearn_on_long_histories(n, scope):
+    prices = trending_prices(n)
+    regression = rolling_regression(prices, scope)
+    ends = np.random.default_rng(1).integers(scope - 1, n, 50)
+    for e in np.r_[scope - 1, ends, n - 1]:
+        slope, intercept, endpoint, stddev = sklearn_fit(prices[e - scope + 1 : e + 1])
+        assert regression['slope'][e] == pytest.approx(slope, rel = 1e-7, abs = 1e-9 * endpoint)
+        assert regression['intercept'][e] == pytest.approx(intercept, rel = 1e-10)
+        assert regression['endpoint'][e] == pytest.approx(endpoint, rel = 1e-10)
+        assert regression['stddev'][e] == pytest.approx(stddev, rel = 1e-8)
+
+
+
+def test_first_windows_are_nan():
+    regression = rolling_regression(trending_prices(100), 30)
+    for array in regression.values():
+        assert np.isnan(array[:29]).all() and not np.isnan(array[29:]).any()
+
+
+
+def test_windows_with_missing_prices_are_nan():
+    prices = trending_prices(2_000)
+    prices[700] = np.nan
+    stats = RollingStats(prices, block_size = 64)
+    stddev = stats.regression(30)['stddev']
+    assert np.isnan(stddev[700 : 730]).all()
+    assert not np.isnan(stddev[730:]).any() and not np.isnan(stddev[29 : 700]).any()
+    assert stddev[1000] == pytest.approx(sklearn_fit(prices[971 : 1001])[3], rel = 1e-8)
+
+
+
+def test_columns_are_separate_series():
+    panel = np.column_stack([trending_prices(3_000, seed) for seed in range(3)])
+    regression = rolling_regression(panel, 50)
+    for column in range(3):
+        single = rolling_regression(panel[:, column], 50)
+        np.testing.assert_allclose(regression['stddev'][:, column], single['stddev'], rtol = 1e-10)
+
+
+
+@pytest.mark.parametrize('block_size', [1, 7, 256])
+def test_scopes_longer_than_a_block(block_size):
+    prices = trending_prices(5_000)
+    stats = RollingStats(prices, block_size = block_size)
+    for scope in (3, 300, 1_000):
+        regression = stats.regression(scope)
+        for e in (scope - 1, 2_345, 4_999):
+            assert regression['stddev'][e] == pytest.approx(sklearn_fit(prices[e - scope + 1 : e + 1])[3], rel = 1e-8)
@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+from strategy_formulation.strategy.rolling_regression import RollingStats, rolling_regression, tilted_mean_signals
+
+
+
+# One RollingStats of the full history is shared by every scope (scope_analysis) and every fold (walk_forward), so its
+# windows have to agree with a RollingStats built from just the window's period, wherever the period sits in the history
+
+def long_panel(n = 200_000, columns = 3, seed = 0):
+    rng = np.random.default_rng(seed)
+    return 100 * np.exp(np.cumsum(rng.normal(10 / n, 0.01, (n, columns)), axis = 0))
+
+
+
+@pytest.mark.parametrize('scope', [10, 30, 252])
+def test_shared_rows_match_the_period_alone(scope):
+    prices = long_panel()
+    shared = RollingStats(prices)
+    for start, stop in ((0, 5_000), (123_457, 131_000), (len(prices) - 3_000, len(prices))):
+        # The period's own RollingStats only sees prices from the first window of the rows onwards
+        first = max(start - scope + 1, 0)
+        alone = RollingStats(prices[first : stop]).regression(scope)
+        rows = shared.regression(scope, start, stop)
+        for key in ('slope', 'intercept', 'endpoint', 'stddev'):
+            expected = alone[key][start - first:]
+            np.testing.assert_allclose(rows[key], expected, rtol = 1e-9, atol = 1e-10 * np.nanmax(np.abs(prices)))
+
+
+
+def test_signal_cube_matches_each_scope():
+    prices = long_panel(50_000, 1)[:, 0]
+    scopes = [20, 45, 252]
+    buy, sell = RollingStats(prices).signal_cube(scopes, buy_range = 1.5, sell_range = 1)
+    for a, scope in enumerate(scopes):
+        expected_buy, expected_sell = tilted_mean_signals(prices, scope, buy_range = 1.5, sell_range = 1)
+        np.testing.assert_array_equal(buy[a], expected_buy)
+        np.testing.assert_array_equal(sell[a], expected_sell)
+
+
+
+def test_rebuilt_from_arrays():
+    prices = long_panel(20_000)
+    prices[5_000 : 5_010, 1] = np.nan
+    stats = RollingStats(prices, block_size = 100)
+    copy = RollingStats.from_arrays({name : array.copy() for name, array in stats.arrays().items()}, one_dimensional = False, block_size = 100)
+    for key, array in stats.regression(60, 4_000, 9_000).items():
+        np.testing.assert_array_equal(copy.regression(60, 4_000, 9_000)[key], array)
+    np.testing.assert_allclose(rolling_regression(prices, 60)['stddev'][4_000 : 9_000], stats.regression(60, 4_000, 9_000)['stddev'], rtol = 1e-9)
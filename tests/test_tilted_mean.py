@@ -0,0 +1,70 @@
+import os
+import sys
+import numpy as np
+import pytest
+from strategy_formulation.strategy.rolling_regression import RollingStats, threshold_signals, tilted_mean_signals
+from strategy_formulation.strategy.tilted_mean_reversion_strategy import tilted_mean
+
+
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from online_signal import OnlineTiltedMean
+
+
+
+# A window whose prices all lie on its regression line (a flat stretch, e.g. a trading halt, or a straight line) gives no
+# signal. Otherwise only rounding errors separate the price from the band, and tilted_mean(), the vectorised signals
+# and OnlineTiltedMean would each decide differently
+
+FLAT = list(range(229, 260)) + list(range(429, 460)) # Windows of 30 bars inside the flat stretch and the straight line
+
+def prices_with_flat_stretch(n = 600, seed = 0):
+    rng = np.random.default_rng(seed)
+    prices = 100 * np.exp(np.cumsum(rng.normal(0, 0.02, n)))
+    prices[200 : 260] = prices[199] # Flat
+    prices[400 : 460] = prices[399] + 0.0137 * np.arange(60) # A straight line
+    return prices
+
+
+
+@pytest.mark.parametrize('buy_range, sell_range', [(2, 2), (1, 0.5), (0, 0)])
+def test_matches_vectorised_signals(buy_range, sell_range):
+    prices = prices_with_flat_stretch()
+    scope = 30
+    buy, sell = tilted_mean_signals(prices, scope, buy_range = buy_range, sell_range = sell_range)
+    for e in range(scope - 1, len(prices)):
+        window = prices[: e + 1]
+        assert tilted_mean(window, scope, buy_range, check = 'buy') == buy[e]
+        assert tilted_mean(window, scope, sell_range, check = 'sell') == sell[e]
+
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_flat_windows_give_no_signal(seed):
+    prices = prices_with_flat_stretch(seed = seed)
+    for e in FLAT:
+        assert not tilted_mean(prices[: e + 1], 30, 0, check = 'buy')
+        assert not tilted_mean(prices[: e + 1], 30, 0, check = 'sell')
+
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_flat_windows_give_no_vectorised_signal(seed):
+    prices = prices_with_flat_stretch(seed = seed)
+    for start in (0, 150, 380): # The whole history and periods starting at different bars, as walk_forward and the panel do
+        buy, sell = threshold_signals(prices[start:], RollingStats(prices[start:]).regression(30), buy_range = 0, sell_range = 0)
+        flat = [e - start for e in FLAT if e - start >= 29]
+        assert not buy[flat].any() and not sell[flat].any()
+
+
+
+@pytest.mark.parametrize('seed', range(20))
+@pytest.mark.parametrize('position', [False, True])
+def test_flat_windows_give_no_live_signal(seed, position):
+    prices = prices_with_flat_stretch(seed = seed)
+    signal = OnlineTiltedMean(scope = 30, buy_range = 0, sell_range = 0)
+    for e, price in enumerate(prices[: FLAT[-1] + 1]):
+        signal.position = position
+        decision = signal.update(price)
+        if e in FLAT:
+            assert decision is None, e
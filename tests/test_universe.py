@@ -0,0 +1,109 @@
+import numpy as np
+import pandas as pd
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+from strategy_formulation.research.stock_info import price_cache
+from strategy_formulation.research.stock_info.price_cache import PriceCache, fixture_fetcher
+from strategy_formulation.research.stock_info.universe import StockUniverse, cached_panel_fetcher
+from strategy_formulation.research.stock_info.risk_metrics import RISK_METRICS
+from strategy_formulation.strategy.panel_backtest import panel_tilted_mean_reversion, TEMPLATE_METRICS
+from strategy_formulation.strategy.tilted_mean_reversion_strategy import MeanReversion
+
+
+
+# A universe of tickers with different calendars: B has a trading halt and a few missing days, C starts trading later
+
+DATES = pd.bdate_range('2015-01-01', periods = 1200)
+
+def ticker_prices(seed, dates):
+    return pd.Series(100 * np.exp(np.cumsum(np.random.default_rng(seed).normal(0, 0.015, len(dates)))), index = dates)
+
+FIXTURES = {
+    'A' : ticker_prices(0, DATES),
+    'B' : ticker_prices(1, DATES.delete(list(range(400, 420)) + [700, 701, 900])),
+    'C' : ticker_prices(2, DATES[300:]),
+}
+
+PERIOD = ['2015-01-01', '2020-01-01', 100]
+
+METRICS = TEMPLATE_METRICS + ['Sharpe ratio', 'Max drawdown %']
+
+
+
+@pytest.fixture
+def universe(tmp_path, monkeypatch):
+    monkeypatch.setattr(price_cache, 'default_cache', PriceCache(directory = str(tmp_path), fetcher = fixture_fetcher(FIXTURES)))
+    return StockUniverse(['A', 'B', 'C'])
+
+
+
+def test_missing_dates_are_not_filled(universe):
+    b = universe.ticker_index['B']
+    assert np.isnan(universe.values[DATES.get_indexer(DATES[400:420]), b]).all()
+    assert universe.valid.sum(axis = 0).tolist() == [len(FIXTURES[ticker]) for ticker in 'ABC']
+    assert np.isnan(universe.values).sum() == (~universe.valid).sum()
+
+
+
+def test_stock_has_only_its_own_dates(universe):
+    for ticker in 'ABC':
+        data = universe.stock(ticker).data
+        pd.testing.assert_index_equal(data.index, FIXTURES[ticker].index, check_names = False)
+        np.testing.assert_array_equal(data.iloc[:, 0].to_numpy(), FIXTURES[ticker].to_numpy())
+
+
+
+def test_default_fetcher_loads_through_the_price_cache(universe):
+    assert len(price_cache.default_cache._entries()) == 3
+
+
+
+@pytest.mark.parametrize('scope, buy_range, sell_range', [(30, 2, 2), (20, 1, 0.5)])
+def test_panel_matches_each_ticker_on_its_own(universe, scope, buy_range, sell_range):
+    panel = panel_tilted_mean_reversion(universe.values, universe.dates, universe.tickers, [PERIOD], scope = scope, buy_range = buy_range, sell_range = sell_range,
+                                        relevant_metrics = METRICS)
+    for ticker in 'ABC':
+        stock = MeanReversion.from_data(ticker, FIXTURES[ticker].to_frame(ticker), result_cache = False)
+        single = stock.tilted_mean_reversion(PERIOD, scope = scope, buy_range = buy_range, sell_range = sell_range, graph = False, analysis = False,
+                                             metrics = [metric for metric in METRICS if metric in RISK_METRICS])
+        for metric in METRICS:
+            assert panel[(ticker, metric)].iloc[0] == pytest.approx(single[metric], abs = 0.011), (ticker, metric)
+
+
+
+# The tickers of a chunk that are not cached yet are downloaded in one request and cached, the rest are read from disk
+
+def test_uncached_tickers_are_downloaded_together(universe, tmp_path):
+    requests = []
+    def panel_fetcher(tickers, start = None, end = None, interval = '1d', adjusted = True):
+        requests.append(list(tickers))
+        return pd.DataFrame({ticker : FIXTURES[ticker] for ticker in tickers})
+
+    cache = PriceCache(directory = str(tmp_path / 'bulk'), fetcher = fixture_fetcher(FIXTURES))
+    cache.load('A')
+    bulk = StockUniverse(['A', 'B', 'C'], fetcher = cached_panel_fetcher(cache, panel_fetcher = panel_fetcher))
+    assert requests == [['B', 'C']]
+    assert all(cache.has(ticker) for ticker in 'ABC')
+    np.testing.assert_array_equal(bulk.values, universe.values)
+
+    StockUniverse(['A', 'B', 'C'], fetcher = cached_panel_fetcher(cache, panel_fetcher = panel_fetcher))
+    assert requests == [['B', 'C']]
+
+
+
+# Loading on many threads while every write evicts the other tickers never fails to read a file another thread removed
+
+def test_eviction_while_loading_on_threads(tmp_path):
+    fixtures = {f"T{i}" : ticker_prices(i, DATES[: 200]) for i in range(16)}
+    cache = PriceCache(directory = str(tmp_path), max_bytes = 1, fetcher = fixture_fetcher(fixtures))
+    errors = []
+    def load(ticker):
+        for end in DATES[100 : 200 : 5]:
+            try:
+                prices = cache.load(ticker, end = end)
+                assert len(prices) == DATES[: 200].get_loc(end)
+            except Exception as e:
+                errors.append(e)
+    with ThreadPoolExecutor(max_workers = 16) as pool:
+        list(pool.map(load, fixtures))
+    assert not errors